@@ -31,6 +31,17 @@ __all__ = [
 from proxy import get_proxy
 from auth import Endpoint, Auth, get_auth
 from helpers import DataUsage, Metadata
+from budget import MemoryBudget, get_memory_budget
+from cfobject import NotModified
+from cffile import CloudFileReader, CloudFileWriter
+from cfinventory import Inventory
+from cfsnapshot import Snapshot, open_snapshot, write_snapshot
+from cfbulk import BulkDeleteResult, BulkUploadResult
+from bloom import BloomFilter, load_bloom_filter, bloom_filter_from_listing
+from cache import MetadataCache, NegativeCache, ListingCache
+from contentcache import ContentCache
+from prefetch import Prefetcher
+from requests.listing import split_points_from_sample
 
 UK_ENDPOINT = Endpoint.UK
 US_ENDPOINT = Endpoint.US
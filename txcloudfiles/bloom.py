@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+    Copyright 2012 Joe Harris
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+'''
+
+'''
+
+    Bloom filters answer "is this object definitely not in the container"
+    locally. A session can hold one per container, they are filled from a
+    listing and then kept up to date by the objects this library creates and
+    deletes.
+
+'''
+
+import os
+from math import ceil, log
+from hashlib import md5
+from collections import OrderedDict
+from struct import Struct, error as StructError
+from helpers import parse_int
+from errors import CloudFilesException
+from txcloudfiles.cfcontainer import name_key
+
+MAGIC = 'TXCFBLOM'
+VERSION = 1
+# magic, version, bits, hashes, capacity, count, error rate, deleted names
+HEADER = Struct('<8sIQIQQdQ')
+HASHES = Struct('<QQ')
+NAME_LENGTH = Struct('<I')
+# bits set in each byte value
+POPCOUNT = ''.join(chr(bin(i).count('1')) for i in xrange(256))
+
+class BloomFilter(object):
+    '''
+        A Bloom filter sized for capacity names at the given false positive
+        rate. Bits can not be cleared so deleted names are kept in a set
+        which is checked first, and dropped from it if they are added again.
+        Only the most recent max_deleted names are kept, older ones are
+        forgotten and reported as present again, which costs a request but
+        is never wrong. Rebuild the filter from a listing once many have
+        been forgotten.
+
+        The number of names is estimated from the bits which are set, so
+        names whose bits all collide with earlier ones are still counted.
+    '''
+
+    # false positive rate used when none is given
+    ERROR_RATE = 0.01
+    # deleted names remembered before the oldest is forgotten
+    MAX_DELETED = 10000
+
+    def __init__(self, capacity, error_rate=ERROR_RATE, max_deleted=MAX_DELETED):
+        capacity = max(parse_int(capacity), 1)
+        error_rate = min(max(float(error_rate), 0.000001), 0.5)
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._size = int(ceil(-capacity * log(error_rate) / (log(2) ** 2)))
+        self._hashes = max(int(round(self._size / float(capacity) * log(2))), 1)
+        self._bits = bytearray((self._size + 7) // 8)
+        self._set = 0
+        self._max_deleted = max(parse_int(max_deleted), 0)
+        self._deleted = OrderedDict()
+        self._forgotten = 0
+        self._checks = 0
+        self._misses = 0
+
+    def __repr__(self):
+        d = (self.__class__.__name__, len(self), self._capacity, self._error_rate, hex(id(self)))
+        return '<CloudFiles %s object (%s of %s names at %s) at %s>' % d
+
+    def __len__(self):
+        '''
+            The estimated number of distinct names added.
+        '''
+        # every bit set gives an infinite estimate, one short of that is
+        # already far beyond capacity
+        filled = min(self._set, self._size - 1) / float(self._size)
+        return int(round(-self._size / float(self._hashes) * log(1 - filled)))
+
+    def _positions(self, key):
+        h1, h2 = HASHES.unpack(md5(key).digest())
+        size = self._size
+        return [(h1 + i * h2) % size for i in xrange(self._hashes)]
+
+    def add(self, name):
+        key = name_key(name)
+        self._deleted.pop(key, None)
+        bits = self._bits
+        for p in self._positions(key):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                bits[p >> 3] |= 1 << (p & 7)
+                self._set += 1
+
+    def update(self, names):
+        for name in names:
+            self.add(name)
+
+    def discard(self, name):
+        '''
+            Marks name as deleted, it will be reported missing until it is
+            added again or forgotten.
+        '''
+        key = name_key(name)
+        self._deleted.pop(key, None)
+        self._deleted[key] = True
+        while len(self._deleted) > self._max_deleted:
+            self._deleted.popitem(last=False)
+            self._forgotten += 1
+
+    def might_contain(self, name):
+        '''
+            Returns False if name was definitely never added or has been
+            deleted since.
+        '''
+        self._checks += 1
+        key = name_key(name)
+        if key in self._deleted:
+            self._misses += 1
+            return False
+        bits = self._bits
+        for p in self._positions(key):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                self._misses += 1
+                return False
+        return True
+
+    def __contains__(self, name):
+        return self.might_contain(name)
+
+    def get_capacity(self):
+        return self._capacity
+
+    def get_error_rate(self):
+        return self._error_rate
+
+    def get_estimated_error_rate(self):
+        '''
+            The false positive rate at the bits currently set, which rises
+            above the configured rate once capacity is exceeded.
+        '''
+        return (self._set / float(self._size)) ** self._hashes
+
+    def get_forgotten_count(self):
+        '''
+            Deleted names forgotten to keep within max_deleted.
+        '''
+        return self._forgotten
+
+    def get_stats(self):
+        return {
+            'count': len(self),
+            'deleted': len(self._deleted),
+            'forgotten': self._forgotten,
+            'capacity': self._capacity,
+            'bits': self._size,
+            'hashes': self._hashes,
+            'error_rate': self._error_rate,
+            'estimated_error_rate': self.get_estimated_error_rate(),
+            'checks': self._checks,
+            'definite_misses': self._misses,
+        }
+
+    def save(self, path):
+        '''
+            Writes the filter to path, replacing any existing file atomically.
+        '''
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        f = open(tmp, 'wb')
+        try:
+            f.write(HEADER.pack(MAGIC, VERSION, self._size, self._hashes, self._capacity, len(self), self._error_rate, len(self._deleted)))
+            f.write(self._bits)
+            for name in self._deleted:
+                f.write(NAME_LENGTH.pack(len(name)))
+                f.write(name)
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            os.rename(tmp, path)
+        except:
+            f.close()
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+def load_bloom_filter(path, max_deleted=BloomFilter.MAX_DELETED):
+    '''
+        Reads a filter written by BloomFilter.save().
+    '''
+    try:
+        f = open(path, 'rb')
+        try:
+            magic, version, size, hashes, capacity, count, error_rate, deleted = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise CloudFilesException('failed to load bloom filter %s, not a bloom filter' % path)
+            bits = bytearray(f.read((size + 7) // 8))
+            names = []
+            for n in xrange(deleted):
+                length = NAME_LENGTH.unpack(f.read(NAME_LENGTH.size))[0]
+                names.append(f.read(length))
+        finally:
+            f.close()
+    except (IOError, StructError), e:
+        raise CloudFilesException('failed to load bloom filter %s: %s' % (path, e))
+    if len(bits) != (size + 7) // 8:
+        raise CloudFilesException('failed to load bloom filter %s, truncated' % path)
+    bloom = BloomFilter(capacity, error_rate, max_deleted)
+    bloom._size = size
+    bloom._hashes = hashes
+    bloom._bits = bits
+    bloom._set = sum(bytearray(str(bits).translate(POPCOUNT)))
+    for name in names:
+        bloom._deleted[name] = True
+    while len(bloom._deleted) > bloom._max_deleted:
+        bloom._deleted.popitem(last=False)
+        bloom._forgotten += 1
+    return bloom
+
+def bloom_filter_from_listing(listing, error_rate=BloomFilter.ERROR_RATE, growth=2):
+    '''
+        Returns a BloomFilter() holding the names in a Container(), Inventory()
+        or Snapshot(), sized for growth times as many names.
+    '''
+    bloom = BloomFilter(len(listing) * max(growth, 1), error_rate)
+    if hasattr(listing, 'get_name_at'):
+        for i in xrange(len(listing)):
+            bloom.add(listing.get_name_at(i))
+    else:
+        for obj in listing:
+            bloom.add(obj.get_name())
+    return bloom
+
+'''
+
+    EOF
+
+'''
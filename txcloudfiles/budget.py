@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+    Copyright 2012 Joe Harris
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+'''
+
+'''
+
+    A memory budget limits the total number of bytes of request and response
+    bodies buffered in memory at any one time across every session in the
+    process. Transfers which do not fit in the budget wait until enough of it
+    has been released. Downloads of an unknown length cannot wait for their
+    whole body up front, they hold what the budget has left and buffer the
+    rest over it, which is counted in get_stats().
+
+'''
+
+from collections import deque
+from twisted.internet.defer import Deferred, succeed
+from txcloudfiles.helpers import parse_int
+
+class MemoryBudget(object):
+    '''
+        A process-wide limit on buffered body bytes. Reservations are granted
+        in the order they were requested. A reservation larger than the whole
+        budget is granted once nothing else holds any of the budget so a
+        single large transfer can never wait forever.
+    '''
+
+    # 256MB of buffered bodies by default, 0 disables the limit
+    DEFAULT_LIMIT = 256*1024*1024
+
+    def __init__(self, limit=DEFAULT_LIMIT):
+        self._limit = max(parse_int(limit), 0)
+        self._used = 0
+        self._peak = 0
+        self._waiting = deque()
+        self._waiting_bytes = 0
+        self._granted = 0
+        self._delayed = 0
+        self._exceeded = 0
+
+    def __repr__(self):
+        d = (self.__class__.__name__, self._used, self._limit, len(self._waiting), hex(id(self)))
+        return '<CloudFiles %s object (%s of %s bytes, %s waiting) at %s>' % d
+
+    def _fits(self, length):
+        if self._limit == 0 or self._used == 0:
+            return True
+        return self._used + length <= self._limit
+
+    def _grant(self, length):
+        self._used += length
+        self._granted += 1
+        if self._used > self._peak:
+            self._peak = self._used
+
+    def _wake(self):
+        while self._waiting:
+            length, d = self._waiting[0]
+            if not self._fits(length):
+                break
+            self._waiting.popleft()
+            self._waiting_bytes -= length
+            self._grant(length)
+            d.callback(length)
+
+    def _cancel(self, d):
+        for waiter in self._waiting:
+            if waiter[1] is d:
+                self._waiting.remove(waiter)
+                self._waiting_bytes -= waiter[0]
+                break
+        self._wake()
+
+    def set_limit(self, limit):
+        self._limit = max(parse_int(limit), 0)
+        self._wake()
+
+    def try_reserve(self, length):
+        '''
+            Reserves length bytes only if they are available right now without
+            jumping the queue, returns boolean True if they were reserved.
+        '''
+        length = parse_int(length)
+        if self._waiting or not self._fits(length):
+            return False
+        self._grant(length)
+        return True
+
+    def reserve(self, length):
+        '''
+            Returns a deferred which fires with the reserved length once length
+            bytes of the budget are available. Cancelling the deferred gives up
+            the place in the queue.
+        '''
+        length = parse_int(length)
+        if self.try_reserve(length):
+            return succeed(length)
+        self._delayed += 1
+        d = Deferred(self._cancel)
+        self._waiting.append((length, d))
+        self._waiting_bytes += length
+        return d
+
+    def release(self, length):
+        self._used = max(self._used - parse_int(length), 0)
+        self._wake()
+
+    def exceeded(self):
+        '''
+            Called by transfers of an unknown length which had to buffer more
+            than the budget had available.
+        '''
+        self._exceeded += 1
+
+    def get_limit(self):
+        return self._limit
+
+    def get_usage(self):
+        return self._used
+
+    def get_available(self):
+        if self._limit == 0:
+            return -1
+        return max(self._limit - self._used, 0)
+
+    def get_peak_usage(self):
+        return self._peak
+
+    def get_waiting(self):
+        return len(self._waiting)
+
+    def get_waiting_bytes(self):
+        return self._waiting_bytes
+
+    def get_stats(self):
+        return {
+            'limit': self._limit,
+            'used': self._used,
+            'peak': self._peak,
+            'waiting': len(self._waiting),
+            'waiting_bytes': self._waiting_bytes,
+            'granted': self._granted,
+            'delayed': self._delayed,
+            'exceeded': self._exceeded,
+        }
+
+_memory_budget = MemoryBudget()
+
+def get_memory_budget():
+    '''
+        Returns the process-wide MemoryBudget() shared by all sessions.
+    '''
+    return _memory_budget
+
+'''
+
+    EOF
+
+'''
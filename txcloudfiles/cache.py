@@ -0,0 +1,561 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+    Copyright 2012 Joe Harris
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+'''
+
+'''
+
+    A metadata cache serves repeated account, container and object HEAD
+    requests from memory. Once set on a session the request wrappers read
+    through it and the session's own writes invalidate the entries they make
+    stale. A negative cache does the same for objects which were not found,
+    and a listing cache for object listings.
+
+    Caches can also serve entries for a while after they expire, refreshing
+    them with a single background request, so callers never wait on Cloud
+    Files for something they have seen recently.
+
+    A request takes a token from the cache before it is sent and passes it
+    back when it stores what it got. If the entry was invalidated while the
+    request was in flight the result is dropped instead of putting the
+    stale value back.
+
+'''
+
+from time import time
+from collections import OrderedDict
+from twisted.internet.defer import succeed
+from txcloudfiles.helpers import parse_int, parse_str, parse_url_str
+from txcloudfiles.cfcontainer import name_key
+
+ACCOUNT = 'account'
+CONTAINER = 'container'
+OBJECT = 'object'
+LISTING = 'listing'
+NAME = 'name'
+
+def _container_name(container):
+    # containers store their names quoted
+    return container.get_name() if hasattr(container, 'get_name') else parse_url_str(container)
+
+def account_key():
+    return (ACCOUNT,)
+
+def container_key(container):
+    return (CONTAINER, container.get_name())
+
+def object_key(container, obj):
+    return (OBJECT, container.get_name(), obj.get_name())
+
+def listing_key(container, prefix=None, path=None, delimiter=None, marker=None, limit=None):
+    return (LISTING, container.get_name(), prefix, path, delimiter, marker, limit)
+
+def read_through(cache, key, fetch):
+    '''
+        Returns a deferred firing with the value cached for key, calling
+        fetch(None) for it on a miss. A stale value is returned at once and
+        fetch(stale) is called in the background to refresh it, unless a
+        refresh of key is already running. fetch() stores what it gets in the
+        cache and may use the stale value to make a conditional request. If
+        the refresh fails the stale value is served until it is too old.
+    '''
+    if cache is None:
+        return fetch(None)
+    cached, fresh = cache.lookup(key)
+    if cached is None:
+        return fetch(None)
+    if not fresh and cache.begin_revalidation(key):
+        d = fetch(cached)
+        d.addCallbacks(lambda _: cache.end_revalidation(key), lambda f: cache.end_revalidation(key, f))
+    return succeed(cached)
+
+class Invalidations(object):
+    '''
+        Remembers when keys were last invalidated, counted in invalidations,
+        for the most recent size keys. Keys which have been forgotten are
+        taken to have been invalidated as late as the last one forgotten.
+    '''
+
+    # keys remembered before the oldest is forgotten
+    SIZE = 10000
+
+    def __init__(self, size=SIZE):
+        self._size = max(parse_int(size), 1)
+        self._clock = 0
+        self._floor = 0
+        self._keys = OrderedDict()
+
+    def get_token(self):
+        return self._clock
+
+    def invalidate(self, key):
+        self._clock += 1
+        self._keys.pop(key, None)
+        self._keys[key] = self._clock
+        while len(self._keys) > self._size:
+            self._floor = self._keys.popitem(last=False)[1]
+
+    def clear(self):
+        self._clock += 1
+        self._floor = self._clock
+        self._keys.clear()
+
+    def changed(self, key, token):
+        '''
+            Returns boolean True if key was invalidated after token was taken.
+        '''
+        return token is not None and self._keys.get(key, self._floor) > token
+
+    def since(self, token):
+        '''
+            Returns the keys invalidated after token was taken, most recent
+            first.
+        '''
+        keys = []
+        for key in reversed(self._keys):
+            if self._keys[key] <= token:
+                break
+            keys.append(key)
+        return keys
+
+    def forgotten(self, token):
+        return self._floor > token
+
+class MetadataCache(object):
+    '''
+        An LRU cache of (response, result) tuples keyed by account, container
+        or object, each kind with its own TTL in seconds. A TTL of 0 disables
+        caching of that kind. With a stale bound, entries are served for up to
+        that many seconds after they expire while they are refreshed in the
+        background.
+    '''
+
+    # entries held before the least recently used is evicted
+    SIZE = 10000
+    # seconds entries of each kind are served from the cache
+    TTLS = {
+        ACCOUNT: 60,
+        CONTAINER: 60,
+        OBJECT: 300,
+    }
+
+    def __init__(self, size=SIZE, ttls=None, stale=0):
+        self._size = max(parse_int(size), 1)
+        self._ttls = dict(self.TTLS)
+        self._ttls.update(ttls or {})
+        self._stale = max(parse_int(stale), 0)
+        self._entries = OrderedDict()
+        self._invalidated = Invalidations(self._size)
+        self._revalidating = set()
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+        self._revalidations = 0
+        self._revalidation_errors = 0
+        self._dropped = 0
+
+    def __repr__(self):
+        d = (self.__class__.__name__, len(self._entries), self._size, hex(id(self)))
+        return '<CloudFiles %s object (%s of %s entries) at %s>' % d
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, key):
+        '''
+            Returns a (value, fresh) tuple for key. The value is None if it is
+            missing or expired beyond the stale bound.
+        '''
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self._misses += 1
+            return None, False
+        expires, value = entry
+        now = time()
+        if expires + self._stale <= now:
+            self._forget(key)
+            self._expirations += 1
+            self._misses += 1
+            return None, False
+        # re-insert to mark it as the most recently used
+        self._entries[key] = entry
+        if expires <= now:
+            self._stale_hits += 1
+            return value, False
+        self._hits += 1
+        return value, True
+
+    def get(self, key):
+        '''
+            Returns the cached value for key or None if it is missing or has
+            expired.
+        '''
+        value, fresh = self.lookup(key)
+        return value if fresh else None
+
+    def begin_revalidation(self, key):
+        '''
+            Returns boolean True if the caller should refresh key, False if
+            a refresh is already running.
+        '''
+        if key in self._revalidating:
+            return False
+        self._revalidating.add(key)
+        self._revalidations += 1
+        return True
+
+    def end_revalidation(self, key, failure=None):
+        self._revalidating.discard(key)
+        if failure is not None:
+            self._revalidation_errors += 1
+
+    def get_token(self):
+        '''
+            Returns a token to pass to set() with the result of a request
+            which is about to be made.
+        '''
+        return self._invalidated.get_token()
+
+    def _changed(self, key, token):
+        # the key itself, or every key of its kind in a container
+        return self._invalidated.changed(key, token) or self._invalidated.changed(key[:2], token)
+
+    def set(self, key, value, token=None):
+        '''
+            Caches value for key, unless key was invalidated after token was
+            taken.
+        '''
+        ttl = self._ttls.get(key[0], 0)
+        if ttl <= 0:
+            return
+        if self._changed(key, token):
+            self._dropped += 1
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = (time() + ttl, value)
+        while len(self._entries) > self._size:
+            self._forget(self._entries.popitem(last=False)[0])
+            self._evictions += 1
+
+    def _forget(self, key):
+        '''
+            Called when key leaves the cache, for subclasses which keep more
+            state per entry.
+        '''
+
+    def invalidate(self, key):
+        self._invalidated.invalidate(key)
+        if self._entries.pop(key, None) is not None:
+            self._forget(key)
+            self._invalidations += 1
+
+    def invalidate_object(self, container, obj):
+        '''
+            Drops an object and the usage totals of its container and the
+            account, called when the object is written or deleted.
+        '''
+        self.invalidate(object_key(container, obj))
+        self.invalidate(container_key(container))
+        self.invalidate(account_key())
+
+    def _invalidate_kind(self, kind, name):
+        self._invalidated.invalidate((kind, name))
+        for key in [k for k in self._entries if k[0] == kind and k[1] == name]:
+            self.invalidate(key)
+
+    def invalidate_container(self, container, objects=False):
+        '''
+            Drops a container and the account totals, and every object in the
+            container as well if objects is set.
+        '''
+        self.invalidate(container_key(container))
+        self.invalidate(account_key())
+        if objects:
+            self._invalidate_kind(OBJECT, container.get_name())
+
+    def clear(self):
+        for key in self._entries.keys():
+            self._forget(key)
+        self._entries.clear()
+        self._invalidated.clear()
+
+    def set_ttl(self, kind, ttl):
+        self._ttls[kind] = max(parse_int(ttl), 0)
+
+    def get_ttl(self, kind):
+        return self._ttls.get(kind, 0)
+
+    def set_stale(self, stale):
+        self._stale = max(parse_int(stale), 0)
+
+    def get_stale(self):
+        return self._stale
+
+    def get_size(self):
+        return self._size
+
+    def get_hit_rate(self):
+        lookups = self._hits + self._stale_hits + self._misses
+        return (self._hits + self._stale_hits) / float(lookups) if lookups else 0.0
+
+    def get_stats(self):
+        return {
+            'entries': len(self._entries),
+            'size': self._size,
+            'hits': self._hits,
+            'stale_hits': self._stale_hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+            'expirations': self._expirations,
+            'invalidations': self._invalidations,
+            'revalidations': self._revalidations,
+            'revalidation_errors': self._revalidation_errors,
+            'dropped': self._dropped,
+        }
+
+class ListingCache(MetadataCache):
+    '''
+        An LRU cache of object listings keyed by container, prefix, path,
+        delimiter, marker and limit. Each listing remembers the range of names
+        it covers so an object written or deleted through the session only
+        drops the listings it could have appeared in, every other listing of
+        the container is still served. With a stale bound, listings are served
+        for up to that many seconds after they expire while they are listed
+        again in the background. Hits and misses are also counted per
+        container.
+    '''
+
+    # listings held before the least recently used is evicted
+    SIZE = 1000
+    # seconds listings are served from the cache
+    TTL = 5
+
+    def __init__(self, size=SIZE, ttl=TTL, stale=0):
+        MetadataCache.__init__(self, size, {LISTING: ttl}, stale)
+        # listing key -> last name in the listing if it was truncated
+        self._bounds = {}
+        # container name -> [hits, misses]
+        self._containers = {}
+
+    def lookup(self, key):
+        value, fresh = MetadataCache.lookup(self, key)
+        counts = self._containers.setdefault(key[1], [0, 0])
+        counts[0 if value is not None else 1] += 1
+        return value, fresh
+
+    def set(self, key, value, last=None, token=None):
+        '''
+            Caches a listing, last is the name of its final entry if the
+            listing stopped at its limit and more names may follow.
+        '''
+        if self._written(key, last, token):
+            self._dropped += 1
+            return
+        MetadataCache.set(self, key, value, token)
+        if key in self._entries:
+            self._bounds[key] = last
+
+    def _written(self, key, last, token):
+        '''
+            Returns boolean True if a name the listing for key covers was
+            written or deleted after token was taken.
+        '''
+        if token is None:
+            return False
+        if self._invalidated.forgotten(token):
+            return True
+        for k in self._invalidated.since(token):
+            if k[0] == NAME and k[1] == key[1] and self._covers(key, k[2], last):
+                return True
+        return False
+
+    def _forget(self, key):
+        self._bounds.pop(key, None)
+
+    def _covers(self, key, name, last=None):
+        '''
+            Returns boolean True if name falls in the range of names the
+            listing for key was made over, up to last if the listing was
+            truncated.
+        '''
+        prefix, path, delimiter, marker = key[2:6]
+        if prefix and not name.startswith(name_key(prefix)):
+            return False
+        if path is not None:
+            path = name_key(path).rstrip('/')
+            if path and not name.startswith(path + '/'):
+                return False
+        if marker and name <= name_key(marker):
+            return False
+        if last is not None:
+            if delimiter and last.endswith(parse_str(delimiter)[:1]):
+                # a pseudo-directory stands in for every name under it
+                last += '\xff'
+            if name > last:
+                return False
+        return True
+
+    def invalidate_name(self, container, name):
+        '''
+            Drops the listings of container which name falls within, called
+            when an object is written or deleted.
+        '''
+        container, name = _container_name(container), name_key(name)
+        self._invalidated.invalidate((NAME, container, name))
+        for key in [k for k in self._entries if k[1] == container and self._covers(k, name, self._bounds.get(k, None))]:
+            self.invalidate(key)
+
+    def invalidate_container(self, container):
+        self._invalidate_kind(LISTING, _container_name(container))
+
+    def set_ttl(self, ttl):
+        MetadataCache.set_ttl(self, LISTING, ttl)
+
+    def get_ttl(self):
+        return MetadataCache.get_ttl(self, LISTING)
+
+    def get_hit_rate(self, container=None):
+        '''
+            Returns the hit rate of a single container, or of every container
+            if none is given.
+        '''
+        if container is None:
+            return MetadataCache.get_hit_rate(self)
+        hits, misses = self._containers.get(_container_name(container), (0, 0))
+        return hits / float(hits + misses) if hits + misses else 0.0
+
+    def get_container_stats(self):
+        '''
+            Returns a dict of container name to its hits, misses and hit rate.
+        '''
+        stats = {}
+        for name, (hits, misses) in self._containers.items():
+            stats[name] = {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / float(hits + misses) if hits + misses else 0.0,
+            }
+        return stats
+
+class NegativeCache(object):
+    '''
+        Remembers objects which returned a 404 for a short TTL so repeated
+        lookups fail without a request. TTLs can be set per container, a TTL
+        of 0 disables the cache for that container. The oldest entry is
+        evicted once size entries are held.
+    '''
+
+    # entries held before the oldest is evicted
+    SIZE = 10000
+    # seconds a 404 is remembered for
+    TTL = 5
+
+    def __init__(self, size=SIZE, ttl=TTL):
+        self._size = max(parse_int(size), 1)
+        self._ttl = max(parse_int(ttl), 0)
+        self._container_ttls = {}
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def __repr__(self):
+        d = (self.__class__.__name__, len(self._entries), self._size, hex(id(self)))
+        return '<CloudFiles %s object (%s of %s entries) at %s>' % d
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, container, obj):
+        '''
+            Records that obj was not found in container.
+        '''
+        ttl = self.get_ttl(container)
+        if ttl <= 0:
+            return
+        key = (container.get_name(), obj.get_name())
+        self._entries.pop(key, None)
+        self._entries[key] = time() + ttl
+        while len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def missing(self, container, obj):
+        '''
+            Returns boolean True if obj is known not to be in container.
+        '''
+        key = (container.get_name(), obj.get_name())
+        expires = self._entries.get(key, None)
+        if expires is None:
+            self._misses += 1
+            return False
+        if expires <= time():
+            del self._entries[key]
+            self._expirations += 1
+            self._misses += 1
+            return False
+        self._hits += 1
+        return True
+
+    def discard(self, container, obj):
+        if self._entries.pop((container.get_name(), obj.get_name()), None) is not None:
+            self._invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def set_ttl(self, ttl, container=None):
+        '''
+            Sets the TTL for a single container, or the default TTL if no
+            container is given.
+        '''
+        if container is None:
+            self._ttl = max(parse_int(ttl), 0)
+        else:
+            self._container_ttls[_container_name(container)] = max(parse_int(ttl), 0)
+
+    def get_ttl(self, container=None):
+        if container is None:
+            return self._ttl
+        return self._container_ttls.get(_container_name(container), self._ttl)
+
+    def get_size(self):
+        return self._size
+
+    def get_stats(self):
+        return {
+            'entries': len(self._entries),
+            'size': self._size,
+            'ttl': self._ttl,
+            'hits': self._hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+            'expirations': self._expirations,
+            'invalidations': self._invalidations,
+        }
+
+'''
+
+    EOF
+
+'''
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+    Copyright 2012 Joe Harris
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+'''
+
+'''
+
+    Results of bulk operations which act on many objects at once.
+
+'''
+
+from time import time
+
+class BulkResult(object):
+    '''
+        Request counts and timing shared by the results of bulk operations.
+    '''
+
+    def __init__(self):
+        self.failed = []
+        self._requests = 0
+        self._retries = 0
+        self._started = time()
+        self._finished = None
+
+    def __len__(self):
+        return len(self.failed)
+
+    def _finish(self):
+        self._finished = time()
+
+    def is_complete(self):
+        '''
+            Returns boolean True if no object failed.
+        '''
+        return len(self.failed) == 0
+
+    def get_request_count(self):
+        return self._requests
+
+    def get_retry_count(self):
+        return self._retries
+
+    def get_elapsed(self):
+        return (self._finished or time()) - self._started
+
+    def get_throughput(self):
+        '''
+            Objects dealt with per second.
+        '''
+        elapsed = self.get_elapsed()
+        return len(self) / elapsed if elapsed > 0 else 0.0
+
+class BulkDeleteResult(BulkResult):
+    '''
+        The outcome of delete_objects(). Objects are (container name, object
+        name) tuples with UTF-8 encoded object names. failed holds
+        (container name, object name, status) tuples where status is the HTTP
+        status of the last attempt, or 0 if it never got a response. The bulk
+        delete middleware only counts the objects it deleted and did not find,
+        so the objects of a batch which had some of each are listed as
+        unresolved, none of them exist any more.
+    '''
+
+    def __init__(self):
+        BulkResult.__init__(self)
+        self.deleted = []
+        self.not_found = []
+        self.unresolved = []
+        self.bulk = True
+
+    def __repr__(self):
+        d = (self.__class__.__name__, len(self.deleted), len(self.not_found), len(self.unresolved), len(self.failed), hex(id(self)))
+        return '<CloudFiles %s object (%s deleted, %s not found, %s unresolved, %s failed) at %s>' % d
+
+    def __len__(self):
+        return len(self.deleted) + len(self.not_found) + len(self.unresolved) + len(self.failed)
+
+class BulkUploadResult(BulkResult):
+    '''
+        The outcome of upload_files(). created holds the UTF-8 encoded names
+        of the objects created, failed holds (object name, status) tuples
+        where status is the HTTP status of the last attempt.
+    '''
+
+    def __init__(self):
+        BulkResult.__init__(self)
+        self.created = []
+        self._archives = 0
+        self._bytes = 0
+
+    def __repr__(self):
+        d = (self.__class__.__name__, len(self.created), len(self.failed), self._archives, hex(id(self)))
+        return '<CloudFiles %s object (%s created, %s failed in %s archives) at %s>' % d
+
+    def __len__(self):
+        return len(self.created) + len(self.failed)
+
+    def get_archive_count(self):
+        return self._archives
+
+    def get_bytes(self):
+        '''
+            Bytes of the files which were created.
+        '''
+        return self._bytes
+
+    def get_byte_throughput(self):
+        elapsed = self.get_elapsed()
+        return self._bytes / elapsed if elapsed > 0 else 0.0
+
+'''
+
+    EOF
+
+'''
@@ -26,20 +26,155 @@
 
 '''
 
-from helpers import parse_int, parse_url_str, DataUsage
+from bisect import bisect_left
+from helpers import parse_int, parse_str, parse_url_str, DataUsage
 from txcloudfiles.cfobject import Object
 
-class ContainerSet(object):
+def name_key(name):
+    '''
+        Names are compared as UTF-8 strings, the order listings are sorted in.
+    '''
+    if hasattr(name, 'get_name'):
+        name = name.get_name()
+    return name.encode('utf-8') if type(name) == unicode else parse_str(name)
+
+class NameIndex(object):
+    '''
+        Name lookups over a list of entries. The index is only built when a
+        lookup is made and then extended with entries added since, so adding
+        pages costs nothing extra. Listings arrive in name order which makes
+        range queries a bisect, entries added out of order are sorted once on
+        the next range query. Subclasses pass in the list they keep their
+        entries in.
+    '''
+    
+    __slots__ = ('_entries', '_keys', '_positions', '_unsorted', '_order')
+    
+    def __init__(self, entries):
+        self._entries = entries
+        self._keys = []
+        self._positions = {}
+        self._unsorted = False
+        self._order = None
+    
+    def _get_key(self, name):
+        '''
+            Returns the key name is stored under for range queries.
+        '''
+        return name_key(name)
+    
+    def _get_keys(self, name):
+        return (name_key(name),)
+    
+    def _update_index(self):
+        entries = self._entries
+        keys = self._keys
+        if len(keys) == len(entries):
+            return
+        positions = self._positions
+        for i in xrange(len(keys), len(entries)):
+            key = name_key(entries[i].get_name())
+            if keys and key < keys[-1]:
+                self._unsorted = True
+            keys.append(key)
+            positions.setdefault(key, i)
+        self._order = None
+    
+    def _get_order(self):
+        '''
+            Returns the sorted keys and their positions, or None for the
+            positions if the entries are already in name order.
+        '''
+        self._update_index()
+        if not self._unsorted:
+            return self._keys, None
+        if self._order is None:
+            order = sorted(xrange(len(self._keys)), key=self._keys.__getitem__)
+            self._order = ([self._keys[i] for i in order], order)
+        return self._order
+    
+    def index(self, name):
+        '''
+            Returns the position of the entry called name or -1.
+        '''
+        self._update_index()
+        for key in self._get_keys(name):
+            i = self._positions.get(key)
+            if i is not None:
+                return i
+        return -1
+    
+    def by_name(self, name):
+        '''
+            Returns the entry called name or None.
+        '''
+        i = self.index(name)
+        return self._entries[i] if i >= 0 else None
+    
+    def __contains__(self, name):
+        return self.index(name) >= 0
+    
+    def _key_range(self, start, end):
+        keys, order = self._get_order()
+        lo = bisect_left(keys, start) if start else 0
+        hi = bisect_left(keys, end) if end else len(keys)
+        entries = self._entries
+        if order is None:
+            return entries[lo:hi]
+        return [entries[order[i]] for i in xrange(lo, hi)]
+    
+    def name_range(self, start=None, end=None):
+        '''
+            Returns the entries with names from start (inclusive) up to end
+            (exclusive) in name order.
+        '''
+        return self._key_range(self._get_key(start) if start else None, self._get_key(end) if end else None)
+    
+    def prefix_range(self, prefix):
+        '''
+            Returns the entries with names starting with prefix in name order.
+        '''
+        if not prefix:
+            return self._key_range(None, None)
+        # 0xff never appears in UTF-8 or quoted names so it sorts after every
+        # name with prefix
+        key = self._get_key(prefix)
+        return self._key_range(key, key + '\xff')
+
+class ContainerSet(NameIndex):
     '''
         An iterable of Container objects.
     '''
     
+    __slots__ = ('_containers', '_requests')
+    
     def __init__(self):
         self._containers = []
         self._requests = 0
+        NameIndex.__init__(self, self._containers)
     
-    def add_containers(self, containers):
+    def _get_key(self, name):
+        # container names are stored quoted
+        return parse_url_str(name_key(name))
+    
+    def _get_keys(self, name):
+        return (name_key(name), name_key(parse_url_str(name)))
+    
+    def add_request(self):
+        '''
+            Counts a listing request whose containers were added with
+            extend_containers() as they were decoded.
+        '''
         self._requests += 1
+    
+    def add_containers(self, containers):
+        self.add_request()
+        self.extend_containers(containers)
+    
+    def extend_containers(self, containers):
+        '''
+            Adds more containers from the same listing request.
+        '''
         for container_data in containers:
             container = Container(container_data.get('name', ''))
             container.set_object_count(parse_int(container_data.get('count', 0)))
@@ -53,6 +188,13 @@ class ContainerSet(object):
             if container.is_valid():
                 self._containers.append(container)
     
+    def merge(self, containerset):
+        '''
+            Appends the containers of another ContainerSet().
+        '''
+        self._requests += containerset.get_request_count()
+        self._containers.extend(containerset)
+    
     def __repr__(self):
         return '<CloudFiles %s object (%s containers) at %s>' % (self.__class__.__name__, len(self._containers), hex(id(self)))
     
@@ -74,17 +216,35 @@ class ContainerSet(object):
             return self._containers[-1]
         return None
 
-class Container(object):
+class Container(NameIndex):
     '''
-        A representation of a Cloud Files container.
+        A representation of a Cloud Files container. Uses __slots__ like
+        Object() as every page of a listing creates one.
     '''
     
+    __slots__ = (
+        '_objects',
+        '_subdirs',
+        '_requests',
+        '_name',
+        '_object_count',
+        '_bytes',
+        '_metadata',
+        '_cdn',
+        '_logging',
+        '_ttl',
+        '_cdn_uri',
+        '_ssl_uri',
+        '_stream_uri',
+    )
+    
     def __init__(self, name=''):
         self._objects = []
+        self._subdirs = []
         self._requests = 0
         self._name = parse_url_str(name)
         self._object_count = 0
-        self._bytes = None
+        self._bytes = 0
         self._metadata = {}
         self._cdn = False
         self._logging = False
@@ -92,19 +252,19 @@ class Container(object):
         self._cdn_uri = ''
         self._ssl_uri = ''
         self._stream_uri = ''
+        NameIndex.__init__(self, self._objects)
     
     def __repr__(self):
         _state = 'public' if self._cdn else 'private'
         _id = hex(id(self))
-        _b = int(self._bytes.b) if self._bytes else 0
-        d = (self.__class__.__name__, self._name, self._object_count, _b, _state, _id)
+        d = (self.__class__.__name__, self._name, self._object_count, self._bytes, _state, _id)
         return '<CloudFiles %s object (%s: %s objects, %s bytes, %s) at %s>' % d
     
     def set_object_count(self, object_count):
         self._object_count = int(object_count)
     
     def set_bytes(self, bytes):
-        self._bytes = DataUsage(bytes)
+        self._bytes = parse_int(bytes)
     
     def set_metadata(self, metadata):
         self._metadata = metadata
@@ -127,16 +287,40 @@ class Container(object):
     def set_stream_uri(self, uri):
         self._stream_uri = str(uri)
     
-    def add_objects(self, objects):
+    def add_request(self):
+        '''
+            Counts a listing request whose objects were added with
+            extend_objects() as they were decoded.
+        '''
         self._requests += 1
+    
+    def add_objects(self, objects):
+        self.add_request()
+        self.extend_objects(objects)
+    
+    def extend_objects(self, objects):
+        '''
+            Adds more objects from the same listing request.
+        '''
         for object_data in objects:
+            if 'subdir' in object_data:
+                self._subdirs.append(object_data['subdir'])
+                continue
             obj = Object(object_data.get('name', ''))
             obj.set_hash(object_data.get('hash', ''))
             obj.set_bytes(object_data.get('bytes', 0))
             obj.set_content_type(object_data.get('content_type', ''))
             obj.set_last_modified(object_data.get('last_modified', ''))
             if obj.is_valid():
-                self._objects.appbytesend(obj)
+                self._objects.append(obj)
+    
+    def merge(self, container):
+        '''
+            Appends the objects and pseudo-directories of another listing.
+        '''
+        self._requests += container.get_request_count()
+        self._objects.extend(container)
+        self._subdirs.extend(container.get_subdirs())
     
     def __iter__(self):
         for o in self._objects:
@@ -160,6 +344,12 @@ class Container(object):
     def get_metadata(self):
         return self._metadata
     
+    def get_object_count(self):
+        return self._object_count
+    
+    def get_bytes(self):
+        return DataUsage(self._bytes)
+    
     def get_cdn(self):
         return self._cdn
     
@@ -188,6 +378,13 @@ class Container(object):
         if len(self._objects) > 0:
             return self._objects[-1]
         return None
+    
+    def get_subdirs(self):
+        '''
+            Pseudo-directories returned in place of objects by a listing made
+            with a delimiter.
+        '''
+        return self._subdirs
 
 '''
 
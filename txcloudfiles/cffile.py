@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+    Copyright 2012 Joe Harris
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+'''
+
+'''
+
+    File-like interfaces to Cloud Files objects. Methods which need to talk to
+    Cloud Files return deferreds, everything else behaves like a normal file.
+
+'''
+
+from time import time
+from hashlib import md5
+from collections import OrderedDict
+from twisted.internet.defer import Deferred, FirstError, succeed, fail, gatherResults
+from txcloudfiles.helpers import parse_int, parse_content_range
+from txcloudfiles.cfcontainer import Container
+from txcloudfiles.cfobject import Object
+from txcloudfiles.errors import CreateRequestException, FileClosedException, ObjectChangedException
+
+class CloudFileReader(object):
+    '''
+        A seekable read-only file over a Cloud Files object. Data is fetched
+        with Range requests aligned to BLOCK_SIZE and kept in a LRU cache of
+        blocks. When reads are sequential the next blocks are fetched in the
+        background before they are asked for.
+    '''
+
+    SEEK_SET = 0
+    SEEK_CUR = 1
+    SEEK_END = 2
+    # bytes per Range request and cached block
+    BLOCK_SIZE = 256*1024
+    # number of blocks kept in the cache
+    CACHE_BLOCKS = 64
+    # number of blocks to fetch ahead once reads are sequential
+    READAHEAD_BLOCKS = 4
+    # sequential reads needed before readahead starts
+    READAHEAD_TRIGGER = 2
+
+    def __init__(self, session, container=None, obj=None, block_size=BLOCK_SIZE, cache_blocks=CACHE_BLOCKS, readahead=READAHEAD_BLOCKS):
+        if type(container) == str or type(container) == unicode:
+            container = Container(name=container)
+        if not isinstance(container, Container):
+            raise CreateRequestException('second argument must be a Container() instance or a string')
+        if type(obj) == str or type(obj) == unicode:
+            obj = Object(name=obj)
+        if not isinstance(obj, Object):
+            raise CreateRequestException('third argument must be an Object() instance or a string')
+        self._session = session
+        self._container = container
+        self._object = obj
+        self._block_size = max(parse_int(block_size), 1)
+        self._cache_blocks = max(parse_int(cache_blocks), 1)
+        self._readahead = max(parse_int(readahead), 0)
+        self._blocks = OrderedDict()
+        self._inflight = {}
+        self._size = -1
+        self._etag = ''
+        self._pos = 0
+        self._last_end = -1
+        self._sequential = 0
+        self._closed = False
+        self._requests = 0
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def __repr__(self):
+        d = (self.__class__.__name__, self._container.get_name(), self._object.get_name(), self._pos, self._size, hex(id(self)))
+        return '<CloudFiles %s object (%s/%s at %s of %s bytes) at %s>' % d
+
+    def _check_open(self):
+        if self._closed:
+            raise FileClosedException('I/O operation on a closed file')
+
+    def _set_size(self, r):
+        etag = r.headers.get('Etag', '')
+        if self._etag and etag and etag != self._etag:
+            raise ObjectChangedException('object changed while being read (%s != %s)' % (etag, self._etag))
+        if not self._etag:
+            self._etag = etag
+        if r.status_code == r.HTTP_PARTIAL_CONTENT:
+            start, end, total = parse_content_range(r.headers.get('Content-Range', ''))
+            if total >= 0:
+                self._size = total
+        elif self._size < 0:
+            self._size = len(r.body)
+
+    def _cache(self, i, data):
+        self._blocks[i] = data
+        while len(self._blocks) > self._cache_blocks:
+            self._blocks.popitem(last=False)
+
+    def _cached(self, i):
+        data = self._blocks.pop(i, None)
+        if data is not None:
+            self._blocks[i] = data
+        return data
+
+    def _fetch(self, first, last):
+        '''
+            Fetches blocks first to last inclusive in a single Range request.
+        '''
+        offset = first * self._block_size
+        length = (last - first + 1) * self._block_size
+        if self._size >= 0:
+            length = min(length, self._size - offset)
+        waiters = {}
+        for i in range(first, last + 1):
+            waiters[i] = []
+            self._inflight[i] = waiters[i]
+        def _got(result):
+            r, obj = result
+            self._requests += 1
+            self._set_size(r)
+            data = obj.get_data()
+            if r.status_code != r.HTTP_PARTIAL_CONTENT:
+                data = data[offset:offset + length]
+            self._bytes += len(data)
+            for i in range(first, last + 1):
+                start = (i - first) * self._block_size
+                block = data[start:start + self._block_size]
+                self._inflight.pop(i, None)
+                self._cache(i, block)
+                for d in waiters[i]:
+                    d.callback(block)
+        def _failed(e):
+            for i in range(first, last + 1):
+                self._inflight.pop(i, None)
+                for d in waiters[i]:
+                    d.errback(e)
+        d = self._session.retrieve_object(self._container, self._object, offset, length)
+        d.addCallback(_got).addErrback(_failed)
+
+    def _get_blocks(self, first, last):
+        '''
+            Returns a deferred firing with a list of the blocks first to last,
+            contiguous blocks missing from the cache share a single request.
+        '''
+        blocks, missing = [], []
+        for i in range(first, last + 1):
+            data = self._cached(i)
+            if data is not None:
+                self._hits += 1
+                blocks.append(succeed(data))
+                continue
+            self._misses += 1
+            if i not in self._inflight:
+                if missing and missing[-1][1] == i - 1:
+                    missing[-1][1] = i
+                else:
+                    missing.append([i, i])
+            blocks.append(None)
+        for run in missing:
+            self._fetch(run[0], run[1])
+        for n, i in enumerate(range(first, last + 1)):
+            if blocks[n] is None:
+                d = Deferred()
+                self._inflight[i].append(d)
+                blocks[n] = d
+        d = gatherResults(blocks, consumeErrors=True)
+        return d.addErrback(lambda f: f.value.subFailure if f.check(FirstError) else f)
+
+    def _prefetch(self, after):
+        '''
+            Fetches up to the readahead window of blocks following after.
+        '''
+        if not self._readahead or self._size < 0:
+            return
+        last_block = (self._size - 1) // self._block_size
+        first = after + 1
+        last = min(after + self._readahead, last_block)
+        run = None
+        for i in range(first, last + 1):
+            if i in self._blocks or i in self._inflight:
+                if run:
+                    self._fetch(run[0], run[1])
+                run = None
+            elif run:
+                run[1] = i
+            else:
+                run = [i, i]
+        if run:
+            self._fetch(run[0], run[1])
+
+    def _read(self, size):
+        if self._size >= 0:
+            if self._pos >= self._size:
+                return succeed('')
+            if size < 0 or self._pos + size > self._size:
+                size = self._size - self._pos
+        elif size < 0:
+            # the object size is unknown until the first request returns
+            d = self._get_blocks(self._pos // self._block_size, self._pos // self._block_size)
+            return d.addCallback(lambda _: self._read(size))
+        if size == 0:
+            return succeed('')
+        start, end = self._pos, self._pos + size
+        first, last = start // self._block_size, (end - 1) // self._block_size
+        if start == self._last_end:
+            self._sequential += 1
+        else:
+            self._sequential = 0
+        self._last_end = end
+        self._pos = end
+        d = self._get_blocks(first, last)
+        def _join(blocks):
+            data = ''.join(blocks)
+            skip = start - first * self._block_size
+            data = data[skip:skip + size]
+            # a reader with an unknown size can be positioned past the end
+            self._pos = start + len(data)
+            if self._sequential >= self.READAHEAD_TRIGGER:
+                self._prefetch(last)
+            return data
+        return d.addCallback(_join)
+
+    def open(self):
+        '''
+            Returns a deferred which fires with this reader once the size and
+            ETag of the object are known, optional as the first read also
+            learns them.
+        '''
+        self._check_open()
+        if self._size >= 0:
+            return succeed(self)
+        d = self._get_blocks(0, 0)
+        return d.addCallback(lambda _: self)
+
+    def read(self, size=-1):
+        '''
+            Returns a deferred which fires with up to size bytes from the
+            current position, or the rest of the object if size is negative.
+        '''
+        try:
+            self._check_open()
+        except FileClosedException as e:
+            return fail(e)
+        return self._read(parse_int(size))
+
+    def seek(self, offset, whence=SEEK_SET):
+        self._check_open()
+        offset = parse_int(offset)
+        if whence == self.SEEK_SET:
+            pos = offset
+        elif whence == self.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == self.SEEK_END:
+            if self._size < 0:
+                raise CreateRequestException('seeking from the end requires open() to have completed')
+            pos = self._size + offset
+        else:
+            raise CreateRequestException('invalid whence: %s' % whence)
+        self._pos = max(pos, 0)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._closed = True
+        self._blocks.clear()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def get_size(self):
+        return self._size
+
+    def get_etag(self):
+        return self._etag
+
+    def get_stats(self):
+        return {
+            'requests': self._requests,
+            'bytes': self._bytes,
+            'hits': self._hits,
+            'misses': self._misses,
+            'cached_blocks': len(self._blocks),
+        }
+
+class CloudFileWriter(object):
+    '''
+        A write-only file over a Cloud Files object. Written data is buffered
+        until more than a segment is available, full segments are uploaded in
+        the background while writing continues. Closing the file uploads the
+        remaining data and a large object manifest, or a single object if no
+        more than one segment was ever written. write() returns a deferred
+        which only fires once there is room in the buffer again.
+    '''
+
+    # bytes per uploaded segment
+    SEGMENT_SIZE = 64*1024*1024
+    # segments uploaded at the same time
+    PARALLELISM = 2
+
+    def __init__(self, session, container=None, obj=None, segment_size=SEGMENT_SIZE, parallelism=PARALLELISM, segment_container=None, metadata={}):
+        if type(container) == str or type(container) == unicode:
+            container = Container(name=container)
+        if not isinstance(container, Container):
+            raise CreateRequestException('second argument must be a Container() instance or a string')
+        if type(obj) == str or type(obj) == unicode:
+            obj = Object(name=obj)
+        if not isinstance(obj, Object):
+            raise CreateRequestException('third argument must be an Object() instance or a string')
+        if segment_container == None:
+            segment_container = container
+        if type(segment_container) == str or type(segment_container) == unicode:
+            segment_container = Container(name=segment_container)
+        self._session = session
+        self._container = container
+        self._object = obj
+        self._segment_container = segment_container
+        self._segment_size = max(parse_int(segment_size), 1)
+        self._parallelism = max(parse_int(parallelism), 1)
+        self._metadata = metadata
+        self._prefix = '%s/%.6f/' % (obj.get_name(), time())
+        self._buffer = []
+        self._buffered = 0
+        self._segments = 0
+        self._uploading = 0
+        self._waiting = []
+        self._closing = None
+        self._closed = False
+        self._error = None
+        self._md5 = md5()
+        self._length = 0
+
+    def __repr__(self):
+        d = (self.__class__.__name__, self._container.get_name(), self._object.get_name(), self._length, self._segments, hex(id(self)))
+        return '<CloudFiles %s object (%s/%s: %s bytes, %s segments) at %s>' % d
+
+    def _take(self, length):
+        data = ''.join(self._buffer)
+        self._buffer = [data[length:]] if len(data) > length else []
+        self._buffered = max(len(data) - length, 0)
+        return data[:length]
+
+    def _upload(self, data):
+        obj = Object(name='%s%08d' % (self._prefix, self._segments))
+        obj.set_data(data)
+        self._segments += 1
+        self._uploading += 1
+        def _done(result):
+            self._uploading -= 1
+            self._flush()
+        def _failed(e):
+            self._uploading -= 1
+            if self._error is None:
+                self._error = e
+            self._flush()
+        d = self._session.create_object(self._segment_container, obj)
+        d.addCallbacks(_done, _failed)
+
+    def _flush(self):
+        '''
+            Starts as many segment uploads as there are free slots then fires
+            any waiting writers or the pending close.
+        '''
+        while self._error is None and self._uploading < self._parallelism:
+            if self._buffered > self._segment_size:
+                self._upload(self._take(self._segment_size))
+            elif self._closing and self._buffered > 0:
+                self._upload(self._take(self._segment_size))
+            else:
+                break
+        if self._error is not None or self._buffered <= self._segment_size:
+            waiting, self._waiting = self._waiting, []
+            for d in waiting:
+                if self._error is not None:
+                    d.errback(self._error)
+                else:
+                    d.callback(self._length)
+        if self._closing and self._uploading == 0:
+            if self._error is not None:
+                d, self._closing = self._closing, None
+                d.errback(self._error)
+            elif self._buffered == 0:
+                self._write_manifest()
+
+    def _write_manifest(self):
+        d, self._closing = self._closing, None
+        self._object.set_hash(self._md5.hexdigest())
+        c = self._session.create_manifest(self._container, self._object, self._segment_container, self._prefix, self._metadata)
+        c.chainDeferred(d)
+
+    def write(self, data):
+        '''
+            Buffers data for upload, returns a deferred which fires with the
+            number of bytes written so far once the buffer has room again.
+        '''
+        if self._closed:
+            return fail(FileClosedException('I/O operation on a closed file'))
+        if self._error is not None:
+            return fail(self._error)
+        if data:
+            self._buffer.append(data)
+            self._buffered += len(data)
+            self._length += len(data)
+            self._md5.update(data)
+        self._flush()
+        if self._buffered <= self._segment_size:
+            return succeed(self._length)
+        d = Deferred()
+        self._waiting.append(d)
+        return d
+
+    def close(self):
+        '''
+            Returns a deferred which fires with a (response, object) tuple once
+            all the data has been uploaded.
+        '''
+        if self._closed:
+            return fail(FileClosedException('file is already closed'))
+        self._closed = True
+        if self._error is not None:
+            return fail(self._error)
+        if self._segments == 0:
+            self._object.set_data(self._take(self._buffered))
+            return self._session.create_object(self._container, self._object, metadata=self._metadata)
+        self._closing = Deferred()
+        d = self._closing
+        self._flush()
+        return d
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def tell(self):
+        return self._length
+
+    def get_segment_count(self):
+        return self._segments
+
+    def get_segment_prefix(self):
+        return self._prefix
+
+
+'''
+
+    EOF
+
+'''
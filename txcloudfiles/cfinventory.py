@@ -0,0 +1,488 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+    Copyright 2012 Joe Harris
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+'''
+
+'''
+
+    Inventory objects are a compact, column oriented alternative to a
+    Container for holding listings of millions of objects.
+
+'''
+
+from array import array
+from operator import and_
+from itertools import compress
+from calendar import timegm
+from datetime import datetime
+from binascii import hexlify, unhexlify, Error as BinasciiError
+from helpers import parse_int
+from txcloudfiles.cfobject import Object
+from txcloudfiles.cfcontainer import name_key
+
+# an md5 digest, used when a listing entry has no valid hash
+EMPTY_DIGEST = '\x00' * 16
+# content type codes held in the narrow type column
+NARROW_TYPES = 0xffff
+
+# seconds since the epoch at the start of each day seen in a listing
+_days = {}
+
+def parse_timestamp(last_modified):
+    '''
+        Converts a listing timestamp such as 2012-11-20T12:34:56.123456 (UTC)
+        into seconds since the epoch, returns 0.0 if it cannot be parsed.
+    '''
+    try:
+        day = _days.get(last_modified[:10])
+        if day is None:
+            day = timegm((int(last_modified[0:4]), int(last_modified[5:7]), int(last_modified[8:10]), 0, 0, 0))
+            _days[last_modified[:10]] = day
+        seconds = day + int(last_modified[11:13]) * 3600 + int(last_modified[14:16]) * 60 + int(last_modified[17:19])
+    except (ValueError, TypeError):
+        return 0.0
+    fraction = last_modified[20:26]
+    if fraction.isdigit():
+        return seconds + int(fraction) / 10.0**len(fraction)
+    return float(seconds)
+
+def to_timestamp(t):
+    '''
+        Returns seconds since the epoch for a UTC datetime or a number.
+    '''
+    if isinstance(t, datetime):
+        return timegm(t.utctimetuple()) + t.microsecond / 1000000.0
+    return float(t)
+
+class Inventory(object):
+    '''
+        A listing of objects held in columns. Names are stored in one
+        contiguous buffer with an array of end offsets, sizes and modification
+        times in typed arrays, hashes as packed 16 byte digests and content
+        types as indexes into a table of distinct types. No per object Python
+        objects exist until an entry is requested.
+
+        Pass an Inventory() to list_all_objects() to fill it directly from
+        listing pages. It can also be used anywhere a listing Container() is
+        iterated, entries are returned as Object() instances on demand.
+    '''
+
+    def __init__(self, name=''):
+        self._name = name
+        self._names = array('c')
+        self._offsets = array('l')
+        self._sizes = array('d')
+        self._mtimes = array('d')
+        self._digests = array('c')
+        # widened to 'I' past NARROW_TYPES distinct content types
+        self._types = array('H')
+        self._type_names = []
+        self._type_index = {}
+        self._subdirs = []
+        self._requests = 0
+        self._sorted = True
+        self._last_name = ''
+        self._lookup = None
+
+    def __repr__(self):
+        d = (self.__class__.__name__, self._name, len(self), parse_int(sum(self._sizes)), hex(id(self)))
+        return '<CloudFiles %s object (%s: %s objects, %s bytes) at %s>' % d
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self._get_object(i)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('inventory index out of range')
+        return self._get_object(i)
+
+    def _type_code(self, content_type):
+        code = self._type_index.get(content_type)
+        if code is None:
+            code = len(self._type_names)
+            if code > NARROW_TYPES and self._types.typecode == 'H':
+                self._types = array('I', self._types)
+            self._type_names.append(content_type)
+            self._type_index[content_type] = code
+        return code
+
+    def _append(self, name, size, mtime, digest, content_type):
+        # before the column is looked up, the code can widen it
+        code = self._type_code(content_type)
+        if name < self._last_name:
+            self._sorted = False
+        self._last_name = name
+        self._lookup = None
+        self._names.fromstring(name)
+        self._offsets.append(len(self._names))
+        self._sizes.append(size)
+        self._mtimes.append(mtime)
+        self._digests.fromstring(digest)
+        self._types.append(code)
+
+    def _get_object(self, i):
+        obj = Object(self.get_name_at(i).decode('utf-8'))
+        obj.set_hash(self.get_hash_at(i))
+        obj.set_bytes(parse_int(self._sizes[i]))
+        obj.set_content_type(self._type_names[self._types[i]])
+        if self._mtimes[i]:
+            obj.set_last_modified(datetime.utcfromtimestamp(self._mtimes[i]))
+        return obj
+
+    def add_request(self):
+        '''
+            Counts a listing request whose objects were added with
+            extend_objects() as they were decoded.
+        '''
+        self._requests += 1
+
+    def add_objects(self, objects):
+        self.add_request()
+        self.extend_objects(objects)
+
+    def extend_objects(self, objects):
+        '''
+            Appends listing entries as decoded from a listing body.
+        '''
+        for object_data in objects:
+            if 'subdir' in object_data:
+                self._subdirs.append(object_data['subdir'])
+                continue
+            name = object_data.get('name', '')
+            if not name:
+                continue
+            if type(name) == unicode:
+                name = name.encode('utf-8')
+            try:
+                digest = unhexlify(object_data.get('hash', ''))
+            except (BinasciiError, TypeError):
+                digest = EMPTY_DIGEST
+            if len(digest) != 16:
+                digest = EMPTY_DIGEST
+            self._append(
+                name,
+                float(parse_int(object_data.get('bytes', 0))),
+                parse_timestamp(object_data.get('last_modified', '')),
+                digest,
+                object_data.get('content_type', '')
+            )
+
+    def merge(self, listing):
+        '''
+            Appends the entries of another Inventory() or listing Container().
+        '''
+        self._requests += listing.get_request_count()
+        self._subdirs.extend(listing.get_subdirs())
+        if isinstance(listing, Inventory):
+            for i in xrange(len(listing)):
+                self._append(
+                    listing.get_name_at(i),
+                    listing._sizes[i],
+                    listing._mtimes[i],
+                    listing._digests[i*16:i*16+16].tostring(),
+                    listing._type_names[listing._types[i]]
+                )
+            return
+        for obj in listing:
+            self.append_object(obj)
+
+    def append_object(self, obj):
+        '''
+            Appends a single Object().
+        '''
+        name = obj.get_name()
+        # avoid parsing the timestamp into a datetime first
+        last_modified = obj._last_modified
+        if type(last_modified) == str or type(last_modified) == unicode:
+            mtime = parse_timestamp(last_modified)
+        else:
+            mtime = to_timestamp(last_modified) if last_modified else 0.0
+        try:
+            digest = unhexlify(obj.get_hash())
+        except (BinasciiError, TypeError):
+            digest = EMPTY_DIGEST
+        self._append(
+            name.encode('utf-8') if type(name) == unicode else name,
+            float(obj.get_bytes().b),
+            mtime,
+            digest if len(digest) == 16 else EMPTY_DIGEST,
+            obj.get_content_type()
+        )
+
+    def get_name(self):
+        return self._name
+
+    def get_name_at(self, i):
+        '''
+            Returns the UTF-8 encoded name of the entry at index i.
+        '''
+        start = self._offsets[i-1] if i > 0 else 0
+        return self._names[start:self._offsets[i]].tostring()
+
+    def get_size_at(self, i):
+        return parse_int(self._sizes[i])
+
+    def get_mtime_at(self, i):
+        '''
+            Returns the modification time of the entry at index i in seconds
+            since the epoch.
+        '''
+        return self._mtimes[i]
+
+    def get_hash_at(self, i):
+        digest = self._digests[i*16:i*16+16].tostring()
+        return hexlify(digest) if digest != EMPTY_DIGEST else ''
+
+    def get_digest_at(self, i):
+        return self._digests[i*16:i*16+16].tostring()
+
+    def get_content_type_at(self, i):
+        return self._type_names[self._types[i]]
+
+    def get_subdirs(self):
+        return self._subdirs
+
+    def get_request_count(self):
+        return self._requests
+
+    def get_last_object(self):
+        if len(self) > 0:
+            return self._get_object(len(self) - 1)
+        return None
+
+    def iter_rows(self):
+        '''
+            Yields (name, bytes, mtime, hash, content_type) tuples without
+            creating an Object() for each entry.
+        '''
+        start = 0
+        names, sizes, mtimes, types = self._names, self._sizes, self._mtimes, self._types
+        for i, end in enumerate(self._offsets):
+            digest = self._digests[i*16:i*16+16].tostring()
+            yield (
+                names[start:end].tostring(),
+                parse_int(sizes[i]),
+                mtimes[i],
+                hexlify(digest) if digest != EMPTY_DIGEST else '',
+                self._type_names[types[i]],
+            )
+            start = end
+
+    def _bisect(self, name):
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get_name_at(mid) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def index(self, name):
+        '''
+            Returns the index of the entry called name or -1 if there is none.
+            Listings arrive sorted so this is a binary search, entries added
+            out of order fall back to a dictionary built on first use.
+        '''
+        if type(name) == unicode:
+            name = name.encode('utf-8')
+        if not self._sorted:
+            if self._lookup is None:
+                self._lookup = dict((self.get_name_at(i), i) for i in xrange(len(self)))
+            return self._lookup.get(name, -1)
+        i = self._bisect(name)
+        if i < len(self) and self.get_name_at(i) == name:
+            return i
+        return -1
+
+    def find(self, name):
+        '''
+            Returns the Object() called name or None.
+        '''
+        i = self.index(name)
+        return self._get_object(i) if i >= 0 else None
+
+    def by_name(self, name):
+        return self.find(name)
+
+    def __contains__(self, name):
+        return self.index(name) >= 0
+
+    def name_range(self, start=None, end=None):
+        '''
+            Returns Object() instances for the entries with names from start
+            (inclusive) up to end (exclusive).
+        '''
+        start = name_key(start) if start else ''
+        end = name_key(end) if end else None
+        if self._sorted:
+            lo = self._bisect(start) if start else 0
+            hi = self._bisect(end) if end is not None else len(self)
+            return [self._get_object(i) for i in xrange(lo, hi)]
+        selected = [i for i in xrange(len(self)) if self.get_name_at(i) >= start and (end is None or self.get_name_at(i) < end)]
+        selected.sort(key=self.get_name_at)
+        return [self._get_object(i) for i in selected]
+
+    def prefix_range(self, prefix):
+        '''
+            Returns Object() instances for the entries starting with prefix.
+        '''
+        return [self._get_object(i) for i in self.select(prefix=prefix)]
+
+    def _prefix_span(self, prefix):
+        # no UTF-8 encoded name contains '\xff' so it sorts after every
+        # name starting with prefix
+        return self._bisect(prefix), self._bisect(prefix + '\xff')
+
+    def _span(self, prefix=None, min_size=None, max_size=None, since=None, before=None):
+        '''
+            Returns the (start, end) slice of entries which can match and a
+            list of flags for the entries in it, or None if every entry in the
+            slice matches.
+        '''
+        start, end = 0, len(self)
+        mask = None
+        if prefix:
+            if type(prefix) == unicode:
+                prefix = prefix.encode('utf-8')
+            if self._sorted:
+                start, end = self._prefix_span(prefix)
+            else:
+                mask = map(lambda name: name.startswith(prefix), self.iter_names())
+        # each condition is tested over a slice of its column by map() so
+        # no Python code runs per entry
+        tests = []
+        if min_size is not None:
+            tests.append((float(min_size).__le__, self._sizes))
+        if max_size is not None:
+            tests.append((float(max_size).__ge__, self._sizes))
+        if since is not None:
+            tests.append((to_timestamp(since).__le__, self._mtimes))
+        if before is not None:
+            tests.append((to_timestamp(before).__gt__, self._mtimes))
+        for test, column in tests:
+            flags = map(test, column[start:end])
+            mask = flags if mask is None else map(and_, mask, flags)
+        return start, end, mask
+
+    def iter_names(self):
+        '''
+            Yields the UTF-8 encoded name of every entry.
+        '''
+        start, names = 0, self._names
+        for end in self._offsets:
+            yield names[start:end].tostring()
+            start = end
+
+    def select(self, prefix=None, min_size=None, max_size=None, since=None, before=None):
+        '''
+            Returns an array of the indexes of entries matching every given
+            condition. Sizes are inclusive bounds in bytes, since and before
+            are UTC datetimes or seconds since the epoch with since inclusive
+            and before exclusive.
+
+            A prefix is found with a binary search on sorted listings, the
+            other conditions cost a pass over their column within it.
+            Unsorted listings compare the prefix with every name.
+        '''
+        start, end, mask = self._span(prefix, min_size, max_size, since, before)
+        if mask is None:
+            return array('l', xrange(start, end))
+        return array('l', compress(xrange(start, end), mask))
+
+    def _slice(self, start, end):
+        # copies a run of entries a column at a time
+        inventory = Inventory(self._name)
+        base = self._offsets[start-1] if start > 0 else 0
+        inventory._names = self._names[base:self._offsets[end-1] if end > start else base]
+        inventory._offsets = array('l', map((-base).__add__, self._offsets[start:end]))
+        inventory._sizes = self._sizes[start:end]
+        inventory._mtimes = self._mtimes[start:end]
+        inventory._digests = self._digests[start*16:end*16]
+        inventory._types = self._types[start:end]
+        inventory._type_names = list(self._type_names)
+        inventory._type_index = dict(self._type_index)
+        inventory._sorted = self._sorted
+        inventory._last_name = self.get_name_at(end - 1) if end > start else ''
+        return inventory
+
+    def filter(self, prefix=None, min_size=None, max_size=None, since=None, before=None):
+        '''
+            Returns a new Inventory() holding the entries which match, takes
+            the same conditions as select(). When only a prefix is given on a
+            sorted listing the columns are copied as slices.
+        '''
+        start, end, mask = self._span(prefix, min_size, max_size, since, before)
+        if mask is None:
+            return self._slice(start, end)
+        inventory = Inventory(self._name)
+        for i in compress(xrange(start, end), mask):
+            inventory._append(
+                self.get_name_at(i),
+                self._sizes[i],
+                self._mtimes[i],
+                self._digests[i*16:i*16+16].tostring(),
+                self._type_names[self._types[i]]
+            )
+        return inventory
+
+    def get_stats(self, indexes=None):
+        '''
+            Returns aggregate statistics for every entry, or only the entries
+            at the given indexes such as those returned by select().
+        '''
+        if indexes is None:
+            sizes, mtimes, types = self._sizes, self._mtimes, self._types
+        else:
+            sizes = [self._sizes[i] for i in indexes]
+            mtimes = [self._mtimes[i] for i in indexes]
+            types = [self._types[i] for i in indexes]
+        content_types = {}
+        for code, size in zip(types, sizes):
+            stats = content_types.setdefault(self._type_names[code], [0, 0])
+            stats[0] += 1
+            stats[1] += parse_int(size)
+        known = [t for t in mtimes if t]
+        return {
+            'count': len(sizes),
+            'bytes': parse_int(sum(sizes)),
+            'min_bytes': parse_int(min(sizes)) if len(sizes) else 0,
+            'max_bytes': parse_int(max(sizes)) if len(sizes) else 0,
+            'oldest': min(known) if known else 0.0,
+            'newest': max(known) if known else 0.0,
+            'content_types': dict((k, {'count': v[0], 'bytes': v[1]}) for k, v in content_types.items()),
+        }
+
+    def get_memory_usage(self):
+        '''
+            Returns the approximate number of bytes held by the columns.
+        '''
+        columns = (self._names, self._offsets, self._sizes, self._mtimes, self._digests, self._types)
+        return sum(len(c) * c.itemsize for c in columns)
+
+'''
+
+    EOF
+
+'''
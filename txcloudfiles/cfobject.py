@@ -25,6 +25,7 @@
 
 '''
 
+import re
 from datetime import datetime
 from hashlib import md5
 from helpers import parse_int, DataUsage
@@ -32,30 +33,53 @@ from helpers import parse_int, DataUsage
 
 class Object(object):
     '''
-        A representation of a Cloud Files storage object.
+        A representation of a Cloud Files storage object. Listings can hold
+        millions of these so instances use __slots__, sizes are stored as
+        plain integers and timestamps are only parsed when requested.
     '''
 
+    __slots__ = (
+        '_name',
+        '_hash',
+        '_bytes',
+        '_content_type',
+        '_last_modified',
+        '_metadata',
+        '_compress',
+        '_download_name',
+        '_data',
+        '_transport',
+        '_transport_len',
+        '_remote_hash',
+        '_len',
+        '_remote_len',
+        '_stream',
+    )
+
+    # format of the last_modified field in listings
+    LAST_MODIFIED_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+    # checks the shape of the format above without parsing it
+    LAST_MODIFIED_PATTERN = re.compile(r'\d{4}-\d\d?-\d\d?T\d\d?:\d\d?:\d\d?\.\d{1,6}$')
+
     def __init__(self, name=''):
         self._name = name
         self._hash = ''
-        self._bytes = None
+        self._bytes = 0
         self._content_type = ''
         self._last_modified = ''
-        self._metadata = {}
-        self._compress = ''
+        self._metadata = None
+        self._compress = False
         self._download_name = ''
         self._data = ''
         self._transport = None
         self._transport_len = 0
-        self._hash = ''
         self._remote_hash = ''
         self._len = 0
         self._remote_len = 0
         self._stream = False
 
     def __repr__(self):
-        _b = int(self._bytes.b) if self._bytes else 0
-        d = (self.__class__.__name__, self._name, _b, hex(id(self)))
+        d = (self.__class__.__name__, self._name, self._bytes, hex(id(self)))
         return '<CloudFiles %s object (%s: %s bytes) at %s>' % d
 
     def __unicode__(self):
@@ -77,25 +101,30 @@ class Object(object):
         self._remote_len = int(remote_length)
 
     def set_bytes(self, bytes):
-        self._bytes = DataUsage(bytes)
+        self._bytes = parse_int(bytes)
 
     def set_content_type(self, content_type):
         self._content_type = str(content_type)
 
     def set_last_modified(self, last_modified):
+        '''
+            Stores the timestamp as given, strings are parsed the first time
+            get_last_modified() is called. Returns boolean False, leaving the
+            timestamp unset, for strings which are not in the listing format.
+        '''
         if type(last_modified) == str or type(last_modified) == unicode:
-            try:
-                self._last_modified = datetime.strptime(last_modified, '%Y-%m-%dT%H:%M:%S.%f')
-                return True
-            except ValueError:
-                pass
-        return False
+            if not self.LAST_MODIFIED_PATTERN.match(last_modified):
+                return False
+        elif not isinstance(last_modified, datetime):
+            return False
+        self._last_modified = last_modified
+        return True
 
     def set_metadata(self, metadata):
         self._metadata = metadata
 
     def set_compressed(self, compressed=True):
-        self._compressed = True if compressed else False
+        self._compress = True if compressed else False
 
     def set_download_name(self, download_name):
         self._download_name = str(download_name)
@@ -115,8 +144,25 @@ class Object(object):
         return self._data
 
     def get_metadata(self):
+        if self._metadata is None:
+            self._metadata = {}
         return self._metadata
 
+    def get_bytes(self):
+        return DataUsage(self._bytes)
+
+    def get_last_modified(self):
+        '''
+            Returns the last modified time as a datetime, or an empty string if
+            it is not set or cannot be parsed.
+        '''
+        if self._last_modified and not isinstance(self._last_modified, datetime):
+            try:
+                self._last_modified = datetime.strptime(self._last_modified, self.LAST_MODIFIED_FORMAT)
+            except ValueError:
+                self._last_modified = ''
+        return self._last_modified
+
     def set_transport(self, transport):
         self._transport = transport
 
@@ -138,12 +184,42 @@ class Object(object):
     def get_content_type(self):
         return self._content_type
 
+    def set_stream(self, stream):
+        self._stream = stream
+
     def is_stream(self):
         return True if self._stream else False
 
     def get_stream(self):
         return self._stream if self._stream else self._data
 
+class NotModified(object):
+    '''
+        Returned in place of an Object() by a conditional request when the
+        object has not changed since the ETag or time given.
+    '''
+
+    def __init__(self, name='', etag='', last_modified=''):
+        self._name = name
+        self._hash = etag
+        self._last_modified = last_modified
+
+    def __repr__(self):
+        d = (self.__class__.__name__, self._name, hex(id(self)))
+        return '<CloudFiles %s object (%s) at %s>' % d
+
+    def get_name(self):
+        return self._name
+
+    def get_hash(self):
+        return self._hash
+
+    def get_last_modified(self):
+        '''
+            Returns the Last-Modified header of the response as sent.
+        '''
+        return self._last_modified
+
 '''
 
     EOF
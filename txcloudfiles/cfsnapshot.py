@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+    Copyright 2012 Joe Harris
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+'''
+
+'''
+
+    Snapshots are sorted listings saved to disk in a compact binary format
+    which is memory-mapped when opened, so a job can look up objects in a
+    huge container without listing it again.
+
+    A snapshot file is laid out as:
+
+        header      magic, version, counts and section offsets
+        records     one fixed size record per object in name order
+        names       every name, UTF-8 encoded, back to back
+        index       every STRIDE'th name, for the first step of a lookup
+        meta        JSON with the container name, creation time and the
+                    table of content types
+
+'''
+
+import os
+import json
+import mmap
+from time import time
+from struct import Struct, error as StructError
+from bisect import bisect_right
+from datetime import datetime
+from binascii import hexlify
+from helpers import parse_int
+from errors import SnapshotException
+from txcloudfiles.cfobject import Object
+from txcloudfiles.cfcontainer import name_key
+from txcloudfiles.cfinventory import Inventory, EMPTY_DIGEST, NARROW_TYPES
+
+MAGIC = 'TXCFSNAP'
+VERSION = 1
+# magic, version, stride, count, records, names, index, index count, meta, meta length
+HEADER = Struct('<8sIIQQQQQQQ')
+# name offset, name length, bytes, mtime, md5 digest, content type
+RECORD = Struct('<QIQd16sH')
+INDEX_LENGTH = Struct('<I')
+# records between entries in the sparse index
+STRIDE = 128
+
+def write_snapshot(path, listing, name='', stride=STRIDE):
+    '''
+        Writes a Container(), Inventory() or any iterable of Object() to a
+        snapshot file at path. The file is written next to path and renamed
+        into place so readers never see a partial snapshot. Returns the number
+        of objects written.
+    '''
+    if not isinstance(listing, Inventory):
+        inventory = Inventory()
+        inventory.merge(listing)
+        listing = inventory
+    stride = max(parse_int(stride), 1)
+    count = len(listing)
+    order = xrange(count)
+    if not listing._sorted:
+        order = sorted(order, key=listing.get_name_at)
+    type_names = listing._type_names
+    if len(type_names) > NARROW_TYPES + 1:
+        # records hold content type codes in 16 bits
+        raise SnapshotException('failed to write snapshot %s, more than %d content types' % (path, NARROW_TYPES + 1))
+    records_offset = HEADER.size
+    names_offset = records_offset + RECORD.size * count
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = open(tmp, 'wb')
+    try:
+        f.write('\x00' * HEADER.size)
+        offset = 0
+        for i in order:
+            start = listing._offsets[i-1] if i > 0 else 0
+            length = listing._offsets[i] - start
+            f.write(RECORD.pack(
+                offset,
+                length,
+                parse_int(listing._sizes[i]),
+                listing._mtimes[i],
+                listing.get_digest_at(i),
+                listing._types[i]
+            ))
+            offset += length
+        for i in order:
+            f.write(listing.get_name_at(i))
+        index_offset = names_offset + offset
+        index_count = 0
+        for n in xrange(0, count, stride):
+            key = listing.get_name_at(order[n])
+            f.write(INDEX_LENGTH.pack(len(key)))
+            f.write(key)
+            index_count += 1
+        meta_offset = f.tell()
+        meta = json.dumps({
+            'container': name or listing.get_name(),
+            'created': time(),
+            'bytes': parse_int(sum(listing._sizes)),
+            'content_types': type_names,
+        })
+        f.write(meta)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, stride, count, records_offset, names_offset, index_offset, index_count, meta_offset, len(meta)))
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.rename(tmp, path)
+    except:
+        f.close()
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return count
+
+class Snapshot(object):
+    '''
+        A read-only, memory-mapped view of a snapshot file. Opening a snapshot
+        only reads the header and meta so it takes the same time whatever the
+        size of the listing. Lookups bisect the sparse index, loaded on first
+        use, and then the records of a single stride.
+    '''
+
+    def __init__(self, path):
+        self._path = path
+        self._map = None
+        self._file = None
+        try:
+            self._file = open(path, 'rb')
+        except IOError, e:
+            raise SnapshotException('failed to open snapshot %s: %s' % (path, e))
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            header = HEADER.unpack_from(self._map, 0)
+        except (mmap.error, StructError, ValueError):
+            self.close()
+            raise SnapshotException('failed to open snapshot %s, not a snapshot' % path)
+        magic, version, self._stride, self._count, self._records, self._names, self._index_offset, self._index_count, meta_offset, meta_length = header
+        if magic != MAGIC or version != VERSION or meta_offset + meta_length > len(self._map):
+            self.close()
+            raise SnapshotException('failed to open snapshot %s, not a snapshot or truncated' % path)
+        meta = json.loads(self._map[meta_offset:meta_offset+meta_length])
+        self._container = meta.get('container', '')
+        self._created = meta.get('created', 0)
+        self._bytes = meta.get('bytes', 0)
+        self._type_names = meta.get('content_types', [])
+        self._index = None
+
+    def __repr__(self):
+        d = (self.__class__.__name__, self._container, self._count, hex(id(self)))
+        return '<CloudFiles %s object (%s: %s objects) at %s>' % d
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for i in xrange(self._count):
+            yield self._get_object(i)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._count
+        if i < 0 or i >= self._count:
+            raise IndexError('snapshot index out of range')
+        return self._get_object(i)
+
+    def __contains__(self, name):
+        return self.index(name) >= 0
+
+    def _record(self, i):
+        return RECORD.unpack_from(self._map, self._records + RECORD.size * i)
+
+    def _type_name(self, code):
+        return self._type_names[code] if code < len(self._type_names) else ''
+
+    def _get_object(self, i):
+        offset, length, size, mtime, digest, content_type = self._record(i)
+        start = self._names + offset
+        obj = Object(self._map[start:start+length].decode('utf-8'))
+        obj.set_hash(hexlify(digest) if digest != EMPTY_DIGEST else '')
+        obj.set_bytes(size)
+        obj.set_content_type(self._type_name(content_type))
+        if mtime:
+            obj.set_last_modified(datetime.utcfromtimestamp(mtime))
+        return obj
+
+    def _load_index(self):
+        if self._index is None:
+            index = []
+            offset = self._index_offset
+            for n in xrange(self._index_count):
+                length = INDEX_LENGTH.unpack_from(self._map, offset)[0]
+                offset += INDEX_LENGTH.size
+                index.append(self._map[offset:offset+length])
+                offset += length
+            self._index = index
+        return self._index
+
+    def _bisect(self, key):
+        '''
+            Returns the position of the first record with a name of at least
+            key.
+        '''
+        block = bisect_right(self._load_index(), key) - 1
+        if block < 0:
+            return 0
+        lo = block * self._stride
+        hi = min(lo + self._stride, self._count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get_name_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def get_path(self):
+        return self._path
+
+    def get_container_name(self):
+        return self._container
+
+    def get_created(self):
+        '''
+            Returns the time the snapshot was written in seconds since the
+            epoch.
+        '''
+        return self._created
+
+    def get_bytes(self):
+        '''
+            Returns the total size of the objects in the snapshot.
+        '''
+        return self._bytes
+
+    def get_name_at(self, i):
+        '''
+            Returns the UTF-8 encoded name of the entry at index i.
+        '''
+        offset, length = self._record(i)[:2]
+        start = self._names + offset
+        return self._map[start:start+length]
+
+    def get_size_at(self, i):
+        return self._record(i)[2]
+
+    def get_mtime_at(self, i):
+        return self._record(i)[3]
+
+    def get_hash_at(self, i):
+        digest = self._record(i)[4]
+        return hexlify(digest) if digest != EMPTY_DIGEST else ''
+
+    def get_digest_at(self, i):
+        return self._record(i)[4]
+
+    def index(self, name):
+        '''
+            Returns the position of the entry called name or -1.
+        '''
+        key = name_key(name)
+        i = self._bisect(key)
+        if i < self._count and self.get_name_at(i) == key:
+            return i
+        return -1
+
+    def bisect(self, name):
+        '''
+            Returns the position of the first entry with a name of at least
+            name, which is where name is or would be.
+        '''
+        return self._bisect(name_key(name))
+
+    def by_name(self, name):
+        '''
+            Returns the Object() called name or None.
+        '''
+        i = self.index(name)
+        return self._get_object(i) if i >= 0 else None
+
+    def find(self, name):
+        return self.by_name(name)
+
+    def iter_rows(self, start=0, end=None):
+        '''
+            Yields (name, bytes, mtime, hash, content_type) tuples for the
+            records from start up to end without creating Object() instances.
+        '''
+        end = self._count if end is None else min(end, self._count)
+        for i in xrange(start, end):
+            offset, length, size, mtime, digest, content_type = self._record(i)
+            position = self._names + offset
+            yield (
+                self._map[position:position+length],
+                size,
+                mtime,
+                hexlify(digest) if digest != EMPTY_DIGEST else '',
+                self._type_name(content_type),
+            )
+
+    def iter_prefix(self, prefix):
+        '''
+            Yields rows as iter_rows() for every name starting with prefix.
+        '''
+        key = name_key(prefix)
+        for row in self.iter_rows(self._bisect(key) if key else 0):
+            if not row[0].startswith(key):
+                break
+            yield row
+
+    def prefix_range(self, prefix):
+        '''
+            Returns Object() instances for every name starting with prefix.
+        '''
+        key = name_key(prefix)
+        i = self._bisect(key) if key else 0
+        objects = []
+        while i < self._count and self.get_name_at(i).startswith(key):
+            objects.append(self._get_object(i))
+            i += 1
+        return objects
+
+    def to_inventory(self):
+        '''
+            Loads the whole snapshot into an Inventory().
+        '''
+        inventory = Inventory(self._container)
+        for i in xrange(self._count):
+            offset, length, size, mtime, digest, content_type = self._record(i)
+            start = self._names + offset
+            inventory._append(self._map[start:start+length], float(size), mtime, digest, self._type_name(content_type))
+        return inventory
+
+    def close(self):
+        if self._map:
+            self._map.close()
+            self._map = None
+        if self._file:
+            self._file.close()
+            self._file = None
+
+class SnapshotDelta(object):
+    '''
+        The differences between a snapshot and the current listing of a
+        container. Added and changed entries are Object() instances, removed
+        entries are UTF-8 encoded names.
+    '''
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.changed = []
+        self.unchanged = False
+        self.verified = False
+        self._bytes = 0
+        self._shards = 0
+        self._requests = 0
+
+    def __repr__(self):
+        d = (self.__class__.__name__, len(self.added), len(self.removed), len(self.changed), hex(id(self)))
+        return '<CloudFiles %s object (%s added, %s removed, %s changed) at %s>' % d
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def get_count_change(self):
+        return len(self.added) - len(self.removed)
+
+    def get_bytes_change(self):
+        return self._bytes
+
+    def get_shard_count(self):
+        return self._shards
+
+    def get_request_count(self):
+        return self._requests
+
+    def apply(self, snapshot):
+        '''
+            Returns an Inventory() of the snapshot with the delta applied.
+        '''
+        removed = set(self.removed)
+        changed = dict((name_key(obj), obj) for obj in self.changed)
+        added = sorted(self.added, key=name_key)
+        added.reverse()
+        updated = Inventory(snapshot.get_container_name())
+        for i in xrange(len(snapshot)):
+            name = snapshot.get_name_at(i)
+            while added and name_key(added[-1]) < name:
+                updated.append_object(added.pop())
+            if name in removed:
+                continue
+            if name in changed:
+                updated.append_object(changed[name])
+                continue
+            offset, length, size, mtime, digest, content_type = snapshot._record(i)
+            updated._append(name, float(size), mtime, digest, snapshot._type_name(content_type))
+        while added:
+            updated.append_object(added.pop())
+        return updated
+
+def open_snapshot(path):
+    '''
+        Opens a snapshot written by write_snapshot() or list_all_objects().
+    '''
+    return Snapshot(path)
+
+'''
+
+    EOF
+
+'''
@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+    Copyright 2012 Joe Harris
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+'''
+
+'''
+
+    A content cache keeps object bodies on local disk so retrieve_object()
+    can serve repeated downloads without transferring the body again. The
+    cache directory is laid out as:
+
+        bodies/xx/<md5>     one file per distinct body, named by its md5 so
+                            objects with the same content share a file
+        index               a journal of JSON records, one per line, which
+                            map container/object/ETag to a body
+
+    Bodies are hashed, written to a temporary file and synced in a thread,
+    then renamed into place before their index record is queued. Index
+    records are appended and synced in batches by a single writer thread and
+    bodies are read back in a thread, so the reactor only waits on the disk
+    to open the cache and to rename and remove body files. A crash can lose
+    the records still queued, bodies without a record are removed the next
+    time the cache is opened.
+
+'''
+
+import os
+import json
+from time import time
+from hashlib import md5
+from itertools import count
+from collections import OrderedDict
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.threads import deferToThread
+from twisted.python.failure import Failure
+from txcloudfiles.helpers import parse_int
+from txcloudfiles.cfcontainer import name_key
+from txcloudfiles.cache import Invalidations
+
+class ContentCache(object):
+    '''
+        An on-disk cache of object bodies bounded by total bytes, the least
+        recently used objects are evicted first. With a ttl of 0 every hit is
+        revalidated against Cloud Files before it is used, otherwise entries
+        younger than ttl seconds are trusted without a request. With a stale
+        bound, entries up to that many seconds older are served at once and
+        revalidated in the background.
+    '''
+
+    # 1GB of bodies by default
+    MAX_BYTES = 1024*1024*1024
+    # objects larger than this are never cached
+    MAX_OBJECT_BYTES = 64*1024*1024
+    # stale records allowed in the index before it is rewritten
+    COMPACT_SLACK = 1000
+
+    def __init__(self, path, max_bytes=MAX_BYTES, ttl=0, max_object_bytes=MAX_OBJECT_BYTES, stale=0):
+        self._path = path
+        self._max_bytes = max(parse_int(max_bytes), 0)
+        self._ttl = max(parse_int(ttl), 0)
+        self._stale = max(parse_int(stale), 0)
+        self._max_object_bytes = max(parse_int(max_object_bytes), 0)
+        # (container, object) -> (etag, digest, bytes, content type, stored)
+        self._entries = OrderedDict()
+        # digest -> number of entries sharing the body
+        self._bodies = {}
+        self._bytes = 0
+        self._records = 0
+        self._index = None
+        # records waiting for the writer thread
+        self._journal = []
+        # index lines to replace the index with before the journal
+        self._rewrite = None
+        self._flushing = False
+        self._closed = False
+        self._closing = []
+        self._invalidated = Invalidations()
+        self._tmp_names = count()
+        self._revalidating = set()
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._revalidations = 0
+        self._revalidation_errors = 0
+        self._dropped = 0
+        self._index_errors = 0
+        self._open()
+
+    def __repr__(self):
+        d = (self.__class__.__name__, len(self._entries), self._bytes, self._max_bytes, hex(id(self)))
+        return '<CloudFiles %s object (%s objects, %s of %s bytes) at %s>' % d
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _key(self, container, obj):
+        return (container.get_name(), name_key(obj))
+
+    def _body_path(self, digest):
+        return os.path.join(self._path, 'bodies', digest[:2], digest)
+
+    def _index_path(self):
+        return os.path.join(self._path, 'index')
+
+    def _open(self):
+        bodies = os.path.join(self._path, 'bodies')
+        if not os.path.isdir(bodies):
+            os.makedirs(bodies)
+        entries = OrderedDict()
+        if os.path.exists(self._index_path()):
+            f = open(self._index_path(), 'rb')
+            try:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # a record torn by a crash
+                        continue
+                    key = (record[1].encode('utf-8'), record[2].encode('utf-8'))
+                    entries.pop(key, None)
+                    if record[0] == 'set':
+                        entries[key] = (record[3].encode('utf-8'), record[4].encode('utf-8'), record[5], record[6].encode('utf-8'), record[7])
+            finally:
+                f.close()
+        for key, entry in entries.items():
+            if os.path.exists(self._body_path(entry[1])):
+                self._add(key, entry)
+        for directory, subdirs, files in os.walk(bodies):
+            for filename in files:
+                if filename not in self._bodies:
+                    os.unlink(os.path.join(directory, filename))
+        self._rewrite_index(self._index_lines())
+        self._records = len(self._entries)
+
+    def _add(self, key, entry):
+        self._entries[key] = entry
+        digest = entry[1]
+        if digest not in self._bodies:
+            self._bodies[digest] = 0
+            self._bytes += entry[2]
+        self._bodies[digest] += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        digest = entry[1]
+        self._bodies[digest] -= 1
+        if self._bodies[digest] == 0:
+            del self._bodies[digest]
+            self._bytes -= entry[2]
+            try:
+                os.unlink(self._body_path(digest))
+            except OSError:
+                pass
+        self._write_record(['del', key[0], key[1]])
+
+    def _write_record(self, record):
+        if self._closed:
+            return
+        self._journal.append(json.dumps(record) + '\n')
+        self._records += 1
+        if self._records > len(self._entries) + self.COMPACT_SLACK:
+            self._compact()
+        self._flush()
+
+    def _index_lines(self):
+        # least recently used first so the order survives reopening the cache
+        return [json.dumps(['set', key[0], key[1]] + list(entry)) + '\n' for key, entry in self._entries.items()]
+
+    def _compact(self):
+        '''
+            Queues a rewrite of the index with a single record per entry,
+            which replaces the records queued so far.
+        '''
+        self._rewrite = self._index_lines()
+        self._journal = []
+        self._records = len(self._entries)
+
+    def _rewrite_index(self, lines):
+        if self._index:
+            self._index.close()
+            self._index = None
+        tmp = '%s.%d.tmp' % (self._index_path(), os.getpid())
+        f = open(tmp, 'wb')
+        try:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            os.rename(tmp, self._index_path())
+        except:
+            f.close()
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        self._index = open(self._index_path(), 'ab')
+
+    def _write_index(self, lines, rewrite):
+        '''
+            Runs in the writer thread, rewrites the index if rewrite is not
+            None then appends lines to it and syncs it.
+        '''
+        if rewrite is not None:
+            self._rewrite_index(rewrite)
+        if self._index is None:
+            # a failed rewrite left the index closed
+            self._index = open(self._index_path(), 'ab')
+        if lines:
+            self._index.writelines(lines)
+            self._index.flush()
+            os.fsync(self._index.fileno())
+
+    def _flush(self):
+        if self._flushing or (not self._journal and self._rewrite is None):
+            return
+        lines, self._journal = self._journal, []
+        rewrite, self._rewrite = self._rewrite, None
+        self._flushing = True
+        deferToThread(self._write_index, lines, rewrite).addBoth(self._flushed)
+
+    def _flushed(self, result):
+        self._flushing = False
+        if isinstance(result, Failure):
+            # the records are lost, the cache is still usable until reopened
+            self._index_errors += 1
+        if self._journal or self._rewrite is not None:
+            self._flush()
+        elif self._closed:
+            self._close_index()
+
+    def _close_index(self):
+        if self._index:
+            self._index.close()
+            self._index = None
+        waiters, self._closing = self._closing, []
+        for d in waiters:
+            d.callback(None)
+
+    def _evict(self):
+        while self._bytes > self._max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+
+    def lookup(self, container, obj):
+        '''
+            Returns the (etag, digest, bytes, content type, stored) entry for
+            an object or None.
+        '''
+        if self._closed:
+            return None
+        key = self._key(container, obj)
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self._misses += 1
+            return None
+        # re-insert to mark it as the most recently used
+        self._entries[key] = entry
+        self._hits += 1
+        return entry
+
+    def is_fresh(self, entry):
+        '''
+            Returns boolean True if the entry can be used without revalidating
+            it first.
+        '''
+        return self._ttl > 0 and entry[4] + self._ttl > time()
+
+    def is_stale(self, entry):
+        '''
+            Returns boolean True if the entry is past its TTL but can still be
+            served while it is revalidated in the background.
+        '''
+        return self._stale > 0 and entry[4] + self._ttl + self._stale > time()
+
+    def begin_revalidation(self, container, obj):
+        '''
+            Returns boolean True if the caller should revalidate the object,
+            False if a revalidation is already running.
+        '''
+        key = self._key(container, obj)
+        if key in self._revalidating:
+            return False
+        self._revalidating.add(key)
+        self._revalidations += 1
+        return True
+
+    def end_revalidation(self, container, obj, failure=None):
+        self._revalidating.discard(self._key(container, obj))
+        if failure is not None:
+            self._revalidation_errors += 1
+
+    def _read_body(self, path):
+        '''
+            Runs in a thread, returns the body at path or None if it has gone
+            missing.
+        '''
+        try:
+            f = open(path, 'rb')
+            try:
+                return f.read()
+            finally:
+                f.close()
+        except IOError:
+            return None
+
+    def read(self, container, obj, entry):
+        '''
+            Returns a deferred which fires with the cached body for entry or
+            None if it has gone missing from the disk.
+        '''
+        key = self._key(container, obj)
+        def _read(body):
+            if body is None and self._entries.get(key, None) == entry and not self._closed:
+                self._remove(key)
+            return body
+        return deferToThread(self._read_body, self._body_path(entry[1])).addCallbacks(_read, lambda _: _read(None))
+
+    def revalidated(self, container, obj):
+        '''
+            Marks an entry as current from now, called after Cloud Files has
+            confirmed its ETag.
+        '''
+        key = self._key(container, obj)
+        entry = self._entries.get(key, None)
+        if entry is not None and (self._ttl > 0 or self._stale > 0):
+            self._entries[key] = entry[:4] + (time(),)
+            self._write_record(['set', key[0], key[1]] + list(self._entries[key]))
+
+    def get_token(self):
+        '''
+            Returns a token to pass to store() with the body of a request
+            which is about to be made.
+        '''
+        return self._invalidated.get_token()
+
+    def _write_body(self, body, tmp):
+        '''
+            Runs in a thread, writes body to tmp and returns its md5.
+        '''
+        digest = md5(body).hexdigest()
+        f = open(tmp, 'wb')
+        try:
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        directory = os.path.dirname(self._body_path(digest))
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # made by another write in the meantime
+                pass
+        return digest
+
+    def store(self, container, obj, etag, body, content_type='', token=None):
+        '''
+            Stores the body of an object with the ETag it was served with,
+            returns a deferred which fires with boolean True once it is
+            stored. Bodies larger than max_object_bytes are not cached, nor
+            are bodies of objects discarded after token was taken.
+        '''
+        if self._closed:
+            return succeed(False)
+        key = self._key(container, obj)
+        if token is None:
+            token = self._invalidated.get_token()
+        if self._invalidated.changed(key, token):
+            self._dropped += 1
+            return succeed(False)
+        if key in self._entries:
+            self._remove(key)
+        if len(body) > self._max_object_bytes or len(body) > self._max_bytes:
+            return succeed(False)
+        tmp = os.path.join(self._path, 'bodies', '%d.%d.tmp' % (os.getpid(), next(self._tmp_names)))
+        length = len(body)
+        def _written(digest):
+            if self._closed or self._invalidated.changed(key, token):
+                # closed or discarded while the body was written
+                self._dropped += 1
+                os.unlink(tmp)
+                return False
+            if digest in self._bodies:
+                os.unlink(tmp)
+            else:
+                os.rename(tmp, self._body_path(digest))
+            if key in self._entries:
+                self._remove(key)
+            entry = (etag, digest, length, content_type or '', time())
+            self._add(key, entry)
+            self._write_record(['set', key[0], key[1]] + list(entry))
+            self._stores += 1
+            self._evict()
+            return True
+        def _failed(failure):
+            # the body is only cached, the download itself succeeded
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            return False
+        return deferToThread(self._write_body, body, tmp).addCallbacks(_written, _failed)
+
+    def discard(self, container, obj):
+        if self._closed:
+            return
+        key = self._key(container, obj)
+        self._invalidated.invalidate(key)
+        if key in self._entries:
+            self._remove(key)
+            self._invalidations += 1
+
+    def clear(self):
+        if self._closed:
+            return
+        for key in self._entries.keys():
+            self._remove(key)
+        self._invalidated.clear()
+        self._compact()
+        self._flush()
+
+    def close(self):
+        '''
+            Closes the cache, returns a deferred which fires once the records
+            already queued are written to the index. A closed cache misses
+            every lookup and ignores stores and discards.
+        '''
+        if self._closed and self._index is None:
+            return succeed(None)
+        d = Deferred()
+        self._closing.append(d)
+        if not self._closed:
+            self._closed = True
+            if not self._flushing:
+                self._close_index()
+        return d
+
+    def is_closed(self):
+        return self._closed
+
+    def get_path(self):
+        return self._path
+
+    def get_ttl(self):
+        return self._ttl
+
+    def set_ttl(self, ttl):
+        self._ttl = max(parse_int(ttl), 0)
+
+    def get_stale(self):
+        return self._stale
+
+    def set_stale(self, stale):
+        self._stale = max(parse_int(stale), 0)
+
+    def get_max_bytes(self):
+        return self._max_bytes
+
+    def get_usage(self):
+        return self._bytes
+
+    def get_stats(self):
+        return {
+            'objects': len(self._entries),
+            'bodies': len(self._bodies),
+            'bytes': self._bytes,
+            'max_bytes': self._max_bytes,
+            'hits': self._hits,
+            'misses': self._misses,
+            'stores': self._stores,
+            'evictions': self._evictions,
+            'invalidations': self._invalidations,
+            'revalidations': self._revalidations,
+            'revalidation_errors': self._revalidation_errors,
+            'dropped': self._dropped,
+            'index_errors': self._index_errors,
+        }
+
+'''
+
+    EOF
+
+'''
@@ -73,6 +73,26 @@ class ResponseException(CloudFilesException):
     '''
     pass
 
+''' file errors '''
+
+class FileClosedException(CloudFilesException):
+    '''
+        An operation was attempted on a closed file.
+    '''
+    pass
+
+class ObjectChangedException(ResponseException):
+    '''
+        The object was replaced while it was being read.
+    '''
+    pass
+
+class SnapshotException(CloudFilesException):
+    '''
+        A listing snapshot file is missing, truncated or not a snapshot.
+    '''
+    pass
+
 '''
 
     EOF
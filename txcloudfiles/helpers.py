@@ -25,6 +25,9 @@
 '''
 
 from urllib import quote_plus
+from calendar import timegm
+from datetime import datetime
+from email.utils import formatdate
 from errors import CloudFilesException
 
 def parse_int(x):
@@ -42,6 +45,51 @@ def parse_str(x):
 def parse_url_str(x):
     return quote_plus(parse_str(x))[:256]
 
+def format_range(offset=None, length=None):
+    '''
+        Returns a Range header value for a single byte range. A negative offset
+        with no length requests the last abs(offset) bytes.
+    '''
+    offset = parse_int(offset) if offset != None else 0
+    if offset < 0 and length == None:
+        return 'bytes=%s' % offset
+    if length == None:
+        return 'bytes=%s-' % offset
+    return 'bytes=%s-%s' % (offset, offset + max(parse_int(length), 1) - 1)
+
+def format_http_date(when):
+    '''
+        Returns an HTTP date header value for a UTC datetime or a time in
+        seconds since the epoch.
+    '''
+    if isinstance(when, datetime):
+        when = timegm(when.utctimetuple())
+    return formatdate(float(when), usegmt=True)
+
+def format_ranges(ranges):
+    '''
+        Returns a Range header value requesting several (offset, length) byte
+        ranges at once.
+    '''
+    spans = []
+    for offset, length in ranges:
+        offset, length = parse_int(offset), max(parse_int(length), 1)
+        spans.append('%s-%s' % (offset, offset + length - 1))
+    return 'bytes=' + ','.join(spans)
+
+def parse_content_range(header):
+    '''
+        Parses a 'bytes start-end/total' Content-Range header into a tuple of
+        (start, end, total) integers, total is -1 if the server did not know it.
+    '''
+    try:
+        unit, spec = parse_str(header).strip().split(' ', 1)
+        span, total = spec.split('/', 1)
+        start, end = span.split('-', 1)
+        return int(start), int(end), -1 if total.strip() == '*' else int(total)
+    except ValueError:
+        return 0, -1, -1
+
 class Metadata(object):
     
     ACCOUNT = 'X-'
@@ -97,6 +145,11 @@ class Metadata(object):
             return self.DEFAULT + header.title()[len(self.prefix)+1:]
 
 class DataUsage(object):
+    '''
+        A number of bytes, converted into larger units on demand.
+    '''
+    
+    __slots__ = ('_bytes',)
     
     BANDWIDTH_B = 1
     BANDWIDTH_KB = 1024
@@ -115,11 +168,12 @@ class DataUsage(object):
     
     def __init__(self, bytes=0):
         self._bytes = parse_int(bytes)
-        self.b = self.get_in(self.BANDWIDTH_B)
-        self.kb = self.get_in(self.BANDWIDTH_KB)
-        self.mb = self.get_in(self.BANDWIDTH_MB)
-        self.gb = self.get_in(self.BANDWIDTH_GB)
-        self.tb = self.get_in(self.BANDWIDTH_TB)
+    
+    b = property(lambda self: self.get_in(self.BANDWIDTH_B))
+    kb = property(lambda self: self.get_in(self.BANDWIDTH_KB))
+    mb = property(lambda self: self.get_in(self.BANDWIDTH_MB))
+    gb = property(lambda self: self.get_in(self.BANDWIDTH_GB))
+    tb = property(lambda self: self.get_in(self.BANDWIDTH_TB))
     
     def get_in(self, bandwidth=0):
         if bandwidth not in self.BANDWIDTHS:
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+    Copyright 2012 Joe Harris
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+'''
+
+'''
+
+    A prefetcher downloads the objects a consumer is about to ask for. It is
+    given a listing in the order the consumer will work through it and keeps
+    the next few objects downloading in the background, retrieve_object()
+    takes their bodies from it instead of waiting for a request.
+
+'''
+
+from collections import deque, OrderedDict
+from twisted.internet.defer import Deferred, succeed, fail
+from twisted.python.failure import Failure
+from txcloudfiles.errors import CreateRequestException
+from txcloudfiles.helpers import parse_int
+from txcloudfiles.budget import get_memory_budget
+from txcloudfiles.cfcontainer import Container, name_key
+from txcloudfiles.requests.objects import retrieve_object
+
+class _Prefetch(object):
+    '''
+        A single object being downloaded or waiting in the buffer.
+    '''
+
+    def __init__(self):
+        self.result = None
+        self.waiters = []
+        self.expected = 0
+        self.bytes = 0
+        self.reserved = 0
+
+class Prefetcher(object):
+    '''
+        Keeps up to depth objects from a listing downloading or buffered ahead
+        of the consumer. The depth grows while the consumer has to wait for
+        downloads and shrinks while downloads run further ahead than needed,
+        between min_depth and max_depth. Buffered bodies are held within
+        max_bytes and the process memory budget, no more downloads are
+        started while either is used up.
+
+        The listing can be any iterable of Object() instances or names, such
+        as a Container() or Inventory(), or a pager from list_object_pages()
+        which is read a page at a time as the consumer advances.
+    '''
+
+    # objects kept ahead of the consumer to begin with
+    DEPTH = 4
+    # fewest and most objects kept ahead of the consumer
+    MIN_DEPTH = 1
+    MAX_DEPTH = 32
+    # 64MB of buffered bodies per prefetcher
+    MAX_BYTES = 64*1024*1024
+
+    def __init__(self, session, container, listing, depth=DEPTH, max_depth=MAX_DEPTH, max_bytes=MAX_BYTES, min_depth=MIN_DEPTH, budget=None):
+        if type(container) == str or type(container) == unicode:
+            container = Container(name=container)
+        if not isinstance(container, Container):
+            raise CreateRequestException('second argument must be a Container() instance or a string')
+        self._session = session
+        self._container = container
+        self._min_depth = max(parse_int(min_depth), 1)
+        self._max_depth = max(parse_int(max_depth), self._min_depth)
+        self._depth = min(max(parse_int(depth), self._min_depth), self._max_depth)
+        self._max_bytes = max(parse_int(max_bytes), 0)
+        self._budget = budget if budget is not None else get_memory_budget()
+        self._pager = listing if hasattr(listing, 'next_page') else None
+        self._listing = iter(listing) if self._pager is None else None
+        self._listed = False
+        self._paging = False
+        # (name key, name, bytes) of objects not yet started
+        self._upcoming = deque()
+        # name key -> _Prefetch() in listing order
+        self._buffer = OrderedDict()
+        self._buffered = 0
+        # bytes expected from downloads still in flight
+        self._pending = 0
+        self._average = 0
+        self._starting = None
+        self._running = False
+        self._hits = 0
+        self._waits = 0
+        self._misses = 0
+        self._wasted = 0
+        self._failures = 0
+        self._stalls = 0
+        self._downloads = 0
+        self._bytes = 0
+
+    def __repr__(self):
+        d = (self.__class__.__name__, len(self._buffer), self._depth, self._buffered, hex(id(self)))
+        return '<CloudFiles %s object (%s of %s objects, %s bytes) at %s>' % d
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def start(self):
+        '''
+            Registers the prefetcher with its session and starts downloading.
+        '''
+        self._running = True
+        self._session.set_prefetcher(self._container, self)
+        self._fill()
+        return self
+
+    def stop(self):
+        '''
+            Stops downloading and drops every buffered object, objects already
+            taken by the consumer are still delivered.
+        '''
+        self._running = False
+        if self._session.get_prefetcher(self._container) is self:
+            self._session.remove_prefetcher(self._container)
+        for key in self._buffer.keys():
+            self._drop(key)
+        self._upcoming.clear()
+
+    def is_running(self):
+        return self._running
+
+    def _read_listing(self):
+        '''
+            Tops up the upcoming objects from the listing, a page at a time
+            for pagers.
+        '''
+        if self._listed or len(self._upcoming) >= self._max_depth:
+            return
+        if self._pager is None:
+            while len(self._upcoming) < self._max_depth:
+                try:
+                    self._queue(next(self._listing))
+                except StopIteration:
+                    self._listed = True
+                    break
+        elif not self._paging:
+            self._paging = True
+            self._pager.next_page().addCallbacks(self._got_page, self._listing_failed)
+
+    def _got_page(self, page):
+        self._paging = False
+        if page is None:
+            self._listed = True
+        else:
+            for obj in page:
+                self._queue(obj)
+        self._fill()
+
+    def _listing_failed(self, failure):
+        # the consumer falls back to plain requests for the rest
+        self._paging = False
+        self._listed = True
+        self._failures += 1
+
+    def _queue(self, obj):
+        if hasattr(obj, 'get_name'):
+            size = parse_int(obj.get_bytes().b) if hasattr(obj, 'get_bytes') else 0
+            obj = obj.get_name()
+        else:
+            size = 0
+        self._upcoming.append((name_key(obj), obj, size))
+
+    def _fits(self, size):
+        size += self._pending
+        if self._buffer and self._buffered + size > self._max_bytes:
+            return False
+        available = self._budget.get_available()
+        # a single download is always allowed, the consumer would make it anyway
+        return available < 0 or size <= available or not self._buffer
+
+    def _fill(self):
+        while self._running and len(self._buffer) < self._depth:
+            self._read_listing()
+            if not self._upcoming:
+                break
+            key, name, size = self._upcoming[0]
+            if not self._fits(size or self._average):
+                # wait for the consumer to take some of the buffer
+                self._stalls += 1
+                self._depth = max(len(self._buffer), self._min_depth)
+                break
+            self._upcoming.popleft()
+            self._start(key, name, size or self._average)
+        if self._running and self._listed and not self._upcoming and not self._buffer:
+            self.stop()
+
+    def _start(self, key, name, size):
+        self._starting = key
+        try:
+            d = retrieve_object(self._session, self._container, name)
+        finally:
+            self._starting = None
+        entry = _Prefetch()
+        entry.expected = size
+        self._pending += size
+        self._buffer[key] = entry
+        self._downloads += 1
+        d.addCallbacks(self._done, self._done, callbackArgs=(key, entry), errbackArgs=(key, entry))
+
+    def _done(self, result, key, entry):
+        if self._buffer.get(key, None) is entry:
+            self._pending -= entry.expected
+        if isinstance(result, Failure):
+            self._failures += 1
+        else:
+            entry.bytes = len(result[1].get_data())
+            self._bytes += entry.bytes
+            self._average = self._bytes // max(self._downloads - self._failures, 1)
+            if self._buffer.get(key, None) is entry:
+                entry.reserved = entry.bytes if self._budget.try_reserve(entry.bytes) else 0
+                self._buffered += entry.bytes
+        entry.result = result
+        waiters, entry.waiters = entry.waiters, []
+        for d in waiters:
+            self._deliver(d, result)
+
+    def _deliver(self, d, result):
+        if isinstance(result, Failure):
+            d.errback(result)
+        else:
+            d.callback(result)
+
+    def _drop(self, key):
+        entry = self._buffer.pop(key)
+        if entry.result is None:
+            self._pending -= entry.expected
+        elif not isinstance(entry.result, Failure):
+            self._buffered -= entry.bytes
+        if entry.reserved:
+            self._budget.release(entry.reserved)
+            entry.reserved = 0
+        return entry
+
+    def _adapt(self, waited):
+        if waited:
+            # the consumer is faster than the downloads, keep more in flight
+            self._depth = min(self._depth + 1, self._max_depth)
+        elif len(self._buffer) >= self._depth and all(e.result is not None for e in self._buffer.values()):
+            # everything ahead is already downloaded, fewer would do
+            self._depth = max(self._depth - 1, self._min_depth)
+
+    def take(self, obj):
+        '''
+            Returns a deferred firing with the (response, Object()) tuple of a
+            prefetched object, or None if obj was not prefetched. Buffered
+            objects listed before obj are taken to have been skipped and are
+            dropped.
+        '''
+        key = name_key(obj)
+        if key == self._starting:
+            # our own download
+            return None
+        if key not in self._buffer:
+            self._misses += 1
+            for i, upcoming in enumerate(self._upcoming):
+                if upcoming[0] == key:
+                    # the consumer has jumped ahead of the downloads
+                    for n in xrange(i + 1):
+                        self._upcoming.popleft()
+                    self._wasted += len(self._buffer)
+                    for k in self._buffer.keys():
+                        self._drop(k)
+                    self._fill()
+                    break
+            return None
+        for k in self._buffer.keys():
+            if k == key:
+                break
+            self._drop(k)
+            self._wasted += 1
+        entry = self._drop(key)
+        if entry.result is not None:
+            self._hits += 1
+            self._adapt(False)
+            self._fill()
+            if isinstance(entry.result, Failure):
+                return fail(entry.result)
+            return succeed(entry.result)
+        self._waits += 1
+        self._adapt(True)
+        d = Deferred()
+        entry.waiters.append(d)
+        self._fill()
+        return d
+
+    def discard(self, obj):
+        '''
+            Drops a buffered object, called when it is written or deleted.
+        '''
+        key = name_key(obj)
+        if key in self._buffer:
+            self._drop(key)
+            self._wasted += 1
+
+    def get_depth(self):
+        return self._depth
+
+    def get_usage(self):
+        return self._buffered
+
+    def get_hit_rate(self):
+        '''
+            The share of takes served without waiting for a download.
+        '''
+        takes = self._hits + self._waits + self._misses
+        return self._hits / float(takes) if takes else 0.0
+
+    def get_stats(self):
+        return {
+            'depth': self._depth,
+            'buffered': len(self._buffer),
+            'bytes': self._buffered,
+            'upcoming': len(self._upcoming),
+            'hits': self._hits,
+            'waits': self._waits,
+            'misses': self._misses,
+            'wasted': self._wasted,
+            'failures': self._failures,
+            'stalls': self._stalls,
+            'downloads': self._downloads,
+            'downloaded_bytes': self._bytes,
+        }
+
+def prefetch_objects(session, container=None, listing=None, depth=Prefetcher.DEPTH, max_depth=Prefetcher.MAX_DEPTH, max_bytes=Prefetcher.MAX_BYTES):
+    '''
+        Starts prefetching the objects in listing from container and returns
+        the Prefetcher(). retrieve_object() calls for the listed objects are
+        served from it until the listing is exhausted or it is stopped.
+    '''
+    if listing is None:
+        raise CreateRequestException('a listing of objects to prefetch is required')
+    return Prefetcher(session, container, listing, depth, max_depth, max_bytes).start()
+
+'''
+
+    EOF
+
+'''
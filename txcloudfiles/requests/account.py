@@ -29,6 +29,7 @@ from txcloudfiles.transport import Request, Response
 from txcloudfiles.errors import NotAuthenticatedException, ResponseException
 from txcloudfiles.helpers import parse_int, parse_str
 from txcloudfiles.cfaccount import Account
+from txcloudfiles.cache import account_key, read_through
 
 ''' requests '''
 
@@ -61,21 +62,27 @@ def get_account_metadata(session):
     '''
         Returns an Account() object populated with metadata on success.
     '''
-    d = Deferred()
-    def _parse(r):
-        if r.OK:
-            account = Account(session.get_username())
-            account.set_container_count(r.headers.get('X-Account-Container-Count', ''))
-            account.set_bytes_used(r.headers.get('X-Account-Bytes-Used', ''))
-            d.callback((r, account))
-        elif r.status_code == 401:
-            d.errback(NotAuthenticatedException('failed to get account information, not authorised'))
-        else:
-            d.errback(ResponseException('failed to get account information'))
-    request = AccountMetadataRequest(session)
-    request.set_parser(_parse)
-    request.run()
-    return d
+    cache = session.get_metadata_cache()
+    def _fetch(stale):
+        d = Deferred()
+        token = cache.get_token() if cache is not None else None
+        def _parse(r):
+            if r.OK:
+                account = Account(session.get_username())
+                account.set_container_count(r.headers.get('X-Account-Container-Count', ''))
+                account.set_bytes_used(r.headers.get('X-Account-Bytes-Used', ''))
+                if cache is not None:
+                    cache.set(account_key(), (r, account), token)
+                d.callback((r, account))
+            elif r.status_code == 401:
+                d.errback(NotAuthenticatedException('failed to get account information, not authorised'))
+            else:
+                d.errback(ResponseException('failed to get account information'))
+        request = AccountMetadataRequest(session)
+        request.set_parser(_parse)
+        request.run()
+        return d
+    return read_through(cache, account_key(), _fetch)
 
 def set_temp_url_key(session, key=''):
     '''
@@ -85,6 +92,9 @@ def set_temp_url_key(session, key=''):
     d = Deferred()
     def _parse(r):
         if r.OK:
+            cache = session.get_metadata_cache()
+            if cache is not None:
+                cache.invalidate(account_key())
             d.callback((r, True))
         elif r.status_code == 401:
             d.errback(NotAuthenticatedException('failed to set temp url key, not authorised'))
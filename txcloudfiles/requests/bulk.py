@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+    Copyright 2012 Joe Harris
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+'''
+
+'''
+
+    Provides request structure for bulk operations on many objects.
+
+'''
+
+import os
+from urllib import quote, unquote, unquote_plus
+from twisted.internet import reactor
+from twisted.internet.task import deferLater
+from twisted.internet.defer import Deferred, DeferredSemaphore, DeferredList
+from txcloudfiles.transport import Request, Response
+from txcloudfiles.errors import NotAuthenticatedException, ResponseException, CreateRequestException
+from txcloudfiles.helpers import parse_int
+from txcloudfiles.cfcontainer import Container, name_key
+from txcloudfiles.cfobject import Object
+from txcloudfiles.cfbulk import BulkDeleteResult, BulkUploadResult
+from txcloudfiles.stream import ArchiveProducer
+from txcloudfiles.requests.objects import DeleteObjectRequest, _object_created, _object_deleted
+
+''' requests '''
+
+class BulkDeleteRequest(Request):
+    '''
+        Delete many objects in a single request.
+    '''
+    QUERY_STRING = {
+        'bulk-delete': 'true',
+    }
+    METHOD = Request.DELETE
+    REQUIRED_BODY = True
+    REQUEST_TYPE = Request.REQUEST_STORAGE
+    EXPECTED_BODY = Response.FORMAT_JSON
+    EXPECTED_RESPONSE_CODE = Response.HTTP_SUCCESSFUL
+
+class ExtractArchiveRequest(Request):
+    '''
+        Create the objects in a tar archive in a single request.
+    '''
+    METHOD = Request.PUT
+    REQUIRED_BODY = True
+    REQUEST_TYPE = Request.REQUEST_STORAGE
+    EXPECTED_BODY = Response.FORMAT_JSON
+    EXPECTED_RESPONSE_CODE = Response.HTTP_SUCCESSFUL
+
+''' response object wrappers '''
+
+# responses from a cluster without the bulk middleware, which often refuses
+# the bulk-delete query with a 403
+BULK_UNAVAILABLE = (
+    Response.HTTP_FORBIDDEN,
+    Response.HTTP_NOT_FOUND,
+    Response.HTTP_METHOD_NOT_ALLOWED,
+    Response.HTTP_NOT_IMPLEMENTED,
+)
+# seconds to wait before the first retry, doubled for each one after
+RETRY_DELAY = 1
+# bytes of files to put in a single archive upload
+ARCHIVE_SIZE = 64*1024*1024
+
+def _retryable(status):
+    # no response at all, rate limiting or a server side failure
+    return status == 0 or status == Response.HTTP_RATE_LIMITED or status >= 500
+
+def _path(container, obj):
+    # container names are stored quoted
+    return '%s/%s' % (unquote_plus(container.get_name()), name_key(obj))
+
+def _bulk_status(r):
+    '''
+        Returns the status the bulk middleware reports inside its response
+        body, such as 400 from '400 Bad Request'.
+    '''
+    return parse_int(str(r.json.get('Response Status', '200')).split(' ')[0])
+
+def _bulk_supported(r):
+    '''
+        Returns boolean False if the response came from a cluster without the
+        bulk middleware, which answers with an error or a plain response.
+    '''
+    if r.status_code in BULK_UNAVAILABLE:
+        return False
+    if r.status_code in Response.HTTP_SUCCESSFUL:
+        return type(r.json) == dict and 'Response Status' in r.json
+    return True
+
+def _bulk_failures(r, paths, items):
+    '''
+        Returns a dict of the items a bulk response reports as failed to their
+        status, every item fails if the whole request failed. paths maps the
+        unquoted object paths the middleware reports to items.
+    '''
+    ok = r.status_code in Response.HTTP_SUCCESSFUL
+    status = _bulk_status(r) if ok else r.status_code
+    failed = {}
+    for path, error in (r.json.get('Errors', []) if ok else []):
+        item = paths.get(unquote(path).lstrip('/'), None)
+        if item is not None:
+            failed[item] = parse_int(str(error).split(' ')[0])
+    if status >= 400 and not failed:
+        # the whole request was rejected
+        failed = dict((item, status) for item in items)
+    return failed
+
+def _bulk_missing(r, failed, items):
+    '''
+        Returns the status of the items of a bulk delete which did not fail,
+        200 if they were all deleted, 404 if none were found or None if the
+        middleware counted some of each.
+    '''
+    if r.status_code not in Response.HTTP_SUCCESSFUL:
+        # every item failed with the request
+        return r.status_code
+    deleted = parse_int(r.json.get('Number Deleted', 0))
+    # objects listed in Errors as not found are counted twice
+    missing = parse_int(r.json.get('Number Not Found', 0)) - len([s for s in failed.values() if s == Response.HTTP_NOT_FOUND])
+    remaining = len([item for item in items if item not in failed])
+    if missing <= 0:
+        return Response.HTTP_OK
+    if deleted <= 0 or missing >= remaining:
+        return Response.HTTP_NOT_FOUND
+    return None
+
+def _later(delay, attempt):
+    return deferLater(reactor, delay * (2 ** (attempt - 1)), lambda: None)
+
+def delete_objects(session, container=None, objects=(), batch_size=0, retries=2, concurrency=4, retry_delay=RETRY_DELAY):
+    '''
+        Deletes many objects using as few requests as possible and fires with
+        a (last response, BulkDeleteResult()) tuple. objects are Object()
+        instances or names in container, or (container, object) pairs if no
+        container is given.
+
+        Objects are deleted in batches of up to batch_size with the bulk
+        delete middleware, up to concurrency batches at once. Objects which
+        fail with a server side error are retried up to retries times. If the
+        cluster does not support bulk deletes the objects are deleted with
+        up to concurrency single requests at once instead.
+    '''
+    if type(container) == str or type(container) == unicode:
+        container = Container(name=container)
+    if container is not None and not isinstance(container, Container):
+        raise CreateRequestException('first argument must be a Container() instance, a string or None')
+    items = []
+    for item in objects:
+        c, obj = (container, item) if container is not None else item
+        if type(c) == str or type(c) == unicode:
+            c = Container(name=c)
+        if type(obj) == str or type(obj) == unicode:
+            obj = Object(name=obj)
+        if not isinstance(c, Container) or not isinstance(obj, Object):
+            raise CreateRequestException('objects must be Object() instances or strings, or (container, object) pairs without a container')
+        items.append((c, obj))
+    batch_size = parse_int(batch_size)
+    batch_size = session.BULK_DELETE_LIMIT if batch_size < 1 or batch_size > session.BULK_DELETE_LIMIT else batch_size
+    retries = max(parse_int(retries), 0)
+    batches = DeferredSemaphore(max(parse_int(concurrency), 1))
+    singles = DeferredSemaphore(max(parse_int(concurrency), 1))
+    result = BulkDeleteResult()
+    state = {'response': None}
+    d = Deferred()
+
+    def _outcome(c, obj, status):
+        if status is None:
+            result.unresolved.append((c.get_name(), name_key(obj)))
+        elif status in Response.HTTP_SUCCESSFUL:
+            result.deleted.append((c.get_name(), name_key(obj)))
+        elif status == Response.HTTP_NOT_FOUND:
+            result.not_found.append((c.get_name(), name_key(obj)))
+        else:
+            result.failed.append((c.get_name(), name_key(obj), status))
+            return
+        _object_deleted(session, c, obj)
+
+    def _retry(batch, attempt, send):
+        result._retries += 1
+        return _later(retry_delay, attempt).addCallback(lambda _: send(batch, attempt))
+
+    def _single(c, obj, attempt):
+        s = Deferred()
+        def _parse(r):
+            result._requests += 1
+            state['response'] = r
+            if r.status_code == 401:
+                s.errback(NotAuthenticatedException('failed to delete objects, not authorised'))
+            elif r.status_code not in Response.HTTP_SUCCESSFUL and _retryable(r.status_code) and attempt < retries:
+                _retry((c, obj), attempt + 1, lambda item, n: _single(item[0], item[1], n)).chainDeferred(s)
+            else:
+                _outcome(c, obj, r.status_code)
+                s.callback(None)
+        request = DeleteObjectRequest(session)
+        request.set_parser(_parse)
+        request.set_container(c)
+        request.set_object(obj)
+        request.run()
+        return s
+
+    def _singles(batch):
+        deletes = [singles.run(_single, c, obj, 0) for c, obj in batch]
+        dl = DeferredList(deletes, fireOnOneErrback=True, consumeErrors=True)
+        return dl.addErrback(lambda f: f.value.subFailure)
+
+    def _bulk(batch, attempt=0):
+        if not result.bulk:
+            return _singles(batch)
+        b = Deferred()
+        paths = dict((_path(c, obj), (c, obj)) for c, obj in batch)
+        def _parse(r):
+            result._requests += 1
+            state['response'] = r
+            if r.status_code == 401:
+                return b.errback(NotAuthenticatedException('failed to delete objects, not authorised'))
+            if not _bulk_supported(r):
+                # fall back to single deletes for this and every later batch
+                result.bulk = False
+                return _singles(batch).chainDeferred(b)
+            failed = _bulk_failures(r, paths, batch)
+            status = _bulk_missing(r, failed, batch)
+            again = []
+            for item in batch:
+                if item in failed and _retryable(failed[item]) and attempt < retries:
+                    again.append(item)
+                elif item in failed:
+                    _outcome(item[0], item[1], failed[item])
+                else:
+                    _outcome(item[0], item[1], status)
+            if again:
+                _retry(again, attempt + 1, _bulk).chainDeferred(b)
+            else:
+                b.callback(None)
+        request = BulkDeleteRequest(session)
+        request.set_parser(_parse)
+        request.set_header(('Content-Type', 'text/plain'))
+        request.set_header(('Accept', 'application/json'))
+        request.set_body(''.join('/%s\n' % quote(path) for path in paths))
+        request.run()
+        return b
+
+    def _done(_):
+        result._finish()
+        d.callback((state['response'], result))
+
+    requests = [batches.run(_bulk, items[i:i + batch_size]) for i in xrange(0, len(items), batch_size)]
+    dl = DeferredList(requests, fireOnOneErrback=True, consumeErrors=True)
+    dl.addCallbacks(_done, lambda f: d.errback(f.value.subFailure))
+    return d
+
+def _local_files(files):
+    '''
+        Returns a list of (local path, object name) tuples for a directory,
+        which is walked with object names relative to it, or a list of paths
+        or (path, object name) tuples.
+    '''
+    if type(files) == str or type(files) == unicode:
+        if not os.path.isdir(files):
+            raise CreateRequestException('%s is not a directory' % files)
+        found = []
+        for directory, subdirs, filenames in os.walk(files):
+            subdirs.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(directory, filename)
+                if os.path.isfile(path):
+                    found.append((path, os.path.relpath(path, files).replace(os.sep, '/')))
+        return found
+    found = []
+    for item in files:
+        if type(item) == str or type(item) == unicode:
+            item = (item, os.path.basename(item))
+        found.append((item[0], item[1].lstrip('/')))
+    return found
+
+def _archives(files, archive_size, limit):
+    '''
+        Splits files into batches of up to archive_size bytes of archive and
+        limit files, a file larger than archive_size is sent on its own.
+    '''
+    batches, batch, size = [], [], 0
+    for path, name in files:
+        length = os.path.getsize(path)
+        # a tar header and padding to a whole block for every file
+        length += 512 + (-length % 512)
+        if batch and (size + length > archive_size or len(batch) >= limit):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append((path, name))
+        size += length
+    if batch:
+        batches.append(batch)
+    return batches
+
+def upload_files(session, container=None, files=(), archive_size=ARCHIVE_SIZE, compress=False, retries=2, concurrency=2, retry_delay=RETRY_DELAY):
+    '''
+        Creates objects from many local files using as few requests as
+        possible and fires with a (last response, BulkUploadResult()) tuple.
+        files is a directory, whose files are uploaded with their paths
+        relative to it as object names, or a list of paths or (path, object
+        name) tuples.
+
+        The files are streamed as tar archives of up to archive_size bytes,
+        gzip compressed if compress is set, which the archive extraction
+        middleware unpacks into container. Up to concurrency archives are
+        sent at once. Files which fail with a server side error are sent
+        again in a new archive up to retries times.
+    '''
+    if type(container) == str or type(container) == unicode:
+        container = Container(name=container)
+    if not isinstance(container, Container):
+        raise CreateRequestException('first argument must be a Container() instance or a string')
+    batches = _archives(_local_files(files), max(parse_int(archive_size), 1), session.BULK_UPLOAD_LIMIT)
+    retries = max(parse_int(retries), 0)
+    semaphore = DeferredSemaphore(max(parse_int(concurrency), 1))
+    result = BulkUploadResult()
+    state = {'response': None}
+    d = Deferred()
+
+    def _extract(batch, attempt=0):
+        e = Deferred()
+        paths = dict(('%s/%s' % (unquote_plus(container.get_name()), name_key(name)), (path, name)) for path, name in batch)
+        def _parse(r):
+            result._requests += 1
+            state['response'] = r
+            if r.status_code == 401:
+                return e.errback(NotAuthenticatedException('failed to upload files, not authorised'))
+            if not _bulk_supported(r):
+                return e.errback(ResponseException('failed to upload files, archive extraction is not supported'))
+            failed = _bulk_failures(r, paths, batch)
+            again = []
+            for item in batch:
+                if item in failed and _retryable(failed[item]) and attempt < retries:
+                    again.append(item)
+                elif item in failed:
+                    result.failed.append((name_key(item[1]), failed[item]))
+                else:
+                    result.created.append(name_key(item[1]))
+                    result._bytes += os.path.getsize(item[0])
+                    _object_created(session, container, Object(name=item[1]))
+            if again:
+                result._retries += 1
+                _later(retry_delay, attempt + 1).addCallback(lambda _: _extract(again, attempt + 1)).chainDeferred(e)
+            else:
+                e.callback(None)
+        result._archives += 1
+        request = ExtractArchiveRequest(session)
+        request.set_parser(_parse)
+        request.set_container(container)
+        request.set_query_string(('extract-archive', 'tar.gz' if compress else 'tar'))
+        request.set_header(('Accept', 'application/json'))
+        try:
+            request.set_stream(ArchiveProducer(batch, compress))
+        except OSError, ex:
+            raise CreateRequestException('failed to upload files, %s' % ex)
+        request.run()
+        return e
+
+    def _done(_):
+        result._finish()
+        d.callback((state['response'], result))
+
+    uploads = [semaphore.run(_extract, batch) for batch in batches]
+    dl = DeferredList(uploads, fireOnOneErrback=True, consumeErrors=True)
+    dl.addCallbacks(_done, lambda f: d.errback(f.value.subFailure))
+    return d
+
+'''
+
+    EOF
+
+'''
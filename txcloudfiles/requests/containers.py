@@ -24,11 +24,14 @@
 
 '''
 
+from urllib import quote
 from twisted.internet.defer import Deferred
 from txcloudfiles.transport import Request, Response
 from txcloudfiles.errors import NotAuthenticatedException, ResponseException, CreateRequestException
 from txcloudfiles.helpers import parse_int, parse_str, Metadata
 from txcloudfiles.cfcontainer import Container, ContainerSet
+from txcloudfiles.cache import container_key, read_through
+from txcloudfiles.requests.listing import Pager
 
 ''' requests '''
 
@@ -78,15 +81,24 @@ class UpdateContainerMetadataRequest(Request):
 
 ''' response object wrappers '''
 
+def _container_changed(session, container, objects=False):
+    cache = session.get_metadata_cache()
+    if cache is not None:
+        cache.invalidate_container(container, objects)
+    listings = session.get_listing_cache()
+    if listings is not None and objects:
+        listings.invalidate_container(container)
+
 def list_containers(session):
     '''
         Returns a ContainerSet() object populated with Containers() on success.
     '''
     d = Deferred()
+    containerset = ContainerSet()
     def _parse(r):
-        if r.OK:
-            containerset = ContainerSet()
-            containerset.add_containers(r.json)
+        if r.OK and (type(r.json) == list or r.status_code == 204):
+            # entries have already been added as they were decoded
+            containerset.add_request()
             d.callback((r, containerset))
         elif r.status_code == 401:
             d.errback(NotAuthenticatedException('failed to get a list of containers, not authorised'))
@@ -94,41 +106,46 @@ def list_containers(session):
             d.errback(ResponseException('failed to get a list of containers'))
     request = ListContainersRequest(session)
     request.set_parser(_parse)
+    request.set_entry_callback(containerset.extend_containers)
     request.run()
     return d
 
-def list_all_containers(session, limit=10000):
+class ContainerPager(Pager):
     '''
-        A slower and more elaborate version of list_containers. Performs
-        sucessive recursive requests on accounts with large numbers of
-        containers. Returns a single (and possibly very large) ContainerSet()
-        populated with Containers() on success.
+        Pages through the containers in an account, each page is a
+        ContainerSet() holding only that page of containers.
     '''
-    limit = parse_int(limit)
-    limit = session.CONTAINER_LIMIT if limit > session.CONTAINER_LIMIT else limit
-    limit = session.CONTAINER_LIMIT if limit < 1 else limit
-    d = Deferred()
-    containerset = ContainerSet()
-    def _parse(r):
-        if r.OK:
-            containerset.add_containers(r.json)
-            if len(r.json) == limit:
-                request = ListContainersRequest(session)
-                request.set_parser(_parse)
-                request.set_query_string(('limit', limit))
-                request.set_query_string(('marker', containerset.get_last_container().get_name()))
-                request.run()
-            else:
-                d.callback((r, containerset))
-        elif r.status_code == 401:
-            d.errback(NotAuthenticatedException('failed to get a block of containers, not authorised'))
-        else:
-            d.errback(ResponseException('failed to get a block of containers'))
-    request = ListContainersRequest(session)
-    request.set_parser(_parse)
-    request.set_query_string(('limit', limit))
-    request.run()
-    return d
+
+    def __init__(self, session, limit=0, prefix=None, marker=None, prefetch=Pager.PREFETCH):
+        add_entries = lambda page, entries: page.add_containers(entries)
+        extend_entries = lambda page, entries: page.extend_containers(entries)
+        error = 'failed to get a block of containers'
+        Pager.__init__(self, session, session.CONTAINER_LIMIT, self._get_request, ContainerSet, add_entries, extend_entries, error, limit, marker, prefetch)
+        self._prefix = prefix
+
+    def _get_request(self):
+        request = ListContainersRequest(self._session)
+        if self._prefix != None:
+            request.set_query_string(('prefix', quote(parse_str(self._prefix), safe='')))
+        return request
+
+def list_container_pages(session, limit=0, prefix=None, marker=None, prefetch=Pager.PREFETCH):
+    '''
+        Returns a ContainerPager() which lazily requests the containers in
+        the account one page at a time, keeping up to prefetch pages in
+        flight ahead of the consumer.
+    '''
+    return ContainerPager(session, limit, prefix, marker, prefetch)
+
+def list_all_containers(session, limit=10000, prefetch=Pager.PREFETCH):
+    '''
+        A slower and more elaborate version of list_containers. Pages through
+        accounts with large numbers of containers and returns a single (and
+        possibly very large) ContainerSet() populated with Containers() on
+        success. Use list_container_pages() to handle one page at a time
+        instead.
+    '''
+    return list_container_pages(session, limit, None, None, prefetch).collect()
 
 def create_container(session, name='', metadata={}):
     '''
@@ -139,6 +156,7 @@ def create_container(session, name='', metadata={}):
     d = Deferred()
     def _parse(r):
         if r.OK:
+            _container_changed(session, container)
             d.callback((r, True))
         elif r.status_code == 401:
             d.errback(NotAuthenticatedException('failed to create container, not authorised'))
@@ -163,6 +181,7 @@ def delete_container(session, container=None):
     d = Deferred()
     def _parse(r):
         if r.OK:
+            _container_changed(session, container, True)
             d.callback((r, True))
         elif r.status_code == 401:
             d.errback(NotAuthenticatedException('failed to delete container, not authorised'))
@@ -186,24 +205,35 @@ def get_container_metadata(session, container=None):
         container = Container(name=container)
     if not isinstance(container, Container):
         raise CreateRequestException('first argument must be a Container() instance or a string')
-    d = Deferred()
-    def _parse(r):
-        if r.OK:
-            container_name = r.request._container.get_name()
-            container = Container(name=container_name)
-            container.set_metadata(r.metadata)
-            d.callback((r, container))
-        elif r.status_code == 401:
-            d.errback(NotAuthenticatedException('failed to get container metadata, not authorised'))
-        elif r.status_code == 404:
-            d.errback(ResponseException('failed to get container metadata, container does not exist'))
-        else:
-            d.errback(ResponseException('failed to get container metadata'))
-    request = ContainerMetadataRequest(session)
-    request.set_parser(_parse)
-    request.set_container(container)
-    request.run()
-    return d
+    cache = session.get_metadata_cache()
+    key = container_key(container)
+    def _fetch(stale):
+        d = Deferred()
+        token = cache.get_token() if cache is not None else None
+        def _parse(r):
+            if r.OK:
+                container_name = r.request._container.get_name()
+                current = Container(name=container_name)
+                current.set_metadata(r.metadata)
+                current.set_object_count(parse_int(r.headers.get('X-Container-Object-Count', 0)))
+                current.set_bytes(r.headers.get('X-Container-Bytes-Used', 0))
+                if cache is not None:
+                    cache.set(key, (r, current), token)
+                d.callback((r, current))
+            elif r.status_code == 401:
+                d.errback(NotAuthenticatedException('failed to get container metadata, not authorised'))
+            elif r.status_code == 404:
+                if cache is not None:
+                    cache.invalidate(key)
+                d.errback(ResponseException('failed to get container metadata, container does not exist'))
+            else:
+                d.errback(ResponseException('failed to get container metadata'))
+        request = ContainerMetadataRequest(session)
+        request.set_parser(_parse)
+        request.set_container(container)
+        request.run()
+        return d
+    return read_through(cache, key, _fetch)
 
 def set_container_metadata(session, container=None, metadata={}):
     '''
@@ -217,6 +247,7 @@ def set_container_metadata(session, container=None, metadata={}):
     d = Deferred()
     def _parse(r):
         if r.OK:
+            _container_changed(session, container)
             d.callback((r, True))
         elif r.status_code == 401:
             d.errback(NotAuthenticatedException('failed to set container metadata, not authorised'))
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+    Copyright 2012 Joe Harris
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+'''
+
+'''
+
+    Provides the paging engine shared by container and object listings.
+
+'''
+
+from collections import deque
+from urllib import quote
+from twisted.internet.defer import Deferred, DeferredLock, succeed, maybeDeferred
+from txcloudfiles.errors import NotAuthenticatedException, ResponseException
+from txcloudfiles.helpers import parse_int, parse_str
+
+def encode_name(name):
+    return name.encode('utf-8') if type(name) == unicode else parse_str(name)
+
+class LastEntry(object):
+    '''
+        Counts the entries of a listing as they are decoded and keeps the
+        UTF-8 encoded name of the last one, the marker for the page after it.
+    '''
+
+    __slots__ = ('count', 'name')
+
+    def __init__(self):
+        self.count = 0
+        self.name = ''
+
+    def add(self, entries):
+        if entries:
+            self.count += len(entries)
+            self.name = encode_name(entries[-1].get('name', entries[-1].get('subdir', '')))
+
+class Pager(object):
+    '''
+        Lazily requests a marker-paged listing one page at a time so only one
+        page of entries needs to be held in memory. next_page() returns a
+        deferred which fires with the next page, or None once the listing is
+        exhausted, which makes it simple to use with inlineCallbacks:
+
+            pager = session.list_object_pages('container')
+            while True:
+                page = yield pager.next_page()
+                if page is None:
+                    break
+                for obj in page:
+                    ...
+
+        Entries are decoded and added to a page as its body arrives. The
+        request for the following page is sent as soon as the last entry of
+        a full page has been decoded, before the rest of the body arrives or
+        the page is handed to the consumer. Up to prefetch pages are
+        requested ahead of the consumer.
+
+        Subclasses pass in what differs between kinds of listing: the most
+        entries a page may hold, a function returning a listing Request()
+        without a parser, limit or marker, a function returning an empty
+        page, functions which add the first and further entries of a request
+        to a page and the message for a failed request.
+    '''
+
+    # pages requested ahead of the page being consumed
+    PREFETCH = 1
+
+    def __init__(self, session, limit_max, new_request, new_page, add_entries, extend_entries, error, limit=0, marker=None, prefetch=PREFETCH):
+        limit = parse_int(limit)
+        self._session = session
+        self._new_request = new_request
+        self._new_page = new_page
+        self._add_entries = add_entries
+        self._extend_entries = extend_entries
+        self._error = error
+        self._limit = limit_max if limit < 1 or limit > limit_max else limit
+        self._prefetch = max(parse_int(prefetch), 0)
+        self._marker = parse_str(marker) if marker else ''
+        self._lock = DeferredLock()
+        self._queue = deque()
+        self._next_marker = self._marker
+        self._ready = True
+        self._more = True
+        self._requests = 0
+        self._response = None
+        self._into = None
+
+    def __repr__(self):
+        d = (self.__class__.__name__, self._requests, 'more' if self.has_more() else 'done', hex(id(self)))
+        return '<CloudFiles %s object (%s pages, %s) at %s>' % d
+
+    def _get_error(self, r):
+        if r.status_code == 401:
+            return NotAuthenticatedException('%s, not authorised' % self._error)
+        elif r.status_code == 404:
+            return ResponseException('%s, container does not exist' % self._error)
+        return ResponseException(self._error)
+
+    def _fetch(self, marker):
+        '''
+            Requests the page after marker, fires with a (response, page,
+            LastEntry()) tuple.
+        '''
+        d = Deferred()
+        page = self._into if self._into is not None else self._new_page()
+        last = LastEntry()
+        def _entries(entries):
+            if last.count == 0:
+                self._add_entries(page, entries)
+            else:
+                self._extend_entries(page, entries)
+            full = last.count >= self._limit
+            last.add(entries)
+            if not full and last.count >= self._limit:
+                self._got_last(last)
+        def _body(body):
+            if type(body) != list:
+                self._more = False
+            elif last.count < self._limit:
+                self._got_last(last)
+        def _parse(r):
+            if r.OK and (type(r.json) == list or r.status_code == 204):
+                d.callback((r, page, last))
+            else:
+                self._more = False
+                d.errback(self._get_error(r))
+        request = self._new_request()
+        request.set_parser(_parse)
+        request.set_entry_callback(_entries)
+        request.set_body_callback(_body)
+        request.set_query_string(('limit', self._limit))
+        if marker:
+            request.set_query_string(('marker', quote(marker, safe='')))
+        request.run()
+        return d
+
+    def _got_last(self, last):
+        '''
+            Called once the last entry of the most recently requested page is
+            known, the next page can be requested if this one was full.
+        '''
+        if last.count >= self._limit and last.name:
+            self._next_marker = last.name
+            self._ready = True
+            self._fill(0)
+        else:
+            self._more = False
+
+    def _fill(self, wanted):
+        '''
+            Requests the next page if its marker is known and fewer than the
+            prefetch depth plus wanted pages are queued.
+        '''
+        if self._ready and self._more and len(self._queue) < self._prefetch + wanted:
+            self._ready = False
+            self._queue.append(self._fetch(self._next_marker))
+
+    def _got_entries(self, r, page, last):
+        self._requests += 1
+        self._response = r
+        if last.count == 0:
+            return None
+        self._marker = last.name
+        return page
+
+    def _next_page(self):
+        self._fill(1)
+        if not self._queue:
+            return succeed(None)
+        d = self._queue.popleft()
+        self._fill(0)
+        return d.addCallback(lambda result: self._got_entries(*result))
+
+    def next_page(self):
+        '''
+            Returns a deferred which fires with the next page of entries or
+            None once there are no more. Calls made while a page is in flight
+            are queued behind it.
+        '''
+        return self._lock.run(self._next_page)
+
+    def each_page(self, callback):
+        '''
+            Calls callback with every remaining page in turn, waiting for any
+            deferred it returns before requesting the next page. Fires with
+            the number of pages requested once the listing is exhausted.
+        '''
+        d = Deferred()
+        def _next(_=None):
+            self.next_page().addCallbacks(_got, d.errback)
+        def _got(page):
+            if page is None:
+                d.callback(self._requests)
+            else:
+                maybeDeferred(callback, page).addCallbacks(_next, d.errback)
+        _next()
+        return d
+
+    def collect(self, into=None):
+        '''
+            Collects every remaining page into a single page, or into the
+            given page such as an Inventory(), fires with a (last response,
+            page) tuple.
+        '''
+        self._into = into if into is not None else self._new_page()
+        d = self.each_page(lambda page: None)
+        return d.addCallback(lambda _: (self._response, self._into))
+
+    def has_more(self):
+        return self._more or len(self._queue) > 0
+
+    def get_marker(self):
+        return self._marker
+
+    def get_request_count(self):
+        return self._requests
+
+    def get_last_response(self):
+        return self._response
+
+class ShardedPager(Pager):
+    '''
+        Lists several disjoint shards of a keyspace at the same time and
+        returns their pages in name order. Up to concurrency shards are
+        listed at once, each buffering at most its prefetch depth of pages
+        until the consumer reaches it. Shards must be given in name order.
+    '''
+
+    # shards listed at the same time
+    CONCURRENCY = 4
+
+    def __init__(self, session, shards, concurrency=CONCURRENCY):
+        shards = list(shards)
+        Pager.__init__(self, session, session.OBJECT_LIMIT, None, shards[0]._new_page, None, None, '')
+        self._shards = shards
+        self._concurrency = max(parse_int(concurrency), 1)
+        self._current = 0
+        self._primed = 0
+
+    def __repr__(self):
+        d = (self.__class__.__name__, len(self._shards), self._current, hex(id(self)))
+        return '<CloudFiles %s object (%s shards, at %s) at %s>' % d
+
+    def _prime(self):
+        '''
+            Starts listing the shards within the concurrency window.
+        '''
+        while self._primed < min(self._current + self._concurrency, len(self._shards)):
+            self._shards[self._primed]._fill(1)
+            self._primed += 1
+
+    def _next_page(self):
+        self._prime()
+        if self._current >= len(self._shards):
+            return succeed(None)
+        def _got(page):
+            if page is None:
+                self._current += 1
+                return self._next_page()
+            self._response = self._shards[self._current].get_last_response()
+            if self._into is not None:
+                self._into.merge(page)
+            return page
+        return self._shards[self._current].next_page().addCallback(_got)
+
+    def has_more(self):
+        return self._current < len(self._shards)
+
+    def get_marker(self):
+        if self._current < len(self._shards):
+            return self._shards[self._current].get_marker()
+        return self._shards[-1].get_marker() if self._shards else ''
+
+    def get_request_count(self):
+        return sum(shard.get_request_count() for shard in self._shards)
+
+    def get_shard_count(self):
+        return len(self._shards)
+
+def shard_ranges(split_points, marker=None):
+    '''
+        Turns sorted split points into (marker, end_marker) shard ranges. Each
+        split point is the last name of its shard, the end marker appends a
+        null byte (which names may not contain) to make it inclusive.
+    '''
+    points = sorted(set(encode_name(p) for p in split_points if p))
+    lower = parse_str(marker) if marker else ''
+    ranges = []
+    for upper in points:
+        if upper > lower:
+            ranges.append((lower, upper + '\x00'))
+            lower = upper
+    ranges.append((lower, None))
+    return ranges
+
+def shard_prefixes(prefixes):
+    '''
+        Sorts prefixes and drops any already covered by a shorter prefix so
+        the shards never overlap.
+    '''
+    shards = []
+    for prefix in sorted(set(encode_name(p) for p in prefixes)):
+        if not shards or not prefix.startswith(shards[-1]):
+            shards.append(prefix)
+    return shards
+
+def split_points_from_sample(names, shards):
+    '''
+        Picks split points which divide a sample of names, such as an earlier
+        listing or snapshot, into the given number of evenly sized shards.
+    '''
+    names = sorted(names)
+    shards = max(parse_int(shards), 1)
+    if len(names) < shards:
+        return names
+    step = len(names) / float(shards)
+    return [names[int(step * i) - 1] for i in range(1, shards)]
+
+
+'''
+
+    EOF
+
+'''
@@ -25,14 +25,21 @@
 '''
 
 from time import mktime
+from urllib import quote
 from datetime import datetime
-from twisted.internet.defer import Deferred
+from twisted.internet.defer import Deferred, gatherResults, succeed, fail
 from txcloudfiles.transport import Request, Response
 from txcloudfiles.errors import NotAuthenticatedException, ResponseException, CreateRequestException
-from txcloudfiles.helpers import parse_int, parse_str, Metadata
+from txcloudfiles.helpers import parse_int, parse_str, format_range, format_ranges, format_http_date, parse_content_range, Metadata
+from txcloudfiles.stream import ByteRangesProtocol
+from txcloudfiles.requests.listing import Pager, ShardedPager, LastEntry, shard_ranges, shard_prefixes, encode_name
 from txcloudfiles.cfaccount import Account
 from txcloudfiles.cfcontainer import Container, ContainerSet
-from txcloudfiles.cfobject import Object
+from txcloudfiles.cfobject import Object, NotModified
+from txcloudfiles.cfsnapshot import write_snapshot
+from txcloudfiles.bloom import BloomFilter
+from txcloudfiles.cache import object_key, listing_key, read_through
+from txcloudfiles.requests.containers import get_container_metadata
 
 ''' requests '''
 
@@ -50,13 +57,29 @@ class ListObjectsRequest(Request):
 
 class RetrieveObjectRequest(Request):
     '''
-        Get an object and all its data.
+        Get an object and all its data, or a 304 if the object matches the
+        conditions sent.
     '''
     METHOD = Request.GET
     REQUEST_TYPE = Request.REQUEST_STORAGE
-    EXPECTED_RESPONSE_CODE = Response.HTTP_SUCCESSFUL
+    EXPECTED_RESPONSE_CODE = Response.HTTP_CONDITIONAL
     EXPECTED_BODY = Request.BINARY
 
+class RetrieveObjectRangesRequest(RetrieveObjectRequest):
+    '''
+        Get several byte ranges of an object in a single request. A
+        multipart/byteranges response is parsed into parts as it arrives.
+    '''
+
+    def _get_body_protocol(self, d, response, budget):
+        content_type = (response.headers.getRawHeaders('content-type') or [''])[0]
+        if content_type.lower().startswith('multipart/byteranges'):
+            for param in content_type.split(';')[1:]:
+                k, sep, v = param.strip().partition('=')
+                if k.lower() == 'boundary':
+                    return ByteRangesProtocol(d, v.strip('"'), budget, response.length)
+        return RetrieveObjectRequest._get_body_protocol(self, d, response, budget)
+
 class CreateObjectRequest(Request):
     '''
         Create an object.
@@ -69,6 +92,18 @@ class CreateObjectRequest(Request):
     REQUEST_TYPE = Request.REQUEST_STORAGE
     EXPECTED_RESPONSE_CODE = Response.HTTP_SUCCESSFUL
 
+class CreateManifestRequest(Request):
+    '''
+        Create a zero byte large object manifest.
+    '''
+    METHOD = Request.PUT
+    REQUIRED_HEADERS = (
+        'Content-Length',
+        'X-Object-Manifest',
+    )
+    REQUEST_TYPE = Request.REQUEST_STORAGE
+    EXPECTED_RESPONSE_CODE = Response.HTTP_SUCCESSFUL
+
 class DeleteObjectRequest(Request):
     '''
         Delete an object.
@@ -79,11 +114,12 @@ class DeleteObjectRequest(Request):
 
 class ObjectMetadataRequest(Request):
     '''
-        Get object metadata.
+        Get object metadata, or a 304 if the object matches the conditions
+        sent.
     '''
     METHOD = Request.HEAD
     REQUEST_TYPE = Request.REQUEST_STORAGE
-    EXPECTED_RESPONSE_CODE = Response.HTTP_SUCCESSFUL
+    EXPECTED_RESPONSE_CODE = Response.HTTP_CONDITIONAL
 
 class UpdateObjectMetadataRequest(Request):
     '''
@@ -103,93 +139,172 @@ class CopyObjectRequest(Request):
 
 ''' response object wrappers '''
 
-def list_objects(session, container=None, prefix=None, path=None, delimiter=None):
+def list_objects(session, container=None, prefix=None, path=None, delimiter=None, marker=None, limit=0):
     '''
-        Returns a Container() populated with objects on success.
+        Returns a Container() populated with objects on success, up to limit
+        objects after marker if they are given. Listings are served from the
+        session's listing cache when one is set, including stale listings
+        while they are refreshed, callers share the cached Container() and
+        must not modify it.
     '''
     if type(container) == str or type(container) == unicode:
         container = Container(name=container)
     if not isinstance(container, Container):
         raise CreateRequestException('first argument must be a Container() instance or a string')
-    d = Deferred()
-    def _parse(r):
-        if r.OK:
-            container = Container()
-            container.add_objects(r.json)
-            d.callback((r, container))
-        elif r.status_code == 401:
-            d.errback(NotAuthenticatedException('failed to get a list of objects, not authorised'))
-        elif r.status_code == 404:
-            d.errback(NotAuthenticatedException('failed to get a list of objects, container does not exist'))
-        else:
-            d.errback(ResponseException('failed to get a list of objects'))
-    request = ListObjectsRequest(session)
-    request.set_parser(_parse)
-    request.set_container(container)
-    if prefix != None:
-        request.set_query_string(('prefix', parse_str(prefix)))
-    if path != None:
-        request.set_query_string(('path', parse_str(path)))
-    if delimiter != None:
-        request.set_query_string(('delimiter', parse_str(delimiter)[:1]))
-    request.run()
-    return d
+    limit = parse_int(limit)
+    limit = session.OBJECT_LIMIT if limit < 1 or limit > session.OBJECT_LIMIT else limit
+    marker = encode_name(marker) if marker else None
+    cache = session.get_listing_cache()
+    key = listing_key(container, prefix, path, delimiter, marker, limit)
+    def _fetch(stale):
+        d = Deferred()
+        token = cache.get_token() if cache is not None else None
+        page = Container()
+        last = LastEntry()
+        def _entries(entries):
+            page.extend_objects(entries)
+            last.add(entries)
+        def _parse(r):
+            if r.OK and (type(r.json) == list or r.status_code == 204):
+                # entries have already been added as they were decoded
+                page.add_request()
+                if cache is not None:
+                    # a full listing may stop short of names after its last
+                    cache.set(key, (r, page), last.name if last.count >= limit else None, token)
+                d.callback((r, page))
+            elif r.status_code == 401:
+                d.errback(NotAuthenticatedException('failed to get a list of objects, not authorised'))
+            elif r.status_code == 404:
+                if cache is not None:
+                    cache.invalidate(key)
+                d.errback(NotAuthenticatedException('failed to get a list of objects, container does not exist'))
+            else:
+                d.errback(ResponseException('failed to get a list of objects'))
+        request = ListObjectsRequest(session)
+        request.set_parser(_parse)
+        request.set_entry_callback(_entries)
+        request.set_container(container)
+        if prefix != None:
+            request.set_query_string(('prefix', parse_str(prefix)))
+        if path != None:
+            request.set_query_string(('path', parse_str(path)))
+        if delimiter != None:
+            request.set_query_string(('delimiter', parse_str(delimiter)[:1]))
+        if marker:
+            request.set_query_string(('marker', quote(marker, safe='')))
+        request.set_query_string(('limit', limit))
+        request.run()
+        return d
+    return read_through(cache, key, _fetch)
 
-def list_all_objects(session, container=None, limit=0, prefix=None, path=None, delimiter=None):
+class ObjectPager(Pager):
+    '''
+        Pages through the objects in a container, each page is a Container()
+        holding only that page of objects.
     '''
-        A slower and more elaborate version of list_objects. Performs
-        sucessive recursive requests on accounts wiRetrieveObjectRequestth large numbers of 
-        objects in a single container. Returns a single (and possibly very
-        large) Container() object.
+
+    def __init__(self, session, container, limit=0, prefix=None, path=None, delimiter=None, marker=None, prefetch=Pager.PREFETCH, end_marker=None):
+        add_entries = lambda page, entries: page.add_objects(entries)
+        extend_entries = lambda page, entries: page.extend_objects(entries)
+        error = 'failed to get a page of objects'
+        Pager.__init__(self, session, session.OBJECT_LIMIT, self._get_request, Container, add_entries, extend_entries, error, limit, marker, prefetch)
+        self._container = container
+        self._prefix = prefix
+        self._path = path
+        self._delimiter = delimiter
+        self._end_marker = end_marker
+
+    def _get_request(self):
+        request = ListObjectsRequest(self._session)
+        request.set_container(self._container)
+        if self._prefix != None:
+            request.set_query_string(('prefix', quote(parse_str(self._prefix), safe='')))
+        if self._path != None:
+            request.set_query_string(('path', quote(parse_str(self._path), safe='')))
+        if self._delimiter != None:
+            request.set_query_string(('delimiter', quote(parse_str(self._delimiter)[:1], safe='')))
+        if self._end_marker:
+            request.set_query_string(('end_marker', quote(parse_str(self._end_marker), safe='')))
+        return request
+
+def list_object_pages(session, container=None, limit=0, prefix=None, path=None, delimiter=None, marker=None, prefetch=Pager.PREFETCH, split_points=None, prefixes=None, concurrency=ShardedPager.CONCURRENCY):
+    '''
+        Returns an ObjectPager() which lazily requests the objects in a
+        container one page at a time, keeping up to prefetch pages in flight
+        ahead of the consumer.
+
+        Huge containers can be listed in parallel by partitioning the names
+        into shards, either by split points (each the last name of its shard,
+        see split_points_from_sample()) or by disjoint prefixes. A
+        ShardedPager() is returned which lists up to concurrency shards at once
+        and still returns pages in name order.
     '''
     if type(container) == str or type(container) == unicode:
         container = Container(name=container)
     if not isinstance(container, Container):
         raise CreateRequestException('first argument must be a Container() instance or a string')
-    limit = parse_int(limit)
-    limit = session.CONTAINER_LIMIT if limit > session.CONTAINER_LIMIT else limit
-    limit = session.CONTAINER_LIMIT if limit < 1 else limit
-    d = Deferred()
-    return_container = Container()
-    def _parse(r):
-        if r.OK:
-            return_container.add_objects(r.json)
-            if len(r.json) == limit:
-                request = ListObjectsRequest(session)
-                request.set_parser(_parse)
-                request.set_container(container)
-                request.set_query_string(('limit', limit))
-                request.set_query_string(('marker', return_container.get_last_object().get_name()))
-                if prefix != None:
-                    request.set_query_string(('prefix', prefix))
-                if path != None:
-                    request.set_query_string(('path', path))
-                if delimiter != None:
-                    request.set_query_string(('delimiter', delimiter))
-                request.run()
-            d.callback((r, return_container))
-        elif r.status_code == 401:
-            d.errback(NotAuthenticatedException('failed to get a list of objects, not authorised'))
-        elif r.status_code == 404:
-            d.errback(NotAuthenticatedException('failed to get a list of objects, container does not exist'))
-        else:
-            d.errback(ResponseException('failed to get a list of objects'))
-    request = ListObjectsRequest(session)
-    request.set_parser(_parse)
-    request.set_container(container)
-    request.set_query_string(('limit', limit))
-    if prefix != None:
-        request.set_query_string(('prefix', parse_str(prefix)))
-    if path != None:
-        request.set_query_string(('path', parse_str(path)))
-    if delimiter != None:
-        request.set_query_string(('delimiter', parse_str(delimiter)[:1]))
-    request.run()
-    return d
+    if split_points and prefixes:
+        raise CreateRequestException('split_points and prefixes cannot be used together')
+    if prefixes:
+        if prefix != None or path != None:
+            raise CreateRequestException('prefixes cannot be used with a prefix or path')
+        shards = [ObjectPager(session, container, limit, p, None, delimiter, None, prefetch) for p in shard_prefixes(prefixes)]
+        return ShardedPager(session, shards, concurrency)
+    if split_points:
+        shards = [ObjectPager(session, container, limit, prefix, path, delimiter, lower, prefetch, upper) for lower, upper in shard_ranges(split_points, marker)]
+        return ShardedPager(session, shards, concurrency)
+    return ObjectPager(session, container, limit, prefix, path, delimiter, marker, prefetch)
 
-def retrieve_object(session, container=None, obj=None):
+def list_all_objects(session, container=None, limit=0, prefix=None, path=None, delimiter=None, prefetch=Pager.PREFETCH, split_points=None, prefixes=None, concurrency=ShardedPager.CONCURRENCY, into=None, snapshot=None):
     '''
-        Retrieves the object, returns a blob of the object data on success.
+        A slower and more elaborate version of list_objects. Pages through
+        containers with large numbers of objects and returns a single (and
+        possibly very large) Container() object once every page has arrived.
+        Pass an Inventory() as into to collect the objects into columns
+        instead. Use list_object_pages() to handle one page at a time.
+
+        If snapshot is a path the listing is also saved there, see
+        cfsnapshot.open_snapshot() to load it again.
+    '''
+    pager = list_object_pages(session, container, limit, prefix, path, delimiter, None, prefetch, split_points, prefixes, concurrency)
+    d = pager.collect(into)
+    if snapshot:
+        def _write(result):
+            r, page = result
+            write_snapshot(snapshot, page, container.get_name() if isinstance(container, Container) else container)
+            return result
+        d.addCallback(_write)
+    return d
+
+def _set_conditions(request, etag=None, modified_since=None):
+    if etag:
+        request.set_header(('If-None-Match', etag))
+    if modified_since:
+        request.set_header(('If-Modified-Since', format_http_date(modified_since)))
+
+def _not_modified(r, obj):
+    return NotModified(obj.get_name(), r.headers.get('Etag', ''), r.headers.get('Last-Modified', ''))
+
+def _cached_response(entry, body):
+    # stands in for the response a content cache entry was stored from
+    headers = {
+        'Etag': entry[0],
+        'Content-Type': entry[3],
+        'Content-Length': str(entry[2]),
+    }
+    return Response(status_code=Response.HTTP_OK, headers=headers, binary_body=body, body_type=Response.FORMAT_BINARY)
+
+def retrieve_object(session, container=None, obj=None, offset=None, length=None, etag=None, modified_since=None):
+    '''
+        Retrieves the object, returns a blob of the object data on success. If
+        an offset or length is supplied only that byte range is retrieved.
+        If an etag or modified_since datetime is supplied the body is only
+        retrieved if the object has changed, otherwise a NotModified() is
+        returned in place of the Object(). Whole objects are taken from the
+        session's prefetcher for the container if it has downloaded them, or
+        served from the session's content cache when it has a copy with the
+        current ETag. A copy served without waiting for a request comes with
+        a 200 Response() built from the cached ETag, content type and length.
     '''
     if type(obj) == str or type(obj) == unicode:
         obj = Object(name=obj)
@@ -199,29 +314,202 @@ def retrieve_object(session, container=None, obj=None):
         container = Container(name=container)
     if not isinstance(container, Container):
         raise CreateRequestException('second argument must be an Object()  instance or a string')
-    d = Deferred()
-    def _parse(r):
-        if r.OK:
+    if _known_missing(session, container, obj):
+        return fail(ResponseException('failed to retrieve object, object does not exist'))
+    ranged = offset != None or length != None
+    conditional = etag or modified_since
+    prefetcher = session.get_prefetcher(container) if not ranged and not conditional else None
+    if prefetcher is not None:
+        prefetched = prefetcher.take(obj)
+        if prefetched is not None:
+            # a failed prefetch is retried as a plain request
+            return prefetched.addErrback(lambda _: retrieve_object(session, container, obj))
+    cache = session.get_content_cache()
+    entry = cache.lookup(container, obj) if cache is not None and not ranged and not conditional else None
+    def _parse(r, d, token, background=False):
+        if r.status_code == r.HTTP_NOT_MODIFIED and entry is not None:
+            cache.revalidated(container, obj)
+            if background:
+                d.callback((r, None))
+            else:
+                _cached(r, d)
+        elif r.status_code == r.HTTP_NOT_MODIFIED:
+            d.callback((r, _not_modified(r, obj)))
+        elif r.OK:
             object_name = r.request._object.get_name()
-            obj = Object(name=object_name)
-            obj.set_remote_hash(r.headers.get('ETag', ''))
-            obj.set_content_type(r.headers.get('Content-Type', ''))
-            obj.set_remote_lenth(r.headers.get('Content-Length', 0))
-            obj.set_data(r.body)
-            d.callback((r, obj))
+            current = Object(name=object_name)
+            current.set_remote_hash(r.headers.get('Etag', ''))
+            current.set_content_type(r.headers.get('Content-Type', ''))
+            current.set_remote_lenth(r.headers.get('Content-Length', 0))
+            current.set_data(r.body)
+            if cache is not None and not ranged and r.headers.get('Etag', ''):
+                cache.store(container, obj, r.headers.get('Etag', ''), r.body, r.headers.get('Content-Type', ''), token)
+            d.callback((r, current))
         elif r.status_code == 401:
-            d.errback(NotAuthenticatedException('failed to delete object, not authorised'))
+            d.errback(NotAuthenticatedException('failed to retrieve object, not authorised'))
         elif r.status_code == 404:
-            d.errback(ResponseException('failed to delete object, object does not exist'))
+            _object_missing(session, container, obj)
+            if entry is not None:
+                cache.discard(container, obj)
+            d.errback(ResponseException('failed to retrieve object, object does not exist'))
+        elif r.status_code == 416:
+            d.errback(ResponseException('failed to retrieve object, range not satisfiable'))
         else:
-            d.errback(ResponseException('failed to delete object'))
-    request = RetrieveObjectRequest(session)
-    request.set_parser(_parse)
-    request.set_container(container)
-    request.set_object(obj)
-    request.run()
+            d.errback(ResponseException('failed to retrieve object'))
+    def _retrieve(d, etag=None, modified_since=None, background=False):
+        token = cache.get_token() if cache is not None else None
+        request = RetrieveObjectRequest(session)
+        request.set_parser(lambda r: _parse(r, d, token, background))
+        request.set_container(container)
+        request.set_object(obj)
+        if ranged:
+            request.set_header(('Range', format_range(offset, length)))
+        _set_conditions(request, etag, modified_since)
+        request.run()
+        return d
+    def _cached(r, d):
+        def _read(body):
+            if body is None:
+                return _retrieve(d)
+            current = Object(name=obj.get_name())
+            current.set_remote_hash(entry[0])
+            current.set_content_type(entry[3])
+            current.set_remote_lenth(entry[2])
+            current.set_data(body)
+            d.callback((r if r is not None else _cached_response(entry, body), current))
+        cache.read(container, obj, entry).addCallback(_read)
+        return d
+    if entry is None:
+        return _retrieve(Deferred(), etag, modified_since)
+    if cache.is_fresh(entry):
+        return _cached(None, Deferred())
+    if cache.is_stale(entry):
+        if cache.begin_revalidation(container, obj):
+            b = _retrieve(Deferred(), entry[0], background=True)
+            b.addCallbacks(lambda _: cache.end_revalidation(container, obj), lambda f: cache.end_revalidation(container, obj, f))
+        return _cached(None, Deferred())
+    # revalidate the cached copy, the body is only sent if it changed
+    return _retrieve(Deferred(), entry[0])
+
+def retrieve_ranges(session, container=None, obj=None, ranges=()):
+    '''
+        Retrieves several (offset, length) byte ranges of an object using as
+        few requests as possible. Returns a list of data blobs in the same
+        order as the ranges on success. Ranges the server did not return as
+        requested are fetched with parallel single range requests.
+    '''
+    if type(container) == str or type(container) == unicode:
+        container = Container(name=container)
+    if not isinstance(container, Container):
+        raise CreateRequestException('first argument must be a Container() instance or a string')
+    if type(obj) == str or type(obj) == unicode:
+        obj = Object(name=obj)
+    if not isinstance(obj, Object):
+        raise CreateRequestException('second argument must be an Object() instance or a string')
+    ranges = [(parse_int(offset), parse_int(length)) for offset, length in ranges]
+    results = [None] * len(ranges)
+    d = Deferred()
+    def _fill(parts, batch):
+        for i in batch:
+            offset, length = ranges[i]
+            for start, data in parts:
+                if start <= offset and start + len(data) >= offset + length:
+                    results[i] = data[offset - start:offset - start + length]
+                    break
+    def _fallback(responses):
+        missing = [i for i, data in enumerate(results) if data is None and ranges[i][1] > 0]
+        for i, data in enumerate(results):
+            if data is None and ranges[i][1] <= 0:
+                results[i] = ''
+        def _got_range(result, i):
+            results[i] = result[1].get_data()
+        fetches = []
+        for i in missing:
+            f = retrieve_object(session, container, obj, ranges[i][0], ranges[i][1])
+            fetches.append(f.addCallback(_got_range, i))
+        return gatherResults(fetches, consumeErrors=True).addCallback(lambda _: (responses[0][0] if responses else None, results))
+    def _batch(batch):
+        b = Deferred()
+        def _parse(r):
+            if r.OK:
+                if isinstance(r.body, list):
+                    parts = r.body
+                elif r.status_code == r.HTTP_PARTIAL_CONTENT:
+                    start, end, total = parse_content_range(r.headers.get('Content-Range', ''))
+                    parts = [(start, r.body)]
+                else:
+                    parts = [(0, r.body)]
+                _fill(parts, batch)
+                b.callback((r, batch))
+            elif r.status_code == 401:
+                b.errback(NotAuthenticatedException('failed to retrieve object ranges, not authorised'))
+            elif r.status_code == 404:
+                b.errback(ResponseException('failed to retrieve object ranges, object does not exist'))
+            else:
+                # unsatisfiable or unsupported multi-range requests fall back
+                # to single range requests
+                b.callback((r, batch))
+        request = RetrieveObjectRangesRequest(session)
+        request.set_parser(_parse)
+        request.set_container(container)
+        request.set_object(obj)
+        request.set_header(('Range', format_ranges([ranges[i] for i in batch])))
+        request.run()
+        return b
+    wanted = [i for i, (offset, length) in enumerate(ranges) if length > 0]
+    batches = [wanted[i:i+session.RANGE_LIMIT] for i in range(0, len(wanted), session.RANGE_LIMIT)]
+    g = gatherResults([_batch(batch) for batch in batches], consumeErrors=True)
+    g.addCallback(_fallback)
+    g.addCallbacks(d.callback, lambda f: d.errback(f.value.subFailure if hasattr(f.value, 'subFailure') else f))
     return d
 
+def _object_created(session, container, obj):
+    bloom = session.get_existence_index(container)
+    if bloom is not None:
+        bloom.add(obj)
+    cache = session.get_metadata_cache()
+    if cache is not None:
+        cache.invalidate_object(container, obj)
+    listings = session.get_listing_cache()
+    if listings is not None:
+        listings.invalidate_name(container, obj)
+    prefetcher = session.get_prefetcher(container)
+    if prefetcher is not None:
+        prefetcher.discard(obj)
+    negative = session.get_negative_cache()
+    if negative is not None:
+        negative.discard(container, obj)
+    content = session.get_content_cache()
+    if content is not None:
+        content.discard(container, obj)
+
+def _object_deleted(session, container, obj):
+    bloom = session.get_existence_index(container)
+    if bloom is not None:
+        bloom.discard(obj)
+    cache = session.get_metadata_cache()
+    if cache is not None:
+        cache.invalidate_object(container, obj)
+    listings = session.get_listing_cache()
+    if listings is not None:
+        listings.invalidate_name(container, obj)
+    prefetcher = session.get_prefetcher(container)
+    if prefetcher is not None:
+        prefetcher.discard(obj)
+    content = session.get_content_cache()
+    if content is not None:
+        content.discard(container, obj)
+    _object_missing(session, container, obj)
+
+def _object_missing(session, container, obj):
+    negative = session.get_negative_cache()
+    if negative is not None:
+        negative.add(container, obj)
+
+def _known_missing(session, container, obj):
+    negative = session.get_negative_cache()
+    return negative is not None and negative.missing(container, obj)
+
 def create_object(session, container=None, obj=None, delete_at=None, metadata={}, cors={}):
     '''
         Create or replace an object into a container and returns a cfobject.Object()
@@ -242,6 +530,7 @@ def create_object(session, container=None, obj=None, delete_at=None, metadata={}
         if r.OK:
             if 'ETag' in r.headers and r.headers.get('ETag', '') != obj.get_hash():
                 d.errback(ResponseException('failed to PUT data, upload hash mismatch (%s != %s)' % (r.headers.get('ETag', ''), obj.get_hash())))
+            _object_created(session, container, obj)
             d.callback((r, obj))
         elif r.status_code == 401:
             d.errback(NotAuthenticatedException('failed to create object, not authorised'))
@@ -272,25 +561,72 @@ def create_object(session, container=None, obj=None, delete_at=None, metadata={}
     request.run()
     return d
 
+def create_manifest(session, container=None, obj=None, segment_container=None, segment_prefix='', metadata={}):
+    '''
+        Creates a large object manifest which joins all the objects in the
+        segment container whose names start with the segment prefix, in name
+        order, into one object. Returns a cfobject.Object() instance on
+        success.
+    '''
+    if type(container) == str or type(container) == unicode:
+        container = Container(name=container)
+    if not isinstance(container, Container):
+        raise CreateRequestException('first argument must be a Container() instance or a string')
+    if type(obj) == str or type(obj) == unicode:
+        obj = Object(name=obj)
+    if not isinstance(obj, Object):
+        raise CreateRequestException('second argument must be an Object() instance or a string')
+    if segment_container == None:
+        segment_container = container
+    if type(segment_container) == str or type(segment_container) == unicode:
+        segment_container = Container(name=segment_container)
+    if not isinstance(segment_container, Container):
+        raise CreateRequestException('segment container must be a Container() instance or a string')
+    d = Deferred()
+    def _parse(r):
+        if r.OK:
+            _object_created(session, container, obj)
+            d.callback((r, obj))
+        elif r.status_code == 401:
+            d.errback(NotAuthenticatedException('failed to create manifest, not authorised'))
+        elif r.status_code == 404:
+            d.errback(ResponseException('failed to create manifest, container does not exist'))
+        else:
+            d.errback(ResponseException('failed to create manifest'))
+    request = CreateManifestRequest(session)
+    request.set_parser(_parse)
+    request.set_container(container)
+    request.set_object(obj)
+    request.set_header(('Content-Length', 0))
+    request.set_header(('X-Object-Manifest', '%s/%s' % (segment_container.get_name(), quote(parse_str(segment_prefix)))))
+    for k, v in metadata.items():
+        request.set_metadata((k, v), Metadata.OBJECT)
+    if obj._content_type:
+        request.set_header(('Content-Type', obj._content_type))
+    request.run()
+    return d
+
 def delete_object(session, container=None, obj=None):
     '''
         Deletes an object and returns boolean True on success.
     '''
     if type(obj) == str or type(obj) == unicode:
         obj = Object(name=obj)
-    if not isinstance(container, Container):
-        raise CreateRequestException('first argument must be a Container() instance or a string')
     if type(container) == str or type(container) == unicode:
         container = Container(name=container)
+    if not isinstance(container, Container):
+        raise CreateRequestException('first argument must be a Container() instance or a string')
     if not isinstance(obj, Object):
         raise CreateRequestException('second argument must be an Object()  instance or a string')
     d = Deferred()
     def _parse(r):
         if r.OK:
+            _object_deleted(session, container, obj)
             d.callback((r, True))
         elif r.status_code == 401:
             d.errback(NotAuthenticatedException('failed to delete object, not authorised'))
         elif r.status_code == 404:
+            _object_deleted(session, container, obj)
             d.errback(ResponseException('failed to delete object, object does not exist'))
         else:
             d.errback(ResponseException('failed to delete object'))
@@ -301,70 +637,162 @@ def delete_object(session, container=None, obj=None):
     request.run()
     return d
 
-def get_object_metadata(session, container=None, obj=None):
+def get_object_metadata(session, container=None, obj=None, etag=None, modified_since=None):
     '''
-        Returns an Object object on success populated with metadata.
+        Returns an Object object on success populated with metadata. If an
+        etag or modified_since datetime is supplied and the object has not
+        changed a NotModified() is returned instead.
     '''
     if type(obj) == str or type(obj) == unicode:
         obj = Object(name=obj)
+    if type(container) == str or type(container) == unicode:
+        container = Container(name=container)
     if not isinstance(container, Container):
         raise CreateRequestException('first argument must be a Container() instance or a string')
+    if not isinstance(obj, Object):
+        raise CreateRequestException('second argument must be an Object()  instance or a string')
+    if _known_missing(session, container, obj):
+        return fail(ResponseException('failed to get object metadata, object does not exist'))
+    cache = session.get_metadata_cache()
+    key = object_key(container, obj)
+    def _fetch(stale):
+        d = Deferred()
+        token = cache.get_token() if cache is not None else None
+        def _parse(r):
+            if r.status_code == r.HTTP_NOT_MODIFIED and stale is not None:
+                cache.set(key, stale, token)
+                d.callback(stale)
+            elif r.status_code == r.HTTP_NOT_MODIFIED:
+                d.callback((r, _not_modified(r, obj)))
+            elif r.OK:
+                object_name = r.request._object.get_name()
+                current = Object(name=object_name)
+                current.set_metadata(r.metadata)
+                if cache is not None:
+                    cache.set(key, (r, current), token)
+                d.callback((r, current))
+            elif r.status_code == 401:
+                d.errback(NotAuthenticatedException('failed to get object metadata, not authorised'))
+            elif r.status_code == 404:
+                _object_missing(session, container, obj)
+                if cache is not None:
+                    cache.invalidate(key)
+                d.errback(ResponseException('failed to get object metadata, object does not exist'))
+            else:
+                d.errback(ResponseException('failed to get object metadata'))
+        request = ObjectMetadataRequest(session)
+        request.set_parser(_parse)
+        request.set_container(container)
+        request.set_object(obj)
+        if stale is not None:
+            _set_conditions(request, stale[0].headers.get('Etag', ''))
+        else:
+            _set_conditions(request, etag, modified_since)
+        request.run()
+        return d
+    if etag or modified_since:
+        return _fetch(None)
+    return read_through(cache, key, _fetch)
+
+def set_object_metadata(session, container=None, obj=None, metadata={}):
+    '''
+        Sets custom arbitrary metadata on an object and returns boolean
+        True on success.
+    '''
+    if type(obj) == str or type(obj) == unicode:
+        obj = Object(name=obj)
     if type(container) == str or type(container) == unicode:
         container = Container(name=container)
+    if not isinstance(container, Container):
+        raise CreateRequestException('first argument must be a Container() instance or a string')
     if not isinstance(obj, Object):
         raise CreateRequestException('second argument must be an Object()  instance or a string')
     d = Deferred()
     def _parse(r):
         if r.OK:
-            object_name = r.request._object.get_name()
-            obj = Object(name=object_name)
-            obj.set_metadata(r.metadata)
-            d.callback((r, obj))
+            cache = session.get_metadata_cache()
+            if cache is not None:
+                cache.invalidate(object_key(container, obj))
+            d.callback((r, True))
         elif r.status_code == 401:
             d.errback(NotAuthenticatedException('failed to set object metadata, not authorised'))
         elif r.status_code == 404:
-            d.errback(NotAuthenticatedException('failed to set object metadata, object does not exist'))
+            d.errback(ResponseException('failed to set object metadata, object does not exist'))
         else:
             d.errback(ResponseException('failed to set object metadata'))
-    request = ObjectMetadataRequest(session)
+    request = UpdateObjectMetadataRequest(session)
     request.set_parser(_parse)
     request.set_container(container)
     request.set_object(obj)
+    for k,v in metadata.items():
+        request.set_metadata((k, v), Metadata.OBJECT)
     request.run()
     return d
 
-def set_object_metadata(session, container=None, obj=None, metadata={}):
+def object_exists(session, container=None, obj=None):
     '''
-        Sets custom arbitrary metadata on an object and returns boolean
-        True on success.
+        Returns boolean True if the object exists. If an existence index is set
+        for the container and it rules the object out, or the negative cache
+        holds a recent 404 for it, False is returned without making a request.
+        Otherwise the object is checked with a HEAD request. The response is
+        None when no request was made.
     '''
     if type(obj) == str or type(obj) == unicode:
         obj = Object(name=obj)
-    if not isinstance(container, Container):
-        raise CreateRequestException('first argument must be a Container() instance or a string')
     if type(container) == str or type(container) == unicode:
         container = Container(name=container)
+    if not isinstance(container, Container):
+        raise CreateRequestException('first argument must be a Container() instance or a string')
     if not isinstance(obj, Object):
         raise CreateRequestException('second argument must be an Object()  instance or a string')
+    bloom = session.get_existence_index(container)
+    if bloom is not None and not bloom.might_contain(obj):
+        return succeed((None, False))
+    if _known_missing(session, container, obj):
+        return succeed((None, False))
     d = Deferred()
     def _parse(r):
         if r.OK:
             d.callback((r, True))
-        elif r.status_code == 401:
-            d.errback(NotAuthenticatedException('failed to set object metadata, not authorised'))
         elif r.status_code == 404:
-            d.errback(ResponseException('failed to set object metadata, object does not exist'))
+            _object_missing(session, container, obj)
+            d.callback((r, False))
+        elif r.status_code == 401:
+            d.errback(NotAuthenticatedException('failed to check object exists, not authorised'))
         else:
-            d.errback(ResponseException('failed to set object metadata'))
-    request = UpdateObjectMetadataRequest(session)
+            d.errback(ResponseException('failed to check object exists'))
+    request = ObjectMetadataRequest(session)
     request.set_parser(_parse)
     request.set_container(container)
     request.set_object(obj)
-    for k,v in metadata.items():
-        request.set_metadata((k, v), Metadata.OBJECT)
     request.run()
     return d
 
+def build_existence_index(session, container=None, error_rate=BloomFilter.ERROR_RATE, growth=2, prefetch=Pager.PREFETCH):
+    '''
+        Pages through the objects in a container into a BloomFilter() sized
+        for growth times the current object count at the given false positive
+        rate, without keeping the listing. The filter is set as the existence
+        index of the container and (response, BloomFilter()) is returned on
+        success. Save it with BloomFilter.save() and restore it later with
+        load_bloom_filter() and session.set_existence_index().
+    '''
+    if type(container) == str or type(container) == unicode:
+        container = Container(name=container)
+    if not isinstance(container, Container):
+        raise CreateRequestException('first argument must be a Container() instance or a string')
+    d = Deferred()
+    def _head(result):
+        r, current = result
+        bloom = BloomFilter(current.get_object_count() * max(growth, 1), error_rate)
+        pager = ObjectPager(session, container, prefetch=prefetch)
+        def _done(_):
+            session.set_existence_index(container, bloom)
+            d.callback((pager.get_last_response(), bloom))
+        pager.each_page(bloom.update).addCallbacks(_done, d.errback)
+    get_container_metadata(session, container).addCallbacks(_head, d.errback)
+    return d
+
 def copy_object(session, container_from, object_from, container_to, object_to):
     '''
         COPY's an Object() from one Container() to another, perserving metadata
@@ -389,6 +817,7 @@ def copy_object(session, container_from, object_from, container_to, object_to):
     d = Deferred()
     def _parse(r):
         if r.OK:
+            _object_created(session, container_to, object_to)
             d.callback((r, True))
         elif r.status_code == 401:
             d.errback(NotAuthenticatedException('failed to set object metadata, not authorised'))
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+    Copyright 2012 Joe Harris
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+'''
+
+'''
+
+    Provides refreshing of listing snapshots against a container.
+
+'''
+
+from random import sample
+from twisted.internet.defer import Deferred, DeferredSemaphore, DeferredList
+from txcloudfiles.errors import CreateRequestException
+from txcloudfiles.helpers import parse_int
+from txcloudfiles.cfcontainer import Container
+from txcloudfiles.cfinventory import Inventory
+from txcloudfiles.cfsnapshot import Snapshot, SnapshotDelta, open_snapshot, write_snapshot
+from txcloudfiles.requests.listing import shard_prefixes
+from txcloudfiles.requests.objects import ObjectPager
+from txcloudfiles.requests.containers import get_container_metadata
+
+def _range_shards(snapshot, shard_size):
+    '''
+        Splits the snapshot into shards of shard_size records, returns a list
+        of (start, end, marker, end_marker) tuples. The last shard has no end
+        marker so it also covers names after the end of the snapshot.
+    '''
+    count = len(snapshot)
+    shards = []
+    for start in xrange(0, max(count, 1), shard_size):
+        end = min(start + shard_size, count)
+        marker = snapshot.get_name_at(start - 1) if start > 0 else None
+        end_marker = snapshot.get_name_at(end - 1) + '\x00' if end < count else None
+        shards.append((start, end, marker, end_marker))
+    return shards
+
+def _prefix_shards(snapshot, prefixes):
+    shards = []
+    for prefix in shard_prefixes(prefixes):
+        shards.append((snapshot.bisect(prefix), snapshot.bisect(prefix + '\xff'), prefix))
+    return shards
+
+def _diff(snapshot, start, end, listing, delta):
+    '''
+        Merges a sorted Inventory() of the current objects in a shard with the
+        snapshot records from start to end and adds the differences to delta.
+    '''
+    i, j = start, 0
+    count = len(listing)
+    while i < end or j < count:
+        local = snapshot.get_name_at(i) if i < end else None
+        remote = listing.get_name_at(j) if j < count else None
+        if remote is None or (local is not None and local < remote):
+            delta.removed.append(local)
+            delta._bytes -= snapshot.get_size_at(i)
+            i += 1
+        elif local is None or remote < local:
+            delta.added.append(listing[j])
+            delta._bytes += listing.get_size_at(j)
+            j += 1
+        else:
+            size, mtime, digest = snapshot._record(i)[2:5]
+            if size != listing.get_size_at(j) or mtime != listing.get_mtime_at(j) or digest != listing.get_digest_at(j):
+                delta.changed.append(listing[j])
+                delta._bytes += listing.get_size_at(j) - size
+            i += 1
+            j += 1
+
+def refresh_snapshot(session, container=None, snapshot=None, shard_size=0, concurrency=4, samples=2, prefixes=None, update=False):
+    '''
+        Compares a snapshot with the container it was taken from and fires
+        with a (response, SnapshotDelta()) tuple of the objects added, removed
+        and changed since. The object count and bytes used of the container
+        decide how much is listed again:
+
+            - if they match the snapshot only samples shards of shard_size
+              objects are listed, if those match too the snapshot is taken to
+              be current and the delta is flagged unchanged
+            - if prefixes are given only those prefixes are listed, which is
+              enough when the churn is known to be confined to them
+            - otherwise, or if the listed shards do not account for the
+              change in count and bytes, every shard is listed with up to
+              concurrency shards at once
+
+        delta.verified is set when the snapshot with the delta applied agrees
+        with the container count and bytes used. If update is set and there
+        are differences the snapshot file is rewritten with them applied.
+    '''
+    if type(container) == str or type(container) == unicode:
+        container = Container(name=container)
+    if not isinstance(container, Container):
+        raise CreateRequestException('first argument must be a Container() instance or a string')
+    if not isinstance(snapshot, Snapshot):
+        snapshot = open_snapshot(snapshot)
+    shard_size = parse_int(shard_size)
+    shard_size = session.OBJECT_LIMIT if shard_size < 1 else shard_size
+    semaphore = DeferredSemaphore(max(parse_int(concurrency), 1))
+    range_shards = _range_shards(snapshot, shard_size)
+    d = Deferred()
+
+    def _list(shard, delta):
+        if len(shard) == 3:
+            start, end, prefix = shard
+            pager = ObjectPager(session, container, prefix=prefix)
+        else:
+            start, end, marker, end_marker = shard
+            pager = ObjectPager(session, container, marker=marker, end_marker=end_marker)
+        def _listed(result):
+            delta._shards += 1
+            delta._requests += pager.get_request_count()
+            _diff(snapshot, start, end, result[1], delta)
+        return pager.collect(Inventory()).addCallback(_listed)
+
+    def _refresh(shards):
+        delta = SnapshotDelta()
+        listings = [semaphore.run(_list, shard, delta) for shard in shards]
+        dl = DeferredList(listings, fireOnOneErrback=True, consumeErrors=True)
+        dl.addCallback(lambda _: delta)
+        dl.addErrback(lambda f: f.value.subFailure)
+        return dl
+
+    def _consistent(delta, count, used):
+        return len(snapshot) + delta.get_count_change() == count and snapshot.get_bytes() + delta.get_bytes_change() == used
+
+    def _done(delta, r):
+        # the container HEAD
+        delta._requests += 1
+        if update and len(delta):
+            write_snapshot(snapshot.get_path(), delta.apply(snapshot), snapshot.get_container_name())
+        d.callback((r, delta))
+
+    def _head(result):
+        r, current = result
+        count, used = current.get_object_count(), parse_int(current.get_bytes().b)
+        matches = count == len(snapshot) and used == snapshot.get_bytes()
+        if prefixes:
+            shards = _prefix_shards(snapshot, prefixes)
+        elif matches:
+            shards = sample(range_shards, min(max(parse_int(samples), 1), len(range_shards)))
+        else:
+            shards = range_shards
+        def _checked(delta):
+            verified = _consistent(delta, count, used)
+            if shards is range_shards or (verified and (prefixes or len(delta) == 0)):
+                delta.verified = verified
+                delta.unchanged = matches and not prefixes and len(delta) == 0
+                return _done(delta, r)
+            return _refresh(range_shards).addCallback(_full, requests=delta.get_request_count())
+        def _full(delta, requests):
+            delta._requests += requests
+            delta.verified = _consistent(delta, count, used)
+            _done(delta, r)
+        _refresh(shards).addCallback(_checked).addErrback(d.errback)
+
+    get_container_metadata(session, container).addCallback(_head).addErrback(d.errback)
+    return d
+
+'''
+
+    EOF
+
+'''
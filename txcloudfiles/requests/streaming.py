@@ -24,10 +24,14 @@
 
 '''
 
-from twisted.internet.defer import Deferred
+from twisted.internet.defer import Deferred, DeferredSemaphore, DeferredList
 from txcloudfiles.transport import Request, Response
 from txcloudfiles.errors import NotAuthenticatedException, ResponseException, CreateRequestException
-from txcloudfiles.helpers import parse_int, parse_str
+from txcloudfiles.helpers import parse_int, parse_str, Metadata
+from txcloudfiles.stream import PipeProtocol, PipeProducer
+from txcloudfiles.cfcontainer import Container
+from txcloudfiles.cfobject import Object
+from txcloudfiles.requests.objects import _object_created
 
 ''' requests '''
 
@@ -50,8 +54,153 @@ class StreamUploadObjectRequest(Request):
     REQUEST_TYPE = Request.REQUEST_STORAGE
     EXPECTED_RESPONSE_CODE = Response.HTTP_SUCCESSFUL
 
+class TransferDownloadRequest(Request):
+    '''
+        Get an object and pipe its body into an upload as it arrives.
+    '''
+    METHOD = Request.GET
+    REQUEST_TYPE = Request.REQUEST_STORAGE
+    EXPECTED_BODY = Request.BINARY
+    EXPECTED_RESPONSE_CODE = Response.HTTP_SUCCESSFUL
+
+    def set_pipe(self, callback):
+        if not hasattr(callback, '__call__'):
+            raise CreateRequestException('set_pipe() must be called with a callback function as the only argument')
+        self._pipe = callback
+
+    def _get_body_protocol(self, d, response, budget):
+        if response.code != Response.HTTP_OK:
+            return Request._get_body_protocol(self, d, response, budget)
+        producer = PipeProducer(response.length)
+        headers, metadata = self._parse_headers(list(response.headers.getAllRawHeaders()))
+        self._pipe(producer, headers, metadata)
+        return PipeProtocol(d, producer)
+
+class TransferUploadRequest(Request):
+    '''
+        Create an object with its body streamed from a TransferDownloadRequest.
+    '''
+    METHOD = Request.PUT
+    REQUIRED_BODY = True
+    REQUEST_TYPE = Request.REQUEST_STORAGE
+    EXPECTED_RESPONSE_CODE = Response.HTTP_SUCCESSFUL
+
 ''' response object wrappers '''
 
+def transfer_object(src_session, src_container=None, obj=None, dst_session=None, dst_container=None, dst_obj=None):
+    '''
+        Copies an object between sessions, possibly on different accounts or
+        regions, by piping the download straight into the upload. Nothing
+        more than a few socket buffers of the body is held in memory and the
+        upload runs at the pace of the slower side. The source ETag is sent
+        with the upload so the destination verifies the body end-to-end.
+        Returns a cfobject.Object() on success.
+    '''
+    if type(src_container) == str or type(src_container) == unicode:
+        src_container = Container(name=src_container)
+    if not isinstance(src_container, Container):
+        raise CreateRequestException('second argument must be a Container() instance or a string')
+    if type(obj) == str or type(obj) == unicode:
+        obj = Object(name=obj)
+    if not isinstance(obj, Object):
+        raise CreateRequestException('third argument must be an Object() instance or a string')
+    if type(dst_container) == str or type(dst_container) == unicode:
+        dst_container = Container(name=dst_container)
+    if not isinstance(dst_container, Container):
+        raise CreateRequestException('fifth argument must be a Container() instance or a string')
+    if dst_obj == None:
+        dst_obj = obj.get_name()
+    if type(dst_obj) == str or type(dst_obj) == unicode:
+        dst_obj = Object(name=dst_obj)
+    if not isinstance(dst_obj, Object):
+        raise CreateRequestException('sixth argument must be an Object() instance or a string')
+    d = Deferred()
+    state = {'download': None, 'upload': None, 'etag': '', 'producer': None}
+    def _fail(e):
+        # abort the other side of the pipe so neither connection is left open
+        if state['producer'] is not None:
+            state['producer'].abort(e)
+        if not d.called:
+            d.errback(e)
+    def _done():
+        if d.called or state['download'] is None or state['upload'] is None:
+            return
+        r, body_hash = state['upload'], state['download']
+        if state['etag'] and state['etag'] != body_hash:
+            _fail(ResponseException('failed to transfer object, source hash mismatch (%s != %s)' % (state['etag'], body_hash)))
+        elif r.headers.get('Etag', body_hash) != body_hash:
+            _fail(ResponseException('failed to transfer object, upload hash mismatch (%s != %s)' % (r.headers.get('Etag', ''), body_hash)))
+        else:
+            dst_obj.set_hash(body_hash)
+            _object_created(dst_session, dst_container, dst_obj)
+            d.callback((r, dst_obj))
+    def _parse_upload(r):
+        if r.OK and r.status_code in Response.HTTP_SUCCESSFUL:
+            state['upload'] = r
+            _done()
+        elif r.status_code == 401:
+            _fail(NotAuthenticatedException('failed to transfer object, not authorised to upload'))
+        elif r.status_code == 404:
+            _fail(ResponseException('failed to transfer object, destination container does not exist'))
+        elif r.status_code == 422:
+            _fail(ResponseException('failed to transfer object, upload hash mismatch'))
+        else:
+            _fail(ResponseException('failed to transfer object, upload failed'))
+    def _pipe(producer, headers, metadata):
+        # manifests and other large objects have a quoted ETag which is not the
+        # md5 of the body
+        etag = headers.get('Etag', '')
+        state['etag'] = etag if etag and not etag.startswith('"') else ''
+        state['producer'] = producer
+        dst_obj.set_stream(producer)
+        dst_obj.set_content_type(headers.get('Content-Type', ''))
+        request = TransferUploadRequest(dst_session)
+        request.set_parser(_parse_upload)
+        request.set_container(dst_container)
+        request.set_object(dst_obj)
+        request.set_stream(producer)
+        if state['etag']:
+            request.set_header(('Etag', state['etag']))
+        if dst_obj.get_content_type():
+            request.set_header(('Content-Type', dst_obj.get_content_type()))
+        for k, v in metadata.items():
+            request.set_metadata((k, v), Metadata.OBJECT)
+        request.run()
+    def _parse_download(r):
+        if r.OK and r.status_code in Response.HTTP_SUCCESSFUL:
+            state['download'] = r.body
+            _done()
+        elif r.status_code == 401:
+            _fail(NotAuthenticatedException('failed to transfer object, not authorised to download'))
+        elif r.status_code == 404:
+            _fail(ResponseException('failed to transfer object, object does not exist'))
+        else:
+            _fail(ResponseException('failed to transfer object, download failed'))
+    request = TransferDownloadRequest(src_session)
+    request.set_parser(_parse_download)
+    request.set_pipe(_pipe)
+    request.set_container(src_container)
+    request.set_object(obj)
+    request.run()
+    return d
+
+def transfer_objects(src_session, src_container=None, objects=(), dst_session=None, dst_container=None, concurrency=4):
+    '''
+        Transfers many objects with transfer_object() with at most concurrency
+        transfers running at once. Returns a list of (name, success, result)
+        tuples in the same order as objects where result is either the
+        transferred cfobject.Object() or the failure.
+    '''
+    semaphore = DeferredSemaphore(max(parse_int(concurrency), 1))
+    names, transfers = [], []
+    for obj in objects:
+        names.append(obj.get_name() if isinstance(obj, Object) else parse_str(obj))
+        t = semaphore.run(transfer_object, src_session, src_container, obj, dst_session, dst_container)
+        transfers.append(t.addCallback(lambda result: result[1]))
+    d = DeferredList(transfers, consumeErrors=True)
+    d.addCallback(lambda results: [(name, ok, result) for name, (ok, result) in zip(names, results)])
+    return d
+
 def stream_upload(session):
     '''
         Creates an object while streaming the body from a source twisted
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+    Copyright 2012 Joe Harris
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+'''
+
+'''
+
+    Provides walking of pseudo-directory trees using delimiter listings.
+
+'''
+
+from collections import deque
+from twisted.internet.defer import Deferred, DeferredLock, succeed, maybeDeferred
+from txcloudfiles.errors import CreateRequestException
+from txcloudfiles.helpers import parse_int, parse_str
+from txcloudfiles.requests.listing import encode_name
+from txcloudfiles.requests.objects import ObjectPager
+from txcloudfiles.cfcontainer import Container
+
+class Walker(object):
+    '''
+        Walks the pseudo-directories of a container breadth-first, like
+        os.walk(). next_dir() returns a deferred which fires with a
+        (dirpath, subdirs, objects) tuple for each directory, or None once
+        the tree is exhausted, where objects is a Container() of the objects
+        directly inside the directory.
+
+        Up to concurrency directories are listed at once and up to ahead
+        directories are listed or held ahead of the consumer. Directories are
+        returned in the order they were requested and the subdirectories of
+        each directory are queued as soon as its listing arrives, so removing
+        entries from subdirs does not prune the walk.
+    '''
+
+    # directories listed at the same time
+    CONCURRENCY = 4
+    # directories listed or held before the consumer asks for them
+    AHEAD = 16
+
+    def __init__(self, session, container, prefix='', delimiter='/', concurrency=CONCURRENCY, ahead=AHEAD):
+        self._session = session
+        self._container = container
+        self._delimiter = parse_str(delimiter)[:1]
+        self._concurrency = max(parse_int(concurrency), 1)
+        self._ahead = max(parse_int(ahead), self._concurrency)
+        self._lock = DeferredLock()
+        self._pending = deque([encode_name(prefix) if prefix else ''])
+        # deferreds of listed and listing directories in the order requested
+        self._results = deque()
+        self._listing = 0
+        self._dirs = 0
+        self._requests = 0
+
+    def __repr__(self):
+        d = (self.__class__.__name__, self._dirs, len(self._pending) + len(self._results), hex(id(self)))
+        return '<CloudFiles %s object (%s directories, %s queued) at %s>' % d
+
+    def _list(self, dirpath):
+        '''
+            Lists a single directory, fires with a (dirpath, subdirs, objects)
+            tuple and queues its subdirectories.
+        '''
+        pager = ObjectPager(self._session, self._container, prefix=dirpath, delimiter=self._delimiter)
+        def _listed(result):
+            r, page = result
+            self._listing -= 1
+            self._requests += pager.get_request_count()
+            subdirs = [encode_name(subdir) for subdir in page.get_subdirs()]
+            self._pending.extend(subdirs)
+            self._fill()
+            return (dirpath, subdirs, page)
+        def _failed(failure):
+            self._listing -= 1
+            self._requests += pager.get_request_count()
+            self._fill()
+            return failure
+        return pager.collect().addCallbacks(_listed, _failed)
+
+    def _fill(self):
+        while self._pending and self._listing < self._concurrency and len(self._results) < self._ahead:
+            self._listing += 1
+            self._results.append(self._list(self._pending.popleft()))
+
+    def _next_dir(self):
+        self._fill()
+        if not self._results:
+            return succeed(None)
+        d = self._results.popleft()
+        self._dirs += 1
+        self._fill()
+        return d
+
+    def next_dir(self):
+        '''
+            Returns a deferred which fires with the next (dirpath, subdirs,
+            objects) tuple or None once every directory has been returned.
+        '''
+        return self._lock.run(self._next_dir)
+
+    def each_dir(self, callback):
+        '''
+            Calls callback with dirpath, subdirs and objects for every
+            remaining directory, waiting for any deferred it returns. Fires
+            with the number of directories walked.
+        '''
+        d = Deferred()
+        def _next(_=None):
+            self.next_dir().addCallbacks(_got, d.errback)
+        def _got(result):
+            if result is None:
+                d.callback(self._dirs)
+            else:
+                maybeDeferred(callback, *result).addCallbacks(_next, d.errback)
+        _next()
+        return d
+
+    def has_more(self):
+        return len(self._pending) > 0 or len(self._results) > 0
+
+    def get_dir_count(self):
+        return self._dirs
+
+    def get_request_count(self):
+        return self._requests
+
+    def get_listing_count(self):
+        '''
+            Directories being listed right now.
+        '''
+        return self._listing
+
+def walk(session, container=None, prefix='', delimiter='/', concurrency=Walker.CONCURRENCY, ahead=Walker.AHEAD):
+    '''
+        Returns a Walker() which lists the pseudo-directory tree below prefix
+        breadth-first, listing up to concurrency directories at once and up
+        to ahead directories before they are asked for.
+    '''
+    if type(container) == str or type(container) == unicode:
+        container = Container(name=container)
+    if not isinstance(container, Container):
+        raise CreateRequestException('first argument must be a Container() instance or a string')
+    if not delimiter:
+        raise CreateRequestException('a delimiter is required to walk a container')
+    return Walker(session, container, prefix, delimiter, concurrency, ahead)
+
+'''
+
+    EOF
+
+'''
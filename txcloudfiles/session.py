@@ -29,7 +29,9 @@
 from time import time
 from urlparse import urlsplit
 from errors import NotAuthenticatedException
-from requests import account, containers, objects, cdn, streaming
+from helpers import parse_url_str
+from requests import account, containers, objects, cdn, streaming, tree, snapshots, bulk
+import prefetch
 
 class Session(object):
     '''
@@ -46,6 +48,12 @@ class Session(object):
     CONTAINER_LIMIT = 10000
     # the maximum objects we can expect to ask for (from API docs)
     OBJECT_LIMIT = 10000
+    # the maximum objects to delete in a single bulk delete (from API docs)
+    BULK_DELETE_LIMIT = 10000
+    # the maximum files to put in a single archive upload
+    BULK_UPLOAD_LIMIT = 10000
+    # the maximum byte ranges to ask for in a single request (swift default)
+    RANGE_LIMIT = 50
     # minimum allowed TTL for CDN containers in seconds (from API docs)
     CDN_TTL_MIN = 900
     # maximum allowed TTL for CDN containers in seconds (from API docs)
@@ -60,6 +68,12 @@ class Session(object):
         self._storage_url_parts = urlsplit(storage_url)
         self._cdn_url_parts = urlsplit(cdn_url)
         self._servicenet = ''
+        self._existence = {}
+        self._prefetchers = {}
+        self._metadata_cache = None
+        self._negative_cache = None
+        self._listing_cache = None
+        self._content_cache = None
     
     def _is_valid(self):
         if self._timer == 0 or not self._key:
@@ -94,6 +108,77 @@ class Session(object):
     def get_cdn_url_parts(self):
         return self._cdn_url_parts
     
+    def _container_name(self, container):
+        # containers store their names quoted
+        return container.get_name() if hasattr(container, 'get_name') else parse_url_str(container)
+    
+    def set_existence_index(self, container, bloom):
+        '''
+            Registers a BloomFilter() of the object names in container. While it
+            is set object_exists() answers definite misses without a request
+            and creates and deletes made through this session update it.
+        '''
+        self._existence[self._container_name(container)] = bloom
+    
+    def get_existence_index(self, container):
+        return self._existence.get(self._container_name(container), None)
+    
+    def remove_existence_index(self, container):
+        return self._existence.pop(self._container_name(container), None)
+    
+    def set_prefetcher(self, container, prefetcher):
+        '''
+            Registers a Prefetcher() for container, retrieve_object() takes the
+            objects it has downloaded from it.
+        '''
+        self._prefetchers[self._container_name(container)] = prefetcher
+    
+    def get_prefetcher(self, container):
+        return self._prefetchers.get(self._container_name(container), None)
+    
+    def remove_prefetcher(self, container):
+        return self._prefetchers.pop(self._container_name(container), None)
+    
+    def set_metadata_cache(self, cache):
+        '''
+            Sets a MetadataCache() to serve repeated metadata requests from, or
+            None to stop caching.
+        '''
+        self._metadata_cache = cache
+    
+    def get_metadata_cache(self):
+        return self._metadata_cache
+    
+    def set_negative_cache(self, cache):
+        '''
+            Sets a NegativeCache() to fail repeated lookups of missing objects
+            without a request, or None to stop caching.
+        '''
+        self._negative_cache = cache
+    
+    def get_negative_cache(self):
+        return self._negative_cache
+    
+    def set_listing_cache(self, cache):
+        '''
+            Sets a ListingCache() for list_objects() to serve repeated listings
+            from, or None to stop caching.
+        '''
+        self._listing_cache = cache
+    
+    def get_listing_cache(self):
+        return self._listing_cache
+    
+    def set_content_cache(self, cache):
+        '''
+            Sets a ContentCache() for retrieve_object() to keep object bodies
+            in, or None to stop caching.
+        '''
+        self._content_cache = cache
+    
+    def get_content_cache(self):
+        return self._content_cache
+    
     ''' account requests '''
     
     get_account_metadata = account.get_account_metadata
@@ -103,6 +188,7 @@ class Session(object):
     
     list_containers = containers.list_containers
     list_all_containers = containers.list_all_containers
+    list_container_pages = containers.list_container_pages
     create_container = containers.create_container
     delete_container = containers.delete_container
     get_container_metadata = containers.get_container_metadata
@@ -116,10 +202,20 @@ class Session(object):
     
     list_objects = objects.list_objects
     list_all_objects = objects.list_all_objects
+    list_object_pages = objects.list_object_pages
+    walk = tree.walk
+    refresh_snapshot = snapshots.refresh_snapshot
     retrieve_object = objects.retrieve_object
+    retrieve_ranges = objects.retrieve_ranges
+    prefetch_objects = prefetch.prefetch_objects
     create_object = objects.create_object
+    create_manifest = objects.create_manifest
+    upload_files = bulk.upload_files
     delete_object = objects.delete_object
+    delete_objects = bulk.delete_objects
     get_object_metadata = objects.get_object_metadata
+    object_exists = objects.object_exists
+    build_existence_index = objects.build_existence_index
     set_object_metadata = objects.set_object_metadata
     copy_object = objects.copy_object
     object_content_type = objects.object_content_type
@@ -137,6 +233,8 @@ class Session(object):
     ''' streaming requests '''
     
     stream_upload = streaming.stream_upload
+    transfer_object = streaming.transfer_object
+    transfer_objects = streaming.transfer_objects
     stream_download = streaming.stream_download
     
 class NullSession(object):
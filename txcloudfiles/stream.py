@@ -25,32 +25,321 @@
 
 '''
 
+import os
+import zlib
+import tarfile
 from zope.interface import implements
-from twisted.internet.defer import succeed
-from twisted.web.iweb import IBodyProducer
+from hashlib import md5
+from json.decoder import JSONDecoder, WHITESPACE
+from twisted.internet.defer import Deferred, succeed, CancelledError
+from twisted.internet.task import cooperate, TaskStopped
+from twisted.web.iweb import IBodyProducer, UNKNOWN_LENGTH
+from twisted.web.client import ResponseDone, PotentialDataLoss
 from twisted.internet.protocol import Protocol
+from txcloudfiles.helpers import parse_content_range
 
 class DownstreamTransportProtocol(Protocol):
     '''
-        Handle downloading/streaming of data from HTTP servers.
+        Handle downloading/streaming of data from HTTP servers. When a memory
+        budget is supplied bodies of a known length pause the transport until
+        the whole body fits in the budget. Bodies of an unknown length hold
+        the budget while it lasts, past that they are still buffered in
+        memory and are not bounded by the budget.
     '''
     
-    def __init__(self, d, streamclient=None):
+    def __init__(self, d, streamclient=None, budget=None, length=UNKNOWN_LENGTH):
         self.d = d
         self.streamclient = streamclient
-        self.buffer = ''
+        self.buffer = []
+        self.budget = budget
+        self.length = length
+        self._held = 0
+        self._pending = None
+        self._exceeded = False
+    
+    def connectionMade(self):
+        if self.streamclient or not self.budget:
+            return
+        if self.length != UNKNOWN_LENGTH and self.length > 0:
+            d = self.budget.reserve(self.length)
+            if not d.called:
+                self.transport.pauseProducing()
+                self._pending = d
+            d.addCallback(self._reserved).addErrback(lambda f: f.trap(CancelledError))
+    
+    def _reserved(self, length):
+        self._held += length
+        if self._pending:
+            self._pending = None
+            self.transport.resumeProducing()
+    
+    def _buffer(self, data):
+        if self.budget and self.length == UNKNOWN_LENGTH and not self._exceeded:
+            if self.budget.try_reserve(len(data)):
+                self._held += len(data)
+            else:
+                self._exceeded = True
+                self.budget.exceeded()
+        self.buffer.append(data)
+    
+    def _release(self):
+        if self._pending:
+            self._pending.cancel()
+            self._pending = None
+        if self.budget and self._held:
+            self.budget.release(self._held)
+        self._held = 0
     
     def dataReceived(self, data):
         if self.streamclient:
             pass
         else:
-            self.buffer += data
+            self._buffer(data)
     
     def connectionLost(self, reason):
         if self.streamclient:
             pass
-        else: 
-            self.d.callback(self.buffer)
+        else:
+            data = ''.join(self.buffer)
+            self.buffer = []
+            self._release()
+            self.d.callback(data)
+
+class ByteRangesProtocol(DownstreamTransportProtocol):
+    '''
+        Parses a multipart/byteranges body as it arrives. Each part is read
+        using the length from its Content-Range header so part bodies are
+        never searched for the boundary. Fires with a list of (offset, data)
+        tuples.
+    '''
+    
+    def __init__(self, d, boundary, budget=None, length=UNKNOWN_LENGTH):
+        DownstreamTransportProtocol.__init__(self, d, None, budget, length)
+        self.parts = []
+        self._data = ''
+        self._part = None
+        self._remaining = 0
+        self._chunks = []
+    
+    def _parse_part_headers(self, head):
+        for line in head.split('\r\n'):
+            k, sep, v = line.partition(':')
+            if sep and k.strip().lower() == 'content-range':
+                start, end, total = parse_content_range(v)
+                if end >= start:
+                    return start, end - start + 1
+        return None
+    
+    def _parse(self):
+        while self._data:
+            if self._part is None:
+                i = self._data.find('\r\n\r\n')
+                if i < 0:
+                    return
+                head, self._data = self._data[:i], self._data[i+4:]
+                part = self._parse_part_headers(head)
+                if part:
+                    self._part = part
+                    self._remaining = part[1]
+                    self._chunks = []
+            else:
+                take = self._data[:self._remaining]
+                self._data = self._data[len(take):]
+                self._chunks.append(take)
+                self._remaining -= len(take)
+                if self._remaining == 0:
+                    self.parts.append((self._part[0], ''.join(self._chunks)))
+                    self._part = None
+                    self._chunks = []
+    
+    def _buffer(self, data):
+        self._data += data
+        self._parse()
+    
+    def connectionLost(self, reason):
+        self._release()
+        self.d.callback(self.parts)
+
+class ListingProtocol(Protocol):
+    '''
+        Decodes a JSON listing body, a list of objects, as it arrives and calls
+        callback with each batch of decoded entries so no more than one
+        partial entry is ever buffered. Fires with an empty list once the whole
+        listing has been decoded or an empty string if the body was truncated
+        or is not a listing.
+    '''
+    
+    # parser states
+    START = 0
+    FIRST = 1
+    ENTRY = 2
+    NEXT = 3
+    DONE = 4
+    FAILED = 5
+    
+    def __init__(self, d, callback):
+        self.d = d
+        self.callback = callback
+        self.count = 0
+        self._data = ''
+        self._state = self.START
+        self._decoder = JSONDecoder()
+    
+    def _parse(self, data):
+        entries = []
+        pos = 0
+        end = len(data)
+        while self._state < self.DONE:
+            pos = WHITESPACE.match(data, pos).end()
+            if pos >= end:
+                break
+            c = data[pos]
+            if self._state == self.START:
+                if c != '[':
+                    self._state = self.FAILED
+                    break
+                self._state = self.FIRST
+                pos += 1
+            elif self._state == self.NEXT or (self._state == self.FIRST and c == ']'):
+                if c == ']':
+                    self._state = self.DONE
+                elif c == ',':
+                    self._state = self.ENTRY
+                else:
+                    self._state = self.FAILED
+                pos += 1
+            else:
+                try:
+                    entry, pos = self._decoder.raw_decode(data, pos)
+                except ValueError:
+                    # most likely an entry split across chunks
+                    break
+                entries.append(entry)
+                self._state = self.NEXT
+        self._data = data[pos:] if self._state < self.DONE else ''
+        if entries:
+            self.count += len(entries)
+            self.callback(entries)
+    
+    def dataReceived(self, data):
+        if self._state < self.DONE:
+            self._parse(self._data + data if self._data else data)
+    
+    def connectionLost(self, reason):
+        self.d.callback([] if self._state == self.DONE else '')
+
+class PipeProtocol(Protocol):
+    '''
+        Receives a response body and writes it straight into a PipeProducer
+        without buffering it. Fires with the md5 of the body once it is
+        complete or with an empty string if the body was cut short.
+    '''
+    
+    def __init__(self, d, producer):
+        self.d = d
+        self.producer = producer
+        self.md5 = md5()
+        self.length = 0
+    
+    def connectionMade(self):
+        self.producer.set_transport(self.transport)
+    
+    def dataReceived(self, data):
+        self.md5.update(data)
+        self.length += len(data)
+        self.producer.write(data)
+    
+    def connectionLost(self, reason):
+        if reason.check(ResponseDone, PotentialDataLoss):
+            self.producer.finish()
+            self.d.callback(self.md5.hexdigest())
+        else:
+            self.producer.finish(reason)
+            self.d.callback('')
+
+class PipeProducer(object):
+    '''
+        Produces the data received by a PipeProtocol as the body of another
+        request. Pause and resume requests from the upload are passed back to
+        the download transport so only a few socket buffers of data are ever
+        held in memory.
+    '''
+    
+    implements(IBodyProducer)
+    
+    def __init__(self, length=UNKNOWN_LENGTH):
+        self.length = length
+        self._transport = None
+        self._consumer = None
+        self._finished = None
+        self._buffer = []
+        self._done = None
+        self._paused = False
+        self._stopped = False
+    
+    def set_transport(self, transport):
+        self._transport = transport
+        if self._consumer is None or self._paused:
+            transport.pauseProducing()
+    
+    def write(self, data):
+        if self._stopped or self._done is not None:
+            return
+        if self._consumer is None:
+            self._buffer.append(data)
+            if self._transport:
+                self._transport.pauseProducing()
+        else:
+            self._consumer.write(data)
+    
+    def finish(self, reason=None):
+        self._done = reason if reason else True
+        if self._finished and not self._stopped:
+            d, self._finished = self._finished, None
+            if reason:
+                d.errback(reason)
+            else:
+                d.callback(None)
+    
+    def startProducing(self, consumer):
+        self._consumer = consumer
+        self._finished = Deferred()
+        d = self._finished
+        for data in self._buffer:
+            consumer.write(data)
+        self._buffer = []
+        if self._done is not None:
+            self.finish(None if self._done is True else self._done)
+        elif self._transport and not self._paused:
+            self._transport.resumeProducing()
+        return d
+    
+    def pauseProducing(self):
+        self._paused = True
+        if self._transport:
+            self._transport.pauseProducing()
+    
+    def resumeProducing(self):
+        self._paused = False
+        if self._transport and self._done is None:
+            self._transport.resumeProducing()
+    
+    def stopProducing(self):
+        self._stopped = True
+        self._buffer = []
+        if self._transport and self._done is None:
+            self._transport.stopProducing()
+    
+    def abort(self, reason):
+        '''
+            Stops the download and fails the upload, whether or not it has
+            started producing yet, when either side of the pipe fails.
+        '''
+        transport = self._transport if self._done is None else None
+        self._buffer = []
+        self.finish(reason)
+        if transport:
+            transport.stopProducing()
 
 class BlockProducer(object):
     '''
@@ -100,6 +389,101 @@ class StreamProducer(object):
         if self._producer is not None:
             self._producer.pauseProducing()
 
+class ArchiveProducer(object):
+    '''
+        Produces a tar archive of local files as it is sent, optionally gzip
+        compressed, so only a single read buffer of the archive is held in
+        memory. files is a list of (local path, name in archive) tuples. The
+        length of an uncompressed archive is known up front, compressed
+        archives are sent chunked.
+    '''
+    
+    implements(IBodyProducer)
+    
+    # bytes read from each file at a time
+    READ_SIZE = 65536
+    
+    def __init__(self, files, compress=False):
+        self.files = []
+        for path, name in files:
+            info = tarfile.TarInfo(name.encode('utf-8') if type(name) == unicode else name)
+            stat = os.stat(path)
+            info.size = stat.st_size
+            info.mtime = int(stat.st_mtime)
+            info.mode = 0644
+            self.files.append((path, info.tobuf(), info.size))
+        self.compress = compress
+        if compress:
+            self.length = UNKNOWN_LENGTH
+        else:
+            self.length = sum(len(header) + size + self._padding(size) for path, header, size in self.files) + 2 * tarfile.BLOCKSIZE
+        self._task = None
+    
+    def _padding(self, size):
+        return -size % tarfile.BLOCKSIZE
+    
+    def _archive(self):
+        for path, header, size in self.files:
+            yield header
+            f = open(path, 'rb')
+            try:
+                remaining = size
+                while remaining > 0:
+                    data = f.read(min(self.READ_SIZE, remaining))
+                    if not data:
+                        raise IOError('%s is shorter than when the archive was started' % path)
+                    remaining -= len(data)
+                    yield data
+            finally:
+                f.close()
+            yield tarfile.NUL * self._padding(size)
+        yield tarfile.NUL * 2 * tarfile.BLOCKSIZE
+    
+    def _chunks(self):
+        if not self.compress:
+            return self._archive()
+        return self._compressed()
+    
+    def _compressed(self):
+        # a wbits of 31 writes a gzip header and trailer
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for data in self._archive():
+            data = compressor.compress(data)
+            if data:
+                yield data
+        yield compressor.flush()
+    
+    def _write(self, consumer):
+        for data in self._chunks():
+            if data:
+                consumer.write(data)
+                yield None
+    
+    def startProducing(self, consumer):
+        self._task = cooperate(self._write(consumer))
+        d = self._task.whenDone()
+        def _stopped(reason):
+            if reason.check(TaskStopped):
+                # the request has been abandoned
+                return Deferred()
+            return reason
+        return d.addCallbacks(lambda _: None, _stopped)
+    
+    def pauseProducing(self):
+        if self._task is not None:
+            self._task.pause()
+    
+    def resumeProducing(self):
+        if self._task is not None:
+            self._task.resume()
+    
+    def stopProducing(self):
+        if self._task is not None:
+            try:
+                self._task.stop()
+            except TaskStopped:
+                pass
+
 '''
 
     EOF
@@ -29,11 +29,12 @@ import json
 from urllib import urlencode
 from urlparse import urlsplit, urlunsplit
 from twisted.internet import reactor
-from twisted.internet.defer import Deferred
+from twisted.internet.defer import Deferred, succeed
 from twisted.web.client import HTTPClientFactory
 from twisted.python.failure import Failure
 from txcloudfiles import __version__
-from txcloudfiles.stream import DownstreamTransportProtocol, BlockProducer, StreamProducer
+from txcloudfiles.stream import DownstreamTransportProtocol, ListingProtocol, BlockProducer, StreamProducer
+from txcloudfiles.budget import get_memory_budget
 from txcloudfiles.validation import RequestBase, ResponseBase
 from txcloudfiles.helpers import parse_int, parse_str, Metadata
 
@@ -81,6 +82,8 @@ class Request(RequestBase):
         self._query_string = {}
         self._body = None
         self._stream = None
+        self._body_callback = None
+        self._entry_callback = None
         self._container = None
         self._object = None
 
@@ -118,6 +121,8 @@ class Request(RequestBase):
         expected_body = self._get_expected_body()
         if expected_body == self.FORMAT_BINARY:
             binary_data, json_data = data, {}
+        elif expected_body == self.FORMAT_JSON and type(data) == list:
+            binary_data, json_data = '', data
         elif expected_body == self.FORMAT_JSON:
             try:
                 binary_data, json_data = '', json.loads(data)
@@ -125,6 +130,16 @@ class Request(RequestBase):
                 binary_data, json_data = '', {}
         return binary_data, json_data
 
+    def _get_body_protocol(self, d, response, budget):
+        '''
+            Returns the protocol which receives the response body, operations
+            can override this to parse bodies as they arrive.
+        '''
+        if self._entry_callback and self._get_expected_body() == self.FORMAT_JSON and response.code in Response.HTTP_SUCCESSFUL:
+            return ListingProtocol(d, self._entry_callback)
+        stream = self._object.get_stream() if self._object else None
+        return DownstreamTransportProtocol(d, stream, budget, response.length)
+
     def _parse_headers(self, headers):
         r = {}
         if type(headers) != list:
@@ -144,7 +159,7 @@ class Request(RequestBase):
         for header in self._get_expected_headers():
             if header not in headers:
                 return status_code, 0
-        if self._get_expected_body() == self.FORMAT_BINARY and not binary_data and status_code != 204:
+        if self._get_expected_body() == self.FORMAT_BINARY and not binary_data and status_code not in (Response.HTTP_NO_CONTENT, Response.HTTP_NOT_MODIFIED):
             return status_code, 0
         if self._get_expected_body() == self.FORMAT_JSON and type(json_data) != list and type(json_data) != dict and status_code != 204:
             return status_code, 0
@@ -162,15 +177,26 @@ class Request(RequestBase):
                 protocol to return, otherwise fire the callback immediately.
             '''
             #print getattr(response, 'printTraceback', str)()
-            if self._get_expected_body():
+            if upload_length:
+                budget.release(upload_length)
+            if self._get_expected_body() and not isinstance(response, Failure):
                 d = Deferred()
+                if self._body_callback:
+                    d.addCallback(_got_body, response)
                 d.addCallback(_got_data, response).addErrback(_got_data, response)
-                stream = self._object.get_stream() if self._object else None
-                response.deliverBody(DownstreamTransportProtocol(d, stream))
+                response.deliverBody(self._get_body_protocol(d, response, budget))
                 return d
             else:
                 _got_data('', response)
 
+        def _got_body(data, response):
+            '''
+                Lets the operation see the raw body before it is parsed.
+            '''
+            if response.code in Response.HTTP_SUCCESSFUL:
+                self._body_callback(data)
+            return data
+
         def _got_data(data, response):
             '''
                 Check the response for failure. Note twisted raises a 'Failure'
@@ -204,20 +230,41 @@ class Request(RequestBase):
         request_headers['User-Agent'] = [USER_AGENT]
         url = self._get_request_url()
         producer = None
-        if self._get_required_body() and self._object:
-            producer = self._object.get_stream() if self._object.is_stream() else BlockProducer(self._body)
+        upload_length = 0
+        if self._get_required_body():
+            if self._object and self._object.is_stream():
+                producer = self._object.get_stream()
+            elif self._stream is not None:
+                producer = self._stream
+            else:
+                producer = BlockProducer(self._body)
+                upload_length = producer.length
         context = SSLContextFactory()
         if hasattr(context, 'set_expected_host'):
             context.set_expected_host(url)
-        agent = Agent(reactor, context)
-        d = agent.request(
-            self._get_request_method(),
-            url,
-            Headers(request_headers),
-            producer
-        )
-        d.addCallback(_got_response)
-        d.addErrback(_got_response)
+        budget = get_memory_budget()
+
+        def _send_request(reserved):
+            '''
+                Non-streaming bodies are held in memory for the length of the
+                upload so wait for them to fit in the memory budget first.
+            '''
+            agent = Agent(reactor, context)
+            d = agent.request(
+                self._get_request_method(),
+                url,
+                Headers(request_headers),
+                producer
+            )
+            d.addCallback(_got_response)
+            d.addErrback(_got_response)
+
+        if upload_length:
+            d = budget.reserve(upload_length)
+        else:
+            # nothing is held in memory, don't queue behind waiting uploads
+            d = succeed(0)
+        d.addCallback(_send_request).addErrback(_got_response)
 
     def run(self):
         '''
@@ -163,6 +163,10 @@ class HTTPResponseMixin(object):
         HTTP_USE_PROXY,
         HTTP_TEMPORARY_REDIRECT,
     )
+    # conditional requests succeed with a 304 if nothing has changed
+    HTTP_CONDITIONAL = HTTP_SUCCESSFUL + (
+        HTTP_NOT_MODIFIED,
+    )
     HTTP_CLIENT_ERROR = (
         HTTP_BAD_REQUEST,
         HTTP_UNAUTHORIZED,
@@ -199,6 +203,7 @@ class HTTPResponseMixin(object):
         HTTP_REDIRECTION,
         HTTP_CLIENT_ERROR,
         HTTP_SERVER_ERROR,
+        HTTP_CONDITIONAL,
     )
 
 class GetValidationMixin(object):
@@ -336,6 +341,16 @@ class SetValidationMixin(object):
     
     def set_stream(self, stream):
         self._stream = stream
+    
+    def set_body_callback(self, callback):
+        if not hasattr(callback, '__call__'):
+            raise OperationConfigException('set_body_callback() must be called with a callback function as the only argument')
+        self._body_callback = callback
+    
+    def set_entry_callback(self, callback):
+        if not hasattr(callback, '__call__'):
+            raise OperationConfigException('set_entry_callback() must be called with a callback function as the only argument')
+        self._entry_callback = callback
 
 class RequestValidationMixin(object):
     '''
@@ -357,8 +372,8 @@ class RequestValidationMixin(object):
         # check post data is set for POST requests
         if self._get_required_post() and len(self._request_post) == 0:
             raise CreateRequestException('required post data is missing for request')
-        # check if a required body is set
-        if self._get_required_body() and not self._body:
+        # check if a required body is set, an empty body is still a body
+        if self._get_required_body() and self._body is None and not self._stream:
             raise CreateRequestException('required body is missing for request')
 
 class RequestBase(GetValidationMixin, SetValidationMixin, RequestValidationMixin, DataFormatMixin, HTTPMethodMixin):